@@ -3,162 +3,128 @@ import os
 import json
 import asyncio
 import shutil
-import re
-from typing import Set, List, Tuple, Any  # Добавлен Any
+import time
+from typing import List, Tuple, Optional, Dict
 # Импорты для Telegram API
-from telegram import Bot, InputMediaPhoto, InputMediaVideo
-# Импорты для B2 SDK и обработки ошибок
-import b2sdk.v2
+from telegram import InputMediaPhoto, InputMediaVideo
+# Импорты для обработки ошибок B2 SDK
 from b2sdk.v2.exception import FileNotPresent, B2Error
+# Параллельное скачивание файлов группы
+from b2_download import (fetch_group_files, fetch_group_bundle, GroupFetchError, B2_DOWNLOAD_WORKERS, B2_DISKLESS,
+                         new_spool)
+# Ленивые клиенты: импорт модуля не ходит в сеть и не требует учетных данных
+from clients import get_bucket, get_bot, require_env
+# Общий слой лимитов Telegram (ведра токенов, RetryAfter, повторы)
+from telegram_limiter import get_rate_limiter
+# Локальный кэш медиа по SHA-1/id файла: повторные попытки не скачивают группу заново
+from media_cache import MediaCache, cache_key
+# Пошаговое состояние публикаций (SQLite + копия в B2)
+from publish_state import (PublishState, message_ids, NO_CHAT, STEP_DOWNLOADED, STEP_ALBUM, STEP_SARCASM,
+                           STEP_POLL)
+# Кэш Telegram file_id по SHA-1 содержимого
+from file_id_cache import FileIdCache, file_sha1, send_with_file_ids
+# Потоковая загрузка больших видео с ограниченной памятью
+from telegram_upload import needs_streaming, send_media_group_streaming
+# Журнал опубликованных ID и их компактное множество
+import published_journal
+from gen_id_set import GenIdSet
+# Манифесты групп по листингу бакета
+from b2_scan import (scan_folders, GroupManifest, SARCASM_SUFFIX, POST_SUFFIX, SCAN_FOLDERS, SCAN_CONCURRENCY,
+                     load_scan_cursor, save_scan_cursor, advance_cursor)
+# Нормализованная запись поста (подпись, хештеги, опрос) — общая для всех публикаторов
+from post_record import normalize_post, fetch_post_record
+# moov в начало MP4 и параметры видео для Telegram
+from mp4_faststart import Mp4Error, make_faststart, remux_faststart, video_send_kwargs
+# Уменьшение и пережатие больших PNG перед загрузкой (Pillow, пул процессов)
+from image_optimizer import ImageOptimizer, image_optimizer_enabled
 
 # ------------------------------------------------------------
 # 1) Считываем переменные окружения
 # ------------------------------------------------------------
-S3_KEY_ID = os.getenv("S3_KEY_ID")
-S3_APPLICATION_KEY = os.getenv("S3_APPLICATION_KEY")
+# Ключи B2 (S3_KEY_ID, S3_APPLICATION_KEY, S3_ENDPOINT) и TELEGRAM_TOKEN читает clients.py
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-S3_ENDPOINT = os.getenv("S3_ENDPOINT", "production")  # По умолчанию 'production', можно переопределить
 
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# Несколько каналов можно указать через запятую: первый — основной, остальные — зеркала
+TELEGRAM_CHAT_IDS = [chat.strip() for chat in (TELEGRAM_CHAT_ID or "").split(",") if chat.strip()]
 
-# Определяем суффикс сарказма (пока хардкод, т.к. нет ConfigManager)
-SARCASM_SUFFIX = "_sarcasm.png"
-
-# Проверяем наличие всех необходимых переменных
-if not all([
-    S3_KEY_ID,
-    S3_APPLICATION_KEY,
-    S3_BUCKET_NAME,
-    TELEGRAM_TOKEN,
-    TELEGRAM_CHAT_ID
-]):
-    raise RuntimeError("❌ Ошибка: Не установлены все необходимые переменные окружения!")
-else:
-    print("✅ Все необходимые переменные окружения загружены.")
+# Пакетный режим: сколько групп публиковать за запуск и бюджет времени (0 — без ограничения)
+PUBLISH_MAX_GROUPS = int(os.getenv("PUBLISH_MAX_GROUPS", "1"))
+PUBLISH_TIME_BUDGET_SECONDS = float(os.getenv("PUBLISH_TIME_BUDGET_SECONDS", "0"))
+
+# Обязательные переменные проверяются в main(), а не при импорте
+REQUIRED_ENV = ["S3_KEY_ID", "S3_APPLICATION_KEY", "S3_BUCKET_NAME", "TELEGRAM_TOKEN", "TELEGRAM_CHAT_ID"]
 
 # ------------------------------------------------------------
-# 2) Настраиваем пути, объект Telegram-бота и B2 SDK
+# 2) Настраиваем пути и общие объекты (клиенты B2 и Telegram — лениво, см. clients.py)
 # ------------------------------------------------------------
 BASE_DIR = os.path.dirname(__file__)
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "downloaded")
 PROCESSED_DIR = os.path.join(DOWNLOAD_DIR, "processed")
 ERROR_DIR = os.path.join(DOWNLOAD_DIR, "errors")
 
-# Инициализация Telegram бота
-try:
-    bot = Bot(token=TELEGRAM_TOKEN)
-    print("✅ Telegram бот инициализирован.")
-except Exception as e:
-    raise RuntimeError(f"❌ Ошибка инициализации Telegram бота: {e}")
-
-# Инициализация B2 API
-try:
-    print("⚙️ Подключаемся к Backblaze B2...")
-    info = b2sdk.v2.InMemoryAccountInfo()
-    b2_api = b2sdk.v2.B2Api(info)
-    b2_api.authorize_account(S3_ENDPOINT, S3_KEY_ID, S3_APPLICATION_KEY)
-    bucket = b2_api.get_bucket_by_name(S3_BUCKET_NAME)
-    print(f"✅ Успешное подключение к B2 бакету: {S3_BUCKET_NAME}")
-except Exception as e:
-    raise RuntimeError(f"❌ Ошибка подключения к B2: {e}")
+# Общий лимитер отправок: лимиты выдерживаются между всеми группами запуска
+limiter = get_rate_limiter()
+# Кэш file_id: повторная отправка того же файла не загружает его байты заново
+file_id_cache = FileIdCache()
+# Кэш медиа живет вне DOWNLOAD_DIR, который очищается в начале запуска
+media_cache = MediaCache()
+# Выполненные шаги публикаций: повторный запуск продолжает с прерванного места
+publish_state = PublishState()
+# Сжатые картинки кэшируются по SHA-1 исходника
+image_optimizer = ImageOptimizer()
 
 
 # ------------------------------------------------------------
-# Работа с config_public.json (отслеживание опубликованных)
+# Работа с журналом опубликованных ID (снимок config_public.json + дельты)
 # ------------------------------------------------------------
-def load_published_ids() -> Set[str]:
+def load_published_ids() -> GenIdSet:
     """
-    Загружает список ID уже опубликованных постов из config/config_public.json в B2.
-    Возвращает set с ID. Если файл не найден или поврежден, возвращает пустой set.
+    Загружает ID уже опубликованных постов: снимок config/config_public.json
+    и дельты журнала config/published/. При ошибках возвращает то, что удалось прочитать.
     """
-    local_config_path = os.path.join(DOWNLOAD_DIR, "config_public.json")
-    config_key = "config/config_public.json"
-    published_ids = set()
-    try:
-        print(f"📥 Пытаемся скачать {config_key} для получения списка опубликованных ID...")
-        os.makedirs(os.path.dirname(local_config_path), exist_ok=True)
-        bucket.download_file_by_name(config_key).save_to(local_config_path)
-        with open(local_config_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        published = data.get("generation_id", [])
-        if isinstance(published, list):
-            published_ids = set(published)
-            print(f"ℹ️ Загружено {len(published_ids)} опубликованных ID из {config_key}.")
-        else:
-            print(f"⚠️ Поле 'generation_id' в {config_key} не является списком. Используем пустой список.")
-        if os.path.exists(local_config_path):
-            os.remove(local_config_path)
-    except FileNotPresent:
-        print(f"⚠️ Файл {config_key} не найден в B2. Будет создан новый при первой успешной публикации.")
-    except json.JSONDecodeError as e:
-        print(f"⚠️ Ошибка декодирования JSON в файле {config_key}: {e}. Используем пустой список.")
-        if os.path.exists(local_config_path): os.remove(local_config_path)
-    except B2Error as e:
-        print(f"⚠️ Ошибка B2 SDK при скачивании {config_key}: {e}. Используем пустой список.")
-        if os.path.exists(local_config_path): os.remove(local_config_path)
-    except Exception as e:
-        print(f"⚠️ Не удалось загрузить или прочитать {config_key}: {e}. Используем пустой список.")
-        if os.path.exists(local_config_path): os.remove(local_config_path)
-    return published_ids
+    print("📥 Загружаем журнал опубликованных ID...")
+    return published_journal.load_published_ids(get_bucket())
 
 
-def save_published_ids(pub_ids: Set[str]):
+def save_published_id(gen_id: str):
     """
-    Сохраняет обновленный список опубликованных ID в config_public.json локально
-    и загружает его обратно в B2.
+    Фиксирует публикацию одного gen_id: пишет в B2 одну маленькую дельту журнала
+    вместо перезаписи всего config_public.json.
     """
-    local_config_path = os.path.join(DOWNLOAD_DIR, "config_public.json")
-    config_key = "config/config_public.json"
-    try:
-        data = {"generation_id": sorted(list(pub_ids))}
-        os.makedirs(os.path.dirname(local_config_path), exist_ok=True)
-        with open(local_config_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        print(f"💾 Локально сохранен обновленный список ID в {local_config_path}")
-        print(f"📤 Загружаем обновленный {config_key} в B2...")
-        bucket.upload_local_file(local_config_path, config_key)
-        print(f"✅ Успешно обновлен {config_key} в B2. Всего ID: {len(pub_ids)}")
-        if os.path.exists(local_config_path):
-            os.remove(local_config_path)
-    except Exception as e:
-        print(f"⚠️ Не удалось сохранить или загрузить {config_key}: {e}")
-        if os.path.exists(local_config_path):
-            try:
-                os.remove(local_config_path)
-            except Exception as rm_err:
-                print(f"  ⚠️ Не удалось удалить временный файл {local_config_path}: {rm_err}")
+    published_journal.record_published_id(get_bucket(), gen_id)
 
 
 # ------------------------------------------------------------
-# 3) Удаляем системные слова и сжимаем пустые строки
+# 3) Публикация одного generation_id
 # ------------------------------------------------------------
-def remove_system_phrases(text: str) -> str:
-    """
-    Очищает текст от стандартных заголовков и заменяет множественные переводы строк.
-    """
-    if not isinstance(text, str):
-        return ""
-    system_phrases = [
-        "Вступление:", "Основная часть:", "Интересный факт:", "Заключение:",
-        "🔥Вступление", "📚Основная часть", "🔍Интересный факт"
-    ]
-    clean_text = text
-    for phrase in system_phrases:
-        clean_text = re.sub(r'^\s*' + re.escape(phrase) + r'\s*\n?', '', clean_text,
-                            flags=re.IGNORECASE | re.MULTILINE).strip()
-        clean_text = re.sub(r'\n\s*' + re.escape(phrase) + r'\s*', '\n', clean_text, flags=re.IGNORECASE).strip()
-    clean_text = re.sub(r"\n\s*\n+", "\n\n", clean_text)
-    return clean_text.strip()
+def _content_sha1(manifest: Optional[GroupManifest], suffix: str, source) -> Optional[str]:
+    """SHA-1 файла группы: из листинга B2, а если его нет — по локальной копии или буферу."""
+    entry = manifest.files.get(suffix) if manifest is not None else None
+    if entry is not None and entry.content_sha1:
+        return entry.content_sha1
+    try:
+        return file_sha1(source)
+    except OSError:
+        return None
 
 
-# ------------------------------------------------------------
-# 4) Публикация одного generation_id
-# ------------------------------------------------------------
-async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str]) -> bool:
+async def publish_generation_id(gen_id: str, folder: str, published_ids: GenIdSet,
+                                manifest: Optional[GroupManifest] = None,
+                                chat_ids: Optional[List[str]] = None) -> bool:
     """
     Скачивает, обрабатывает и публикует контент для одного generation_id.
+    Если передан manifest из листинга, файлы скачиваются от большего к меньшему.
+    chat_ids — целевые чаты (по умолчанию TELEGRAM_CHAT_IDS); медиа загружается
+    один раз в первый чат, в остальные рассылаются полученные file_id.
+    Успех публикации определяется первым чатом, сбои зеркал только логируются.
+    При B2_DISKLESS файлы не пишутся в DOWNLOAD_DIR: скачанные буферы
+    сразу передаются в Telegram.
+    Каждый отправленный шаг фиксируется в publish_state, поэтому после
+    частичного сбоя уже отправленное не скачивается и не отправляется повторно.
     """
+    target_chats = list(chat_ids or TELEGRAM_CHAT_IDS)
+    bucket, bot = get_bucket(), get_bot()
     print(f"⚙️ Обрабатываем gen_id: {gen_id} из папки {folder}")
     json_file_key = f"{folder}{gen_id}.json"
     video_file_key = f"{folder}{gen_id}.mp4"
@@ -170,12 +136,16 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
     local_png_path = os.path.join(DOWNLOAD_DIR, f"{gen_id}.png")
     local_sarcasm_png_path = os.path.join(DOWNLOAD_DIR, f"{gen_id}{SARCASM_SUFFIX}")
 
-    json_downloaded = False
-    video_downloaded = False
-    png_downloaded = False
-    sarcasm_png_downloaded = False
     local_files_to_clean = [local_json_path, local_video_path, local_png_path, local_sarcasm_png_path]
 
+    # Источники для отправки: локальные пути или, в бездисковом режиме, буферы в памяти
+    json_source, video_source, png_source, sarcasm_source = (
+        local_json_path, local_video_path, local_png_path, local_sarcasm_png_path)
+    spooled_files = []
+    if B2_DISKLESS:
+        spooled_files = [new_spool() for _ in range(4)]
+        json_source, video_source, png_source, sarcasm_source = spooled_files
+
     def cleanup_local_files():
         for file_path in local_files_to_clean:
             if os.path.exists(file_path):
@@ -183,47 +153,65 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
                     os.remove(file_path)
                 except Exception as e:
                     print(f"  ⚠️ Не удалось удалить временный файл {file_path}: {e}")
-
+        for spool in spooled_files:
+            spool.close()
+
+    # Видео идет первым: оно самое тяжелое, остальные файлы скачаются параллельно с ним
+    group_files = [
+        (video_file_key, video_source),
+        (json_file_key, json_source),
+        (png_file_key, png_source),
+        (sarcasm_png_file_key, sarcasm_source),
+    ]
+    # Шаги, выполненные в прошлых запусках: медиа уже отправленных шагов не скачиваются
+    done_steps = publish_state.steps(gen_id)
+    if done_steps:
+        print(f"⏯️ Продолжаем публикацию {gen_id}: уже выполнено {sorted(step for _chat, step in done_steps)}")
+    skipped_keys = set()
+    # Готовая запись поста заменяет разбор JSON группы, сам JSON тогда не скачивается
+    post_record = None
+    post_entry = manifest.files.get(POST_SUFFIX) if manifest is not None else None
+    if post_entry is not None:
+        post_record = await asyncio.to_thread(fetch_post_record, bucket, post_entry.file_name)
+    if post_record is not None:
+        skipped_keys.add(json_file_key)
+    if all((str(chat), STEP_ALBUM) in done_steps for chat in target_chats):
+        skipped_keys.update((png_file_key, video_file_key))
+    if all((str(chat), STEP_SARCASM) in done_steps for chat in target_chats):
+        skipped_keys.add(sarcasm_png_file_key)
+    group_files = [item for item in group_files if item[0] not in skipped_keys]
+
+    cache_entries = {}
+    sizes = {}
+    if manifest is not None:
+        sizes = {entry.file_name: entry.size for entry in manifest.files.values()}
+        group_files.sort(key=lambda item: sizes.get(item[0], 0), reverse=True)
+        for entry in manifest.files.values():
+            key = cache_key(entry.content_sha1, entry.file_id)
+            if key:
+                cache_entries[entry.file_name] = (key, entry.content_sha1)
     try:
-        print(f"📥 Скачиваем JSON: {json_file_key} -> {local_json_path}")
-        os.makedirs(os.path.dirname(local_json_path), exist_ok=True)
-        bucket.download_file_by_name(json_file_key).save_to(local_json_path)
-        json_downloaded = True
-        print(f"✅ JSON скачан: {local_json_path}")
-
-        print(f"📥 Пытаемся скачать PNG: {png_file_key} -> {local_png_path}")
-        os.makedirs(os.path.dirname(local_png_path), exist_ok=True)
-        bucket.download_file_by_name(png_file_key).save_to(local_png_path)
-        png_downloaded = True
-        print(f"✅ PNG скачан: {local_png_path}")
-
-        print(f"📥 Пытаемся скачать видео: {video_file_key} -> {local_video_path}")
-        os.makedirs(os.path.dirname(local_video_path), exist_ok=True)
-        bucket.download_file_by_name(video_file_key).save_to(local_video_path)
-        video_downloaded = True
-        print(f"✅ Видео скачано: {local_video_path}")
-
-        print(f"📥 Пытаемся скачать Sarcasm PNG: {sarcasm_png_file_key} -> {local_sarcasm_png_path}")
-        os.makedirs(os.path.dirname(local_sarcasm_png_path), exist_ok=True)
-        bucket.download_file_by_name(sarcasm_png_file_key).save_to(local_sarcasm_png_path)
-        sarcasm_png_downloaded = True
-        print(f"✅ Sarcasm PNG скачан: {local_sarcasm_png_path}")
-
-    except FileNotPresent:
-        missing_file_key = ""
-        if not json_downloaded:
-            missing_file_key = json_file_key
-        elif not png_downloaded:
-            missing_file_key = png_file_key
-        elif not video_downloaded:
-            missing_file_key = video_file_key
-        elif not sarcasm_png_downloaded:
-            missing_file_key = sarcasm_png_file_key
-        print(f"❌ Группа {gen_id} неполная ({missing_file_key} отсутствует). Публикация пропускается.")
-        cleanup_local_files()
-        return False
-    except B2Error as e:
-        print(f"⚠️ Ошибка B2 SDK при скачивании файлов для {gen_id}: {e}")
+        if manifest is not None and manifest.bundle is not None:
+            # Вся группа в одном объекте: один запрос (или диапазоны нужных файлов)
+            suffix_by_key = {json_file_key: ".json", video_file_key: ".mp4", png_file_key: ".png",
+                             sarcasm_png_file_key: SARCASM_SUFFIX}
+            bundle_targets = {suffix_by_key[file_key]: target for file_key, target in group_files}
+            print(f"📦 Получаем {len(bundle_targets)} файла группы {gen_id} из бандла {manifest.bundle.file_name}...")
+            await fetch_group_bundle(bucket, manifest.bundle.file_name, bundle_targets,
+                                     cache=None if B2_DISKLESS else media_cache,
+                                     bundle_cache_key=cache_key(manifest.bundle.content_sha1, manifest.bundle.file_id))
+        else:
+            print(f"📥 Скачиваем {len(group_files)} файла группы {gen_id} параллельно (потоков: {B2_DOWNLOAD_WORKERS}"
+                  f"{', в память' if B2_DISKLESS else ''})...")
+            await fetch_group_files(bucket, group_files, max_workers=B2_DOWNLOAD_WORKERS,
+                                    cache=media_cache, cache_entries=cache_entries, sizes=sizes)
+    except GroupFetchError as e:
+        if isinstance(e.cause, FileNotPresent):
+            print(f"❌ Группа {gen_id} неполная ({e.file_key} отсутствует). Публикация пропускается.")
+        elif isinstance(e.cause, B2Error):
+            print(f"⚠️ Ошибка B2 SDK при скачивании файлов для {gen_id}: {e.cause}")
+        else:
+            print(f"⚠️ Неожиданная ошибка при скачивании файлов для {gen_id}: {e.cause}")
         cleanup_local_files()
         return False
     except Exception as e:
@@ -231,13 +219,29 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
         cleanup_local_files()
         return False
 
-    if not (json_downloaded and png_downloaded and video_downloaded and sarcasm_png_downloaded):
-        print(
-            f"❌ Группа {gen_id} неполная (JSON:{json_downloaded}, PNG:{png_downloaded}, Видео:{video_downloaded}, Sarcasm:{sarcasm_png_downloaded}). Пропуск.")
-        cleanup_local_files()
-        return False
+    publish_state.mark(gen_id, NO_CHAT, STEP_DOWNLOADED)
+    print(f"✅ Все нужные файлы для {gen_id} ({len(group_files)}) получены. Продолжаем обработку и отправку...")
 
-    print(f"✅ Все 4 файла для {gen_id} найдены. Продолжаем обработку и отправку...")
+    # Видео без moov в начале Telegram не показывает до полной загрузки: переставляем атомы
+    video_params = {}
+    if video_file_key not in skipped_keys:
+        try:
+            if isinstance(video_source, str):
+                video_info = await asyncio.to_thread(make_faststart, video_source)
+            else:
+                remuxed_video = new_spool()
+                spooled_files.append(remuxed_video)
+                video_info = await asyncio.to_thread(remux_faststart, video_source, remuxed_video)
+                if video_info.remuxed:
+                    video_source = remuxed_video
+                video_source.seek(0)
+            if video_info.remuxed:
+                print(f"🎞️ moov перенесен в начало видео {gen_id} (faststart).")
+            video_params = video_send_kwargs(video_info)
+        except Mp4Error as e:
+            print(f"❌ Видео {video_file_key} повреждено или не является MP4: {e}. Публикация пропускается.")
+            cleanup_local_files()
+            return False
     caption_text = ""
     poll_question = ""
     poll_options = []
@@ -248,147 +252,163 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
     success = False
 
     try:
-        with open(local_json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # --- ИЗВЛЕЧЕНИЕ ОСНОВНОГО ТЕКСТА ---
-        content_value = data.get("content")
-        possible_text_keys = ["текст", "content", "text"]
-        found_text = None
-        content_data = None
-        if isinstance(content_value, dict):
-            content_data = content_value
-        elif isinstance(content_value, str) and content_value.strip():
-            try:
-                content_data = json.loads(content_value.strip())
-            except json.JSONDecodeError:
-                found_text = content_value.strip() if content_value.strip() not in ["{}"] else None
-            except Exception as e:
-                print(f"⚠️ Ошибка обработки 'content' {gen_id}: {e}")
-        if content_data is not None:
-            post_list = content_data.get("post")
-            if isinstance(post_list, list):
-                post_texts = [list(item.values())[0] for item in post_list if isinstance(item, dict) and len(item) == 1]
-                if post_texts: found_text = "\n\n".join(filter(None, post_texts))
-            if found_text is None:
-                for key in possible_text_keys:
-                    if key in content_data: found_text = content_data[key]; break
-        main_text = found_text.strip() if isinstance(found_text, str) else ""
-        main_text = remove_system_phrases(main_text)
-        main_text = re.sub(r'(?<!\n)\n(?!\n)', '\n\n', main_text)
-
-        # --- ИЗВЛЕЧЕНИЕ И ФОРМАТИРОВАНИЕ ХЕШТЕГОВ ---
-        hashtags_list = data.get("hashtags")
-        formatted_hashtags_str = ""
-        if isinstance(hashtags_list, list):
-            formatted_hashtags = [f"#{tag.strip()}" for tag in hashtags_list if tag.strip()]
-            formatted_hashtags_str = " ".join(formatted_hashtags)
-            print(f"ℹ️ Сформированы хештеги: {formatted_hashtags_str}")
-        elif hashtags_list is not None:
-            print(f"⚠️ Ключ 'hashtags' найден, но не является списком: {type(hashtags_list)}")
-
-        # --- ИСПРАВЛЕННЫЙ БЛОК: Сборка финальной подписи (текст + ссылка + хештеги) ---
-        # Этот блок теперь находится ВНЕ условий if/elif для hashtags_list
-        link_html = '<b><a href="https://t.me/boyarinn7">Подпишись, забудешь</a></b>'
-        parts_for_caption = []
-
-        if main_text:  # Добавляем основной текст, если он есть
-            parts_for_caption.append(main_text)
-
-        parts_for_caption.append(link_html)  # Всегда добавляем ссылку
-
-        if formatted_hashtags_str:  # Добавляем хештеги, только если они были сформированы
-            parts_for_caption.append(formatted_hashtags_str)
-
-        # Собираем все части вместе, разделяя двойным переносом строки
-        # Только если часть не пустая
-        caption_text = "\n\n".join(part for part in parts_for_caption if part)
-
-        # Обрезаем подпись, если она слишком длинная
-        if len(caption_text) > 1024:
-            caption_text = caption_text[:1020] + "..."
-            print(f"⚠️ Подпись была обрезана до 1024 символов.")
-
-        # КЛЮЧЕВАЯ ОТЛАДОЧНАЯ СТРОКА (теперь должна работать всегда)
+        # Запись поста: готовая из {gen_id}_post.json или разобранная на лету (post_record)
+        if post_record is None:
+            if isinstance(json_source, str):
+                with open(json_source, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            else:
+                data = json.loads(json_source.read().decode("utf-8"))
+            post_record = normalize_post(data, gen_id)
+        else:
+            print(f"ℹ️ Используем готовую запись поста {POST_SUFFIX} для {gen_id}.")
+        caption_text = post_record["caption"]
         print(f"DEBUG: Финальная подпись для фото: '{caption_text[:150]}...'")
-        # --- Конец ИСПРАВЛЕННОГО блока сборки подписи ---
-
-        # --- Извлечение опроса ---
-        sarcasm_data = data.get("sarcasm", {})
-        poll_data = sarcasm_data.get("poll", {})
-        poll_question = poll_data.get("question", "").strip()[:300]
-        poll_options = [str(opt).strip()[:100] for opt in poll_data.get("options", []) if str(opt).strip()][:10]
+        poll = post_record.get("poll") or {}
+        poll_question = poll.get("question", "")
+        poll_options = poll.get("options", [])
         print(f"DEBUG: Опрос: Q='{poll_question}', Opts={poll_options}")
 
         json_processed_successfully = True
 
         # --- Отправка в Telegram ---
         os.makedirs(PROCESSED_DIR, exist_ok=True)
-        png_file_handle = None
-        video_file_handle = None
-        sarcasm_png_file_handle = None
-
-        try:
-            media_items = []
-            current_caption = caption_text  # Используем обновленный caption_text
-
-            png_file_handle = open(local_png_path, "rb")
-            media_items.append(InputMediaPhoto(png_file_handle, caption=current_caption, parse_mode="HTML"))
-            print(f"ℹ️ Добавлено PNG ПЕРВЫМ в медиагруппу (с подписью).")
-
-            video_file_handle = open(local_video_path, "rb")
-            media_items.append(
-                InputMediaVideo(video_file_handle, caption="", parse_mode="HTML", supports_streaming=True))
-            print(f"ℹ️ Добавлено MP4 ВТОРЫМ в медиагруппу (без подписи).")
-
-            print(f"✈️ Пытаемся отправить медиагруппу ({len(media_items)} элемента) для {gen_id}...")
-            await bot.send_media_group(
-                chat_id=TELEGRAM_CHAT_ID, media=media_items,
-                read_timeout=120, connect_timeout=120, write_timeout=120
-            )
-            album_sent = True
-            print(f"✅ Медиагруппа (Фото+Видео) для {gen_id} отправлена.")
-        except Exception as e:
-            print(f"❌ Ошибка при отправке медиагруппы для {gen_id}: {e}")
-            success = False
-            raise
-        finally:
-            if png_file_handle: png_file_handle.close()
-            if video_file_handle: video_file_handle.close()
-
-        if album_sent:
-            try:
-                print(f"✈️ Отправляем фото сарказма для {gen_id}...")
-                sarcasm_png_file_handle = open(local_sarcasm_png_path, "rb")
-                await bot.send_photo(
-                    chat_id=TELEGRAM_CHAT_ID,
-                    photo=sarcasm_png_file_handle,
-                    read_timeout=60, connect_timeout=60, write_timeout=60
+        # SHA-1 из листинга B2 (или посчитанный локально) — ключ кэша file_id
+        png_sha1 = _content_sha1(manifest, ".png", png_source)
+        video_sha1 = _content_sha1(manifest, ".mp4", video_source)
+        sarcasm_sha1 = _content_sha1(manifest, SARCASM_SUFFIX, sarcasm_source)
+
+        # Картинки, которые будут загружаться байтами (нет file_id), уменьшаем и пережимаем заранее
+        photos = [(file_key, source, sha1) for file_key, source, sha1 in (
+            (png_file_key, png_source, png_sha1), (sarcasm_png_file_key, sarcasm_source, sarcasm_sha1))
+            if file_key not in skipped_keys and not file_id_cache.contains("photo", sha1)]
+        if photos and image_optimizer_enabled():
+            results = await image_optimizer.optimize_many([(source, sha1) for _key, source, sha1 in photos])
+            for (file_key, _source, _sha1), result in zip(photos, results):
+                if not result.optimized:
+                    continue
+                if isinstance(result.source, str):
+                    local_files_to_clean.append(result.source)
+                print(f"🖼️ {os.path.basename(file_key)}: {result.original_bytes / 1024:.0f} КБ → "
+                      f"{result.optimized_bytes / 1024:.0f} КБ{' (из кэша)' if result.from_cache else ''}")
+                if file_key == png_file_key:
+                    png_source = result.source
+                else:
+                    sarcasm_source = result.source
+
+        async def send_to_chat(chat_id) -> Dict[str, bool]:
+            """Публикует группу в один чат, сохраняя порядок: альбом -> фото сарказма -> опрос."""
+            status = {"album": False, "sarcasm": False, "poll": False}
+
+            async def send_album(refs):
+                png_ref, video_ref = refs
+                print(f"✈️ [{chat_id}] Отправляем медиагруппу (2 элемента: PNG с подписью, MP4) для {gen_id}...")
+                if needs_streaming(refs):
+                    # Большое видео идет потоком с диска кусками, а не целиком в памяти
+                    media_specs = [
+                        {"type": "photo", "media": png_ref, "caption": caption_text, "parse_mode": "HTML"},
+                        {"type": "video", "media": video_ref, "supports_streaming": True, **video_params},
+                    ]
+                    return await limiter.send(
+                        send_media_group_streaming, bot, cost=len(media_specs),
+                        chat_id=chat_id, media=media_specs,
+                        read_timeout=120, connect_timeout=120, write_timeout=120
+                    )
+                media_items = [
+                    InputMediaPhoto(png_ref, caption=caption_text, parse_mode="HTML"),
+                    InputMediaVideo(video_ref, caption="", parse_mode="HTML", supports_streaming=True,
+                                    **video_params),
+                ]
+                return await limiter.send(
+                    bot.send_media_group, cost=len(media_items),
+                    chat_id=chat_id, media=media_items,
+                    read_timeout=120, connect_timeout=120, write_timeout=120
                 )
-                sarcasm_photo_sent = True
-                print(f"✅ Фото сарказма для {gen_id} отправлено.")
-            except Exception as e:
-                print(f"⚠️ Ошибка при отправке фото сарказма для {gen_id}: {e}")
-            finally:
-                if sarcasm_png_file_handle: sarcasm_png_file_handle.close()
-
-        if album_sent:
-            print("⏳ Пауза 1 секунда перед отправкой опроса...")
-            await asyncio.sleep(1)
-            if poll_question and len(poll_options) >= 2:
-                poll_question_formatted = f"🎭 {poll_question}"
+
+            if publish_state.done(gen_id, chat_id, STEP_ALBUM):
+                status["album"] = True
+                print(f"⏭️ [{chat_id}] Медиагруппа для {gen_id} уже была отправлена.")
+            else:
+                try:
+                    result = await send_with_file_ids(
+                        file_id_cache,
+                        [("photo", png_sha1, png_source), ("video", video_sha1, video_source)],
+                        send_album,
+                    )
+                    status["album"] = True
+                    publish_state.mark(gen_id, chat_id, STEP_ALBUM, message_ids(result))
+                    print(f"✅ [{chat_id}] Медиагруппа (Фото+Видео) для {gen_id} отправлена.")
+                except Exception as e:
+                    print(f"❌ [{chat_id}] Ошибка при отправке медиагруппы для {gen_id}: {e}")
+                    raise
+
+            if publish_state.done(gen_id, chat_id, STEP_SARCASM):
+                status["sarcasm"] = True
+                print(f"⏭️ [{chat_id}] Фото сарказма для {gen_id} уже было отправлено.")
+            else:
+                try:
+                    print(f"✈️ [{chat_id}] Отправляем фото сарказма для {gen_id}...")
+                    result = await send_with_file_ids(
+                        file_id_cache,
+                        [("photo", sarcasm_sha1, sarcasm_source)],
+                        lambda refs: limiter.send(
+                            bot.send_photo,
+                            chat_id=chat_id,
+                            photo=refs[0],
+                            read_timeout=60, connect_timeout=60, write_timeout=60
+                        ),
+                    )
+                    status["sarcasm"] = True
+                    publish_state.mark(gen_id, chat_id, STEP_SARCASM, message_ids(result))
+                    print(f"✅ [{chat_id}] Фото сарказма для {gen_id} отправлено.")
+                except Exception as e:
+                    print(f"⚠️ [{chat_id}] Ошибка при отправке фото сарказма для {gen_id}: {e}")
+
+            if publish_state.done(gen_id, chat_id, STEP_POLL):
+                status["poll"] = True
+                print(f"⏭️ [{chat_id}] Опрос для {gen_id} уже был отправлен.")
+            elif poll_question and len(poll_options) >= 2:
                 try:
-                    print(f"✈️ Отправляем опрос для {gen_id}...")
-                    await bot.send_poll(
-                        chat_id=TELEGRAM_CHAT_ID, question=poll_question_formatted,
+                    print(f"✈️ [{chat_id}] Отправляем опрос для {gen_id}...")
+                    result = await limiter.send(
+                        bot.send_poll,
+                        chat_id=chat_id, question=f"🎭 {poll_question}",
                         options=poll_options, is_anonymous=True
                     )
-                    poll_sent = True
-                    print(f"✅ Опрос для {gen_id} отправлен.")
+                    status["poll"] = True
+                    publish_state.mark(gen_id, chat_id, STEP_POLL, message_ids(result))
+                    print(f"✅ [{chat_id}] Опрос для {gen_id} отправлен.")
                 except Exception as e:
-                    print(f"⚠️ Ошибка при отправке опроса для {gen_id}: {e}")
+                    print(f"⚠️ [{chat_id}] Ошибка при отправке опроса для {gen_id}: {e}")
             else:
                 print("DEBUG: Опрос невалиден, отправка пропускается.")
+            return status
+
+        # Первый чат загружает файлы; остальные получают закэшированные file_id параллельно
+        primary_chat, mirror_chats = target_chats[0], target_chats[1:]
+        primary_status = await send_to_chat(primary_chat)
+        album_sent = primary_status["album"]
+        sarcasm_photo_sent = primary_status["sarcasm"]
+        poll_sent = primary_status["poll"]
+
+        if mirror_chats:
+            if any(not isinstance(source, str) for source in (png_source, video_source, sarcasm_source)):
+                # Буферы (B2_DISKLESS, сжатые картинки) общие для всех чатов: без file_id каждая
+                # отправка перематывает и читает тот же объект, поэтому зеркала идут по очереди
+                print(f"📡 Зеркалируем {gen_id} в {len(mirror_chats)} чат(а) по очереди (файлы в памяти)...")
+                mirror_results = []
+                for chat in mirror_chats:
+                    try:
+                        mirror_results.append(await send_to_chat(chat))
+                    except Exception as e:
+                        mirror_results.append(e)
+            else:
+                print(f"📡 Зеркалируем {gen_id} в {len(mirror_chats)} чат(а) параллельно...")
+                mirror_results = await asyncio.gather(*(send_to_chat(chat) for chat in mirror_chats),
+                                                      return_exceptions=True)
+            for chat, result in zip(mirror_chats, mirror_results):
+                if isinstance(result, BaseException) or not (result["album"] and result["sarcasm"]):
+                    print(f"⚠️ Зеркало {chat}: публикация {gen_id} неполная ({result}).")
 
         if album_sent and sarcasm_photo_sent:
             success = True
@@ -396,7 +416,13 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
         print(f"❌ Ошибка декодирования JSON {local_json_path}: {e}")
         os.makedirs(ERROR_DIR, exist_ok=True)
         try:
-            shutil.move(local_json_path, os.path.join(ERROR_DIR, os.path.basename(local_json_path)))
+            error_path = os.path.join(ERROR_DIR, os.path.basename(local_json_path))
+            if isinstance(json_source, str):
+                shutil.move(json_source, error_path)
+            else:
+                json_source.seek(0)
+                with open(error_path, "wb") as f:
+                    shutil.copyfileobj(json_source, f)
         except Exception as move_err:
             print(f"  ⚠️ Не удалось переместить поврежденный JSON: {move_err}")
         success = False
@@ -407,7 +433,7 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
     if success:
         print(f"✅ Успешная публикация контента для {gen_id}.")
         published_ids.add(gen_id)
-        save_published_ids(published_ids)
+        save_published_id(gen_id)
         os.makedirs(PROCESSED_DIR, exist_ok=True)
         for file_path in local_files_to_clean:
             if os.path.exists(file_path):
@@ -417,6 +443,8 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
                     print(f"  📁 Файл {os.path.basename(file_path)} перемещен в {PROCESSED_DIR}")
                 except Exception as e:
                     print(f"  ⚠️ Не удалось переместить файл {os.path.basename(file_path)} в processed: {e}")
+        for spool in spooled_files:
+            spool.close()
     else:
         print(f"⚠️ Публикация контента для {gen_id} НЕ УДАЛАСЬ или была пропущена. ID не добавлен в опубликованные.")
         if json_processed_successfully:
@@ -428,78 +456,123 @@ async def publish_generation_id(gen_id: str, folder: str, published_ids: Set[str
 
 
 # ------------------------------------------------------------
-# 5) Основная логика (поиск и публикация)
+# 4) Основная логика (поиск и публикация)
 # ------------------------------------------------------------
 async def main():
     print("\n" + "=" * 50)
     print("🚀 Запуск скрипта публикации B2 -> Telegram (v23: Финальная проверка логики caption)")
     print("=" * 50)
 
+    require_env(*REQUIRED_ENV)
+    print("✅ Все необходимые переменные окружения загружены.")
+
     shutil.rmtree(DOWNLOAD_DIR, ignore_errors=True)
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     os.makedirs(PROCESSED_DIR, exist_ok=True)
     os.makedirs(ERROR_DIR, exist_ok=True)
     print(f"✅ Локальные папки готовы.")
 
+    bucket = get_bucket()
+    get_bot()
+
     published_ids = load_published_ids()
-    folders_to_scan = ["444/", "555/", "666/"]
+    file_id_cache.load().load_from_b2(bucket)
+    media_cache.evict()
+    publish_state.load_from_b2(bucket)
+    publish_state.prune()
+    folders_to_scan = SCAN_FOLDERS
     print(f"📂 Папки в бакете '{S3_BUCKET_NAME}' для сканирования: {', '.join(folders_to_scan)}")
 
-    unpublished_items: List[Tuple[str, str]] = []
+    scan_cursor = load_scan_cursor(bucket)
+    print(f"\n🔎 Сканируем {len(folders_to_scan)} папки параллельно (лимит: {SCAN_CONCURRENCY})...")
+    scan_results = await scan_folders(bucket, folders_to_scan, scan_cursor, max_concurrency=SCAN_CONCURRENCY)
+
+    scanned_manifests = {}
+    unpublished_items: List[Tuple[str, str, GroupManifest]] = []
     for folder in folders_to_scan:
-        print(f"\n🔎 Сканируем папку: {folder}")
-        try:
-            ls_result = bucket.ls(folder_to_list=folder, recursive=False)
-            gen_ids_in_folder = set()
-            for file_version, _folder_name in ls_result:
-                file_name = file_version.file_name
-                relative_path = file_name.replace(folder, '', 1)
-                if '/' not in relative_path:
-                    gen_id = None
-                    if relative_path.endswith(SARCASM_SUFFIX):
-                        gen_id = relative_path[:-len(SARCASM_SUFFIX)]
-                    else:
-                        gen_id = os.path.splitext(relative_path)[0]
-                    if re.fullmatch(r"\d{8}-\d{4}", gen_id):
-                        gen_ids_in_folder.add(gen_id)
-                    else:
-                        if not relative_path.endswith('.bzEmpty'):
-                            print(f"   ⚠️ Пропускаем файл с некорректным именем ID: {file_name}")
-
-            print(f"   ℹ️ Найдено {len(gen_ids_in_folder)} уникальных ID формата ГГГГММДД-ЧЧММ в {folder}")
-            new_ids = gen_ids_in_folder - published_ids
-            if new_ids:
-                print(f"   ✨ Найдено {len(new_ids)} новых (неопубликованных) ID в {folder}.")
-                for gen_id_item in new_ids:
-                    unpublished_items.append((gen_id_item, folder))
-            else:
-                print(f"   ✅ Нет новых ID для публикации в {folder}.")
-        except B2Error as e:
-            print(f"   ❌ Ошибка B2 SDK при сканировании папки {folder}: {e}")
-        except Exception as e:
-            print(f"   ❌ Неожиданная ошибка при сканировании папки {folder}: {e}")
+        start_gen_id = scan_cursor.get(folder)
+        print(f"\n🔎 Папка: {folder}" + (f" (начиная с {start_gen_id})" if start_gen_id else ""))
+        manifests = scan_results[folder]
+        if isinstance(manifests, B2Error):
+            print(f"   ❌ Ошибка B2 SDK при сканировании папки {folder}: {manifests}")
+            continue
+        if isinstance(manifests, Exception):
+            print(f"   ❌ Неожиданная ошибка при сканировании папки {folder}: {manifests}")
+            continue
+        scanned_manifests[folder] = manifests
+        print(f"   ℹ️ Найдено {len(manifests)} уникальных ID формата ГГГГММДД-ЧЧММ в {folder}")
+        new_ids = published_ids.unpublished(manifests)
+        complete_ids = {gen_id for gen_id in new_ids if manifests[gen_id].is_complete}
+        for gen_id_item in sorted(new_ids - complete_ids):
+            print(f"   ⏭️ Группа {gen_id_item} неполная (нет: {', '.join(manifests[gen_id_item].missing)}). Пропуск без скачивания.")
+        if complete_ids:
+            print(f"   ✨ Найдено {len(complete_ids)} новых (неопубликованных) полных групп в {folder}.")
+            for gen_id_item in complete_ids:
+                unpublished_items.append((gen_id_item, folder, manifests[gen_id_item]))
+        else:
+            print(f"   ✅ Нет новых полных групп для публикации в {folder}.")
 
     if unpublished_items:
         print(f"\n⏳ Всего найдено {len(unpublished_items)} неопубликованных групп для проверки.")
         unpublished_items.sort(key=lambda item: item[0])
         print("   🔢 Сортировка по дате и времени (gen_id)...")
-        published_this_run = False
-        for gen_id_to_publish, folder_to_publish in unpublished_items:
+        limit_text = str(PUBLISH_MAX_GROUPS) if PUBLISH_MAX_GROUPS > 0 else "без ограничения"
+        budget_text = f"{PUBLISH_TIME_BUDGET_SECONDS:.0f} сек" if PUBLISH_TIME_BUDGET_SECONDS > 0 else "без ограничения"
+        print(f"   📦 Пакетный режим: до {limit_text} групп, бюджет времени: {budget_text}.")
+        started_at = time.monotonic()
+        published_count = 0
+        for gen_id_to_publish, folder_to_publish, manifest in unpublished_items:
+            if 0 < PUBLISH_MAX_GROUPS <= published_count:
+                print(f"\n⏹️ Достигнут лимит публикаций за запуск ({PUBLISH_MAX_GROUPS}).")
+                break
+            if 0 < PUBLISH_TIME_BUDGET_SECONDS <= time.monotonic() - started_at:
+                print(f"\n⏹️ Исчерпан бюджет времени ({PUBLISH_TIME_BUDGET_SECONDS:.0f} сек).")
+                break
             print(f"\n▶️ Пытаемся опубликовать следующую группу: ID={gen_id_to_publish} из папки {folder_to_publish}")
             print("-" * 50)
-            success_flag = await publish_generation_id(gen_id_to_publish, folder_to_publish, published_ids)
+            success_flag = await publish_generation_id(gen_id_to_publish, folder_to_publish, published_ids,
+                                                       manifest=manifest)
+            # Состояние сохраняется после каждой группы: раннер может прерваться в любой момент
+            publish_state.save_to_b2(bucket)
             print("-" * 50)
             if success_flag:
                 print(f"✅ Успешно опубликована группа {gen_id_to_publish}.")
-                published_this_run = True
-                break
+                published_count += 1
             else:
                 print(
                     f"ℹ️ Публикация группы {gen_id_to_publish} не удалась или была пропущена. Переходим к следующей...")
-        if not published_this_run:
+        if published_count == 0:
             print("\n⚠️ Не найдено полных групп (4 файла) для публикации в этом запуске.")
+        else:
+            print(f"\n📊 Опубликовано групп за запуск: {published_count} "
+                  f"за {time.monotonic() - started_at:.1f} сек.")
+        print(f"🚦 Состояние лимитера Telegram: {limiter.state()}")
     else:
         print("\n🎉 Нет новых групп для публикации во всех отсканированных папках.")
+
+    # Сдвигаем курсоры только для успешно отсканированных папок
+    new_cursor = dict(scan_cursor)
+    for folder, manifests in scanned_manifests.items():
+        folder_cursor = advance_cursor(manifests, published_ids, previous=scan_cursor.get(folder))
+        if folder_cursor:
+            new_cursor[folder] = folder_cursor
+    if new_cursor != scan_cursor:
+        save_scan_cursor(bucket, new_cursor)
+
+    # Сохраняем кэш file_id локально и в B2 (раннеры CI эфемерны)
+    file_id_cache.save()
+    file_id_cache.save_to_b2(bucket)
+    print(f"⚡ Кэш file_id: попаданий {file_id_cache.hits}, промахов {file_id_cache.misses}, записей {len(file_id_cache)}.")
+    print(f"♻️ Кэш медиа: {media_cache.stats()}.")
+    media_cache.evict()
+    if image_optimizer.bytes_before:
+        print(f"🖼️ Картинки: {image_optimizer.stats()}.")
+    image_optimizer.cache.evict()
+    publish_state.save_to_b2(bucket)
+    publish_state.close()
+
+    # Периодически сворачиваем дельты журнала в снимок
+    published_journal.compact_journal(bucket)
     print("\n🏁 Скрипт завершил работу.")
     print("=" * 50 + "\n")
 
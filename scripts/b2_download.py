@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Параллельное скачивание файлов группы generation_id из B2.
+
+Синхронные вызовы b2sdk выполняются в пуле потоков, поэтому цикл событий
+asyncio не блокируется, пока идут загрузки.
+
+Большие файлы (видео) скачиваются параллельными запросами диапазонов байтов
+(download_ranged): готовые части отмечаются в файле прогресса рядом с частичным
+файлом, поэтому после обрыва докачиваются только недостающие части, а SHA-1
+считается по мере готовности непрерывного префикса и сверяется с contentSha1.
+
+Бездисковый режим (B2_DISKLESS=1): файлы скачиваются не в DOWNLOAD_DIR,
+а в SpooledTemporaryFile — буфер в памяти, который сбрасывается во временный
+файл только при превышении B2_SPOOL_MAX_BYTES. Эти же объекты затем передаются
+в Telegram, без повторной записи и чтения с диска.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+from media_cache import MEDIA_CACHE_DISABLED, MediaCache, cache_key
+from group_bundle import BundleError, fetch_bundle, fetch_bundle_members, read_index
+from b2_scan import GROUP_SUFFIXES, VIDEO_SUFFIX
+
+# Количество потоков для одновременного скачивания файлов одной группы
+B2_DOWNLOAD_WORKERS = int(os.getenv("B2_DOWNLOAD_WORKERS", "4"))
+# Бездисковый режим и порог размера, выше которого буфер уходит во временный файл
+B2_DISKLESS = os.getenv("B2_DISKLESS", "").strip().lower() in ("1", "true", "yes")
+B2_SPOOL_MAX_BYTES = int(os.getenv("B2_SPOOL_MAX_BYTES", str(64 * 1024 * 1024)))
+# Скачивание диапазонами: размер части, потоки на файл, минимальный размер файла и повторы части
+B2_RANGE_PART_SIZE = int(os.getenv("B2_RANGE_PART_SIZE", str(16 * 1024 * 1024)))
+B2_RANGE_THREADS = int(os.getenv("B2_RANGE_THREADS", "4"))
+B2_RANGE_MIN_SIZE = int(os.getenv("B2_RANGE_MIN_SIZE", str(32 * 1024 * 1024)))
+B2_RANGE_RETRIES = int(os.getenv("B2_RANGE_RETRIES", "3"))
+
+# Куда скачивать: локальный путь или открытый файловый объект (например, буфер)
+DownloadTarget = Union[str, IO[bytes]]
+# Ключ файла в B2 -> (ключ кэша медиа, ожидаемый SHA-1 или None)
+CacheEntries = Dict[str, Tuple[str, Optional[str]]]
+
+
+class DownloadCancelled(Exception):
+    """Скачивание прервано, потому что соседняя загрузка группы завершилась ошибкой."""
+
+
+class GroupFetchError(Exception):
+    """
+    Ошибка скачивания группы. file_key — ключ файла, на котором произошла ошибка,
+    cause — исходное исключение (например, FileNotPresent).
+    """
+
+    def __init__(self, file_key: str, cause: BaseException):
+        super().__init__(f"{file_key}: {cause}")
+        self.file_key = file_key
+        self.cause = cause
+
+
+class ChecksumMismatch(Exception):
+    """SHA-1 скачанного файла не совпадает с contentSha1 из листинга B2."""
+
+
+class _CancellableWriter:
+    """
+    Обертка над файловым объектом: при каждой записи проверяет флаг отмены,
+    чтобы прервать уже идущую загрузку (например, большого MP4).
+    """
+
+    def __init__(self, file_obj, cancel_event: threading.Event):
+        self._file = file_obj
+        self._cancel_event = cancel_event
+
+    def write(self, data):
+        if self._cancel_event.is_set():
+            raise DownloadCancelled()
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class _RangeProgress:
+    """
+    Состояние докачки: частичный файл {path}.part и прогресс {path}.part.json
+    (размер, SHA-1, размер части и номера готовых частей).
+    """
+
+    def __init__(self, path: str, size: int, sha1: Optional[str], part_size: int):
+        self.part_path = path + ".part"
+        self.progress_path = path + ".part.json"
+        self.size = size
+        self.sha1 = sha1
+        self.part_size = part_size
+        self.done = set()
+
+    @property
+    def part_count(self) -> int:
+        return max(1, -(-self.size // self.part_size))
+
+    def part_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.part_size
+        return start, min(self.size, start + self.part_size) - 1
+
+    def _header(self) -> Dict:
+        return {"size": self.size, "sha1": self.sha1, "part_size": self.part_size}
+
+    def load(self) -> None:
+        """Подхватывает прогресс, если он относится к тому же файлу; иначе начинает заново."""
+        try:
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (all(data.get(name) == value for name, value in self._header().items())
+                    and os.path.getsize(self.part_path) == self.size):
+                self.done = {index for index in data.get("done", []) if 0 <= index < self.part_count}
+                return
+        except (OSError, ValueError):
+            pass
+        self.done = set()
+        with open(self.part_path, "wb") as f:
+            f.truncate(self.size)
+
+    def save(self) -> None:
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self._header(), done=sorted(self.done)), f)
+        os.replace(tmp_path, self.progress_path)
+
+    def discard(self) -> None:
+        for path in (self.part_path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _fetch_range(bucket, file_key: str, start: int, end: int, cancel_event: threading.Event) -> bytes:
+    buffer = io.BytesIO()
+    bucket.download_file_by_name(file_key, range_=(start, end)).save(_CancellableWriter(buffer, cancel_event))
+    data = buffer.getvalue()
+    if len(data) != end - start + 1:
+        raise IOError(f"{file_key}: получено {len(data)} байт вместо {end - start + 1} (диапазон {start}-{end})")
+    return data
+
+
+def download_ranged(bucket, file_key: str, local_path: str, size: int, sha1: Optional[str] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    part_size: Optional[int] = None, threads: Optional[int] = None,
+                    offset: int = 0) -> None:
+    """
+    Скачивает файл параллельными запросами диапазонов в local_path.
+    offset — начало файла внутри объекта file_key (член бандла); size — его длина.
+
+    Части пишутся в {local_path}.part, номера готовых частей — в {local_path}.part.json,
+    поэтому повторный вызов после сбоя докачивает только недостающее. Часть
+    повторяется до B2_RANGE_RETRIES раз. SHA-1 считается по мере появления
+    непрерывного префикса и сверяется с sha1; при несовпадении частичный файл
+    удаляется и выбрасывается ChecksumMismatch. Готовый файл переносится на
+    место атомарно.
+    """
+    cancel_event = cancel_event or threading.Event()
+    progress = _RangeProgress(local_path, size, sha1.lower() if sha1 else None,
+                              max(1, part_size or B2_RANGE_PART_SIZE))
+    progress.load()
+    pending = [index for index in range(progress.part_count) if index not in progress.done]
+    if progress.done:
+        print(f"⏯️ Докачка {file_key}: готово {len(progress.done)} из {progress.part_count} частей.")
+
+    digest = hashlib.sha1()
+    hashed_parts = 0
+    lock = threading.Lock()
+
+    with open(progress.part_path, "r+b") as f:
+
+        def advance_digest():
+            # Хешируем непрерывный префикс готовых частей, пока остальные скачиваются
+            nonlocal hashed_parts
+            while hashed_parts in progress.done:
+                start, end = progress.part_range(hashed_parts)
+                f.seek(start)
+                digest.update(f.read(end - start + 1))
+                hashed_parts += 1
+
+        def fetch_part(index: int) -> None:
+            start, end = progress.part_range(index)
+            for attempt in range(B2_RANGE_RETRIES + 1):
+                if cancel_event.is_set():
+                    raise DownloadCancelled()
+                try:
+                    data = _fetch_range(bucket, file_key, offset + start, offset + end, cancel_event)
+                    break
+                except DownloadCancelled:
+                    raise
+                except Exception as e:
+                    if attempt >= B2_RANGE_RETRIES:
+                        raise
+                    print(f"🔁 {file_key}: ошибка части {index} ({e}), повтор {attempt + 1}/{B2_RANGE_RETRIES}")
+            with lock:
+                f.seek(start)
+                f.write(data)
+                f.flush()
+                progress.done.add(index)
+                progress.save()
+                advance_digest()
+
+        with lock:
+            advance_digest()
+        workers = max(1, min(threads or B2_RANGE_THREADS, len(pending) or 1))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="b2-range") as executor:
+            futures = [executor.submit(fetch_part, index) for index in pending]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                cancel_event.set()
+                raise
+        advance_digest()
+
+    if progress.sha1 and digest.hexdigest() != progress.sha1:
+        progress.discard()
+        raise ChecksumMismatch(f"{file_key}: SHA-1 {digest.hexdigest()} не совпадает с {progress.sha1}")
+    os.replace(progress.part_path, local_path)
+    os.remove(progress.progress_path)
+
+
+def new_spool() -> IO[bytes]:
+    """Буфер для бездискового режима: в памяти до B2_SPOOL_MAX_BYTES, дальше — временный файл."""
+    return tempfile.SpooledTemporaryFile(max_size=B2_SPOOL_MAX_BYTES, mode="w+b")
+
+
+def _download_one(bucket, file_key: str, target: DownloadTarget, cancel_event: threading.Event,
+                  cache: Optional[MediaCache] = None,
+                  cache_entry: Optional[Tuple[str, Optional[str]]] = None,
+                  size: Optional[int] = None) -> DownloadTarget:
+    """
+    Скачивает один файл из B2 в путь или файловый объект target, прерываясь по cancel_event.
+    Для путей с переданными cache и cache_entry файл берется из локального кэша медиа.
+    Файлы известного размера от B2_RANGE_MIN_SIZE скачиваются диапазонами с докачкой.
+    """
+    if cancel_event.is_set():
+        raise DownloadCancelled()
+    if isinstance(target, str) and size is not None and size >= B2_RANGE_MIN_SIZE:
+        key, sha1 = cache_entry if cache_entry is not None else (None, None)
+
+        def download_to(path):
+            print(f"📥 Скачиваем диапазонами по {B2_RANGE_PART_SIZE // (1024 * 1024)} МБ "
+                  f"({B2_RANGE_THREADS} потоков): {file_key} -> {target}")
+            download_ranged(bucket, file_key, path, size, sha1=sha1, cancel_event=cancel_event)
+
+        if cache is not None and cache.fetch_to_path(key, target, download_to):
+            print(f"♻️ Из кэша медиа: {file_key} -> {target}")
+        else:
+            if cache is None:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                download_to(target)
+            print(f"✅ Скачан{' и проверен по SHA-1' if sha1 else ''}: {target}")
+    elif isinstance(target, str) and cache is not None and cache_entry is not None:
+        key, sha1 = cache_entry
+
+        def download(f):
+            print(f"📥 Скачиваем: {file_key} -> {target}")
+            bucket.download_file_by_name(file_key).save(_CancellableWriter(f, cancel_event))
+
+        if cache.fetch(key, target, download, sha1=sha1):
+            print(f"♻️ Из кэша медиа: {file_key} -> {target}")
+        else:
+            print(f"✅ Скачан: {target}")
+    elif isinstance(target, str):
+        print(f"📥 Скачиваем: {file_key} -> {target}")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        downloaded_file = bucket.download_file_by_name(file_key)
+        with open(target, "wb+") as f:
+            downloaded_file.save(_CancellableWriter(f, cancel_event))
+        print(f"✅ Скачан: {target}")
+    else:
+        print(f"📥 Скачиваем в память: {file_key}")
+        downloaded_file = bucket.download_file_by_name(file_key)
+        downloaded_file.save(_CancellableWriter(target, cancel_event))
+        target.seek(0)
+        print(f"✅ Скачан в память: {file_key}")
+    return target
+
+
+async def fetch_group_files(bucket, files: List[Tuple[str, DownloadTarget]],
+                            max_workers: Optional[int] = None,
+                            cache: Optional[MediaCache] = None,
+                            cache_entries: Optional[CacheEntries] = None,
+                            sizes: Optional[Dict[str, int]] = None) -> None:
+    """
+    Скачивает все файлы группы одновременно в пуле потоков.
+
+    files — список пар (ключ в B2, локальный путь или файловый объект). Файлы запускаются в порядке
+    списка, поэтому самый большой (видео) стоит передавать первым: остальные
+    успеют скачаться, пока идет его загрузка.
+    При первой ошибке (например, FileNotPresent) остальные загрузки отменяются,
+    частично скачанные файлы удаляются и выбрасывается GroupFetchError.
+    cache и cache_entries (ключ файла -> (ключ кэша, SHA-1)) включают локальный
+    кэш медиа: повторная попытка той же группы не скачивает файлы заново.
+    sizes (ключ файла -> размер из листинга) включает скачивание больших файлов
+    диапазонами с докачкой и проверкой SHA-1 (см. download_ranged).
+    """
+    cache_entries = cache_entries or {}
+    sizes = sizes or {}
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    workers = max(1, max_workers or B2_DOWNLOAD_WORKERS)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="b2-group") as executor:
+        tasks = {
+            loop.run_in_executor(executor, _download_one, bucket, file_key, local_path, cancel_event,
+                                 cache, cache_entries.get(file_key), sizes.get(file_key)): file_key
+            for file_key, local_path in files
+        }
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+        failure: Optional[GroupFetchError] = None
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), DownloadCancelled):
+                failure = GroupFetchError(tasks[task], task.exception())
+                break
+
+        if failure is not None:
+            cancel_event.set()
+            for task in pending:
+                task.cancel()
+            # Дожидаемся, пока уже запущенные потоки заметят отмену
+            await asyncio.gather(*pending, return_exceptions=True)
+            for _file_key, local_path in files:
+                # Буферы закрывает вызывающий код, здесь удаляются только файлы
+                if isinstance(local_path, str) and os.path.exists(local_path):
+                    try:
+                        os.remove(local_path)
+                    except OSError as e:
+                        print(f"  ⚠️ Не удалось удалить частично скачанный файл {local_path}: {e}")
+            raise failure
+
+
+def _index_key(bundle_cache_key: Optional[str]) -> Optional[str]:
+    """Ключ записи кэша с индексом бандла (сам бандл целиком не кэшируется)."""
+    return f"{bundle_cache_key}.index" if bundle_cache_key else None
+
+
+def _load_cached_index(cache: MediaCache, index_key: Optional[str]) -> Optional[Dict[str, Dict]]:
+    """Индекс бандла, сохраненный в кэше при прошлом скачивании, или None."""
+    path = cache.get(index_key)
+    if path is None:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_index(cache: MediaCache, index_key: Optional[str], index: Dict[str, Dict]) -> None:
+    if not index_key:
+        return
+    tmp_path = cache.new_temp_file()
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    cache.put(index_key, tmp_path)
+
+
+def _fetch_bundle_to_cache(bucket, bundle_key: str, targets: Dict[str, str], cache: MediaCache,
+                           index_key: Optional[str]) -> None:
+    """
+    Весь бандл одним запросом: члены пишутся во временные файлы кэша, после
+    проверки SHA-1 регистрируются в кэше по SHA-1 из индекса, а нужные кладутся в targets.
+    """
+    print(f"📦 Скачиваем бандл одним запросом в кэш медиа: {bundle_key}")
+    tmp_paths = {suffix: cache.new_temp_file() for suffix in GROUP_SUFFIXES}
+    try:
+        index = fetch_bundle(bucket, bundle_key, dict(tmp_paths))
+        for suffix, member in index.items():
+            if suffix in tmp_paths:
+                cache.put(cache_key(member["sha1"]), tmp_paths.pop(suffix), targets.get(suffix))
+        missing = set(targets) - set(index)
+        if missing:
+            raise BundleError(f"в бандле {bundle_key} нет членов {sorted(missing)}")
+        _store_index(cache, index_key, index)
+    finally:
+        for tmp_path in tmp_paths.values():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _fetch_bundle_member(bucket, bundle_key: str, index: Dict[str, Dict], suffix: str,
+                         target: DownloadTarget, cache: Optional[MediaCache] = None) -> bool:
+    """
+    Один член бандла запросом диапазона. Члены от B2_RANGE_MIN_SIZE с путем в
+    target скачиваются как отдельные большие файлы: параллельными диапазонами
+    с докачкой и проверкой SHA-1 (download_ranged со смещением члена).
+    Возвращает True, если член взят из кэша.
+    """
+    member = index.get(suffix)
+    if member is None or not isinstance(target, str):
+        fetch_bundle_members(bucket, bundle_key, {suffix: target}, index=index)
+        return False
+    key = cache_key(member["sha1"]) if cache is not None else None
+    if member["size"] >= B2_RANGE_MIN_SIZE:
+
+        def download_to(path):
+            download_ranged(bucket, bundle_key, path, member["size"], sha1=member["sha1"], offset=member["offset"])
+
+        if cache is None:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            download_to(target)
+            return False
+        return cache.fetch_to_path(key, target, download_to)
+    if cache is None:
+        fetch_bundle_members(bucket, bundle_key, {suffix: target}, index=index)
+        return False
+    return cache.fetch(key, target, lambda f: fetch_bundle_members(bucket, bundle_key, {suffix: f}, index=index),
+                       sha1=member["sha1"])
+
+
+def _fetch_bundle_sync(bucket, bundle_key: str, targets: Dict[str, DownloadTarget],
+                       cache: Optional[MediaCache], bundle_cache_key: Optional[str] = None) -> None:
+    if MEDIA_CACHE_DISABLED:
+        cache = None
+    if cache is None and set(targets) >= set(GROUP_SUFFIXES):
+        # Без кэша и за всей группой — один запрос на весь бандл, члены раскладываются на лету
+        print(f"📦 Скачиваем бандл одним запросом: {bundle_key}")
+        fetch_bundle(bucket, bundle_key, targets)
+        return
+    if cache is None:
+        print(f"📦 Скачиваем из бандла {bundle_key} только {', '.join(targets)}")
+        index = read_index(bucket, bundle_key)
+        for suffix, target in targets.items():
+            _fetch_bundle_member(bucket, bundle_key, index, suffix, target)
+        return
+    # Индекс прошлого скачивания (из кэша) говорит, каких членов в кэше нет. Если среди
+    # них видео — основной объем бандла, — весь бандл идет одним запросом прямо в кэш
+    index_key = _index_key(bundle_cache_key)
+    index = _load_cached_index(cache, index_key)
+    uncached = [suffix for suffix in targets
+                if index is None or suffix not in index or not cache.contains(cache_key(index[suffix]["sha1"]))]
+    if VIDEO_SUFFIX in uncached and all(isinstance(target, str) for target in targets.values()):
+        _fetch_bundle_to_cache(bucket, bundle_key, targets, cache, index_key)
+        return
+    # Иначе — диапазоны только тех членов, которых нет в кэше (ключ — SHA-1 из индекса)
+    if index is None:
+        index = read_index(bucket, bundle_key)
+        _store_index(cache, index_key, index)
+    for suffix, target in targets.items():
+        if _fetch_bundle_member(bucket, bundle_key, index, suffix, target, cache):
+            print(f"♻️ Из кэша медиа: {bundle_key}[{suffix}] -> {target}")
+        else:
+            print(f"📦 Скачан член бандла: {bundle_key}[{suffix}] -> {target}")
+
+
+async def fetch_group_bundle(bucket, bundle_key: str, targets: Dict[str, DownloadTarget],
+                             cache: Optional[MediaCache] = None, bundle_cache_key: Optional[str] = None) -> None:
+    """
+    Получает файлы группы из бандла {gen_id}.bundle (см. group_bundle).
+    targets — {суффикс: путь или файловый объект}, только нужные члены.
+    С cache бандл, видео из которого нет в кэше, скачивается одним запросом,
+    а члены регистрируются в кэше по SHA-1 из индекса. bundle_cache_key (ключ
+    кэша самого бандла) сохраняет индекс, чтобы повторная попытка знала, что
+    уже в кэше, и обходилась без запросов.
+    При ошибке частично записанные файлы удаляются и выбрасывается GroupFetchError.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, _fetch_bundle_sync, bucket, bundle_key, targets, cache, bundle_cache_key)
+    except Exception as e:
+        for target in targets.values():
+            if isinstance(target, str) and os.path.exists(target):
+                try:
+                    os.remove(target)
+                except OSError as remove_error:
+                    print(f"  ⚠️ Не удалось удалить частично скачанный файл {target}: {remove_error}")
+        raise GroupFetchError(bundle_key, e)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Сканирование папок бакета B2 и сборка манифестов групп generation_id.
+
+Полнота группы (все 4 файла) определяется по результатам bucket.ls,
+без скачивания самих файлов.
+
+Инкрементальный режим: для каждой папки в config/scan_cursor.json хранится
+курсор — самый ранний gen_id, который еще может понадобиться. Листинг
+начинается с него (gen_id сортируются лексикографически как время),
+поэтому вся опубликованная история повторно не перечисляется.
+Полный пересмотр включается переменной окружения B2_FULL_RESCAN=1.
+
+Папки сканируются параллельно (по одной задаче листинга на префикс);
+список папок и лимит параллельности задаются через B2_SCAN_FOLDERS и
+B2_SCAN_CONCURRENCY.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+
+# Суффиксы файлов одной группы: {gen_id}.json, {gen_id}.png, {gen_id}.mp4, {gen_id}_sarcasm.png
+SARCASM_SUFFIX = "_sarcasm.png"
+VIDEO_SUFFIX = ".mp4"
+GROUP_SUFFIXES = (".json", ".png", VIDEO_SUFFIX, SARCASM_SUFFIX)
+# Бандл {gen_id}.bundle содержит все файлы группы в одном объекте (см. group_bundle)
+BUNDLE_SUFFIX = ".bundle"
+# Нормализованная запись поста {gen_id}_post.json (см. post_record), необязательна
+POST_SUFFIX = "_post.json"
+
+GEN_ID_PATTERN = re.compile(r"\d{8}-\d{4}")
+GEN_ID_FORMAT = "%Y%m%d-%H%M"
+
+
+def parse_folder_list(raw: str) -> List[str]:
+    """Разбирает список папок через запятую, добавляя завершающий '/'."""
+    folders = []
+    for item in raw.split(","):
+        item = item.strip()
+        if item:
+            folders.append(item if item.endswith("/") else item + "/")
+    return folders
+
+
+# Папки-источники групп и лимит одновременных листингов
+SCAN_FOLDERS = parse_folder_list(os.getenv("B2_SCAN_FOLDERS", "444/,555/,666/"))
+SCAN_CONCURRENCY = int(os.getenv("B2_SCAN_CONCURRENCY", "8"))
+
+# Курсоры инкрементального сканирования (рядом с config_public.json)
+SCAN_CURSOR_KEY = "config/scan_cursor.json"
+B2_FULL_RESCAN = os.getenv("B2_FULL_RESCAN", "").strip().lower() in ("1", "true", "yes")
+# Неполные группы моложе этого срока держат курсор: их файлы могут еще догружаться
+INCOMPLETE_GRACE_HOURS = int(os.getenv("B2_SCAN_INCOMPLETE_GRACE_HOURS", "24"))
+# Размер страницы для b2_list_file_names
+LIST_PAGE_SIZE = 1000
+
+
+class FileEntry(NamedTuple):
+    """Сведения о файле группы из листинга B2."""
+    file_name: str
+    size: int
+    content_sha1: Optional[str]
+    file_id: Optional[str]
+
+
+class _ListedFile(NamedTuple):
+    """Запись сырого ответа b2_list_file_names в виде, похожем на FileVersion."""
+    file_name: str
+    size: int
+    content_sha1: Optional[str]
+    id_: Optional[str]
+
+
+@dataclass
+class GroupManifest:
+    """Манифест группы: какие из 4 файлов (или бандл) есть в бакете, их размеры и SHA-1."""
+    gen_id: str
+    folder: str
+    files: Dict[str, FileEntry] = field(default_factory=dict)
+
+    @property
+    def bundle(self) -> Optional[FileEntry]:
+        return self.files.get(BUNDLE_SUFFIX)
+
+    @property
+    def missing(self) -> List[str]:
+        if self.bundle is not None:
+            return []
+        return [suffix for suffix in GROUP_SUFFIXES if suffix not in self.files]
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.missing
+
+    @property
+    def total_size(self) -> int:
+        if self.bundle is not None:
+            return self.bundle.size
+        return sum(entry.size for suffix, entry in self.files.items() if suffix in GROUP_SUFFIXES)
+
+    def key(self, suffix: str) -> str:
+        """Полный ключ файла группы в бакете."""
+        return f"{self.folder}{self.gen_id}{suffix}"
+
+
+def split_group_file_name(relative_path: str):
+    """
+    Разбирает имя файла внутри папки на (gen_id, суффикс).
+    Для файлов, не относящихся к группам, возвращает (None, None).
+    """
+    if relative_path.endswith(SARCASM_SUFFIX):
+        gen_id, suffix = relative_path[:-len(SARCASM_SUFFIX)], SARCASM_SUFFIX
+    elif relative_path.endswith(POST_SUFFIX):
+        gen_id, suffix = relative_path[:-len(POST_SUFFIX)], POST_SUFFIX
+    else:
+        gen_id, suffix = os.path.splitext(relative_path)
+    if not GEN_ID_PATTERN.fullmatch(gen_id):
+        return None, None
+    return gen_id, suffix
+
+
+def _normalize_sha1(content_sha1: Optional[str]) -> Optional[str]:
+    # Для больших файлов B2 хранит 'none' или 'unverified:<sha1>'
+    if not content_sha1 or content_sha1 == "none":
+        return None
+    if content_sha1.startswith("unverified:"):
+        return content_sha1[len("unverified:"):]
+    return content_sha1
+
+
+def build_manifests(file_versions, folder: str) -> Dict[str, GroupManifest]:
+    """
+    Собирает манифесты групп из итератора FileVersion (результат bucket.ls).
+    """
+    manifests: Dict[str, GroupManifest] = {}
+    for file_version in file_versions:
+        file_name = file_version.file_name
+        relative_path = file_name.replace(folder, '', 1)
+        if '/' in relative_path:
+            continue
+        gen_id, suffix = split_group_file_name(relative_path)
+        if gen_id is None:
+            if not relative_path.endswith('.bzEmpty'):
+                print(f"   ⚠️ Пропускаем файл с некорректным именем ID: {file_name}")
+            continue
+        if suffix not in GROUP_SUFFIXES and suffix not in (BUNDLE_SUFFIX, POST_SUFFIX):
+            continue
+        manifest = manifests.setdefault(gen_id, GroupManifest(gen_id=gen_id, folder=folder))
+        manifest.files[suffix] = FileEntry(
+            file_name=file_name,
+            size=getattr(file_version, "size", 0) or 0,
+            content_sha1=_normalize_sha1(getattr(file_version, "content_sha1", None)),
+            file_id=getattr(file_version, "id_", None),
+        )
+    return manifests
+
+
+def _list_from(bucket, folder: str, start_file_name: str) -> Iterable[_ListedFile]:
+    """Постраничный листинг папки начиная с start_file_name (включительно)."""
+    next_file_name = start_file_name
+    while next_file_name is not None:
+        response = bucket.list_file_names(start_filename=next_file_name, max_entries=LIST_PAGE_SIZE,
+                                          prefix=folder)
+        for item in response.get("files", []):
+            if item.get("action", "upload") != "upload":
+                continue
+            yield _ListedFile(
+                file_name=item["fileName"],
+                size=item.get("contentLength", 0),
+                content_sha1=item.get("contentSha1"),
+                id_=item.get("fileId"),
+            )
+        next_file_name = response.get("nextFileName")
+
+
+def scan_folder(bucket, folder: str, start_gen_id: Optional[str] = None) -> Dict[str, GroupManifest]:
+    """
+    Листинг одной папки бакета и сборка манифестов групп в ней.
+    Если задан start_gen_id, перечисляются только файлы начиная с этой группы.
+    """
+    if start_gen_id:
+        return build_manifests(_list_from(bucket, folder, f"{folder}{start_gen_id}"), folder)
+    ls_result = bucket.ls(folder_to_list=folder, recursive=False)
+    return build_manifests((file_version for file_version, _folder_name in ls_result), folder)
+
+
+async def scan_folders(bucket, folders: List[str], scan_cursor: Optional[Dict[str, str]] = None,
+                       max_concurrency: Optional[int] = None
+                       ) -> Dict[str, Union[Dict[str, GroupManifest], Exception]]:
+    """
+    Параллельно сканирует папки (синхронный листинг b2sdk — в потоках).
+    Возвращает словарь папка -> манифесты; для папок с ошибкой значение — исключение.
+    """
+    scan_cursor = scan_cursor or {}
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or SCAN_CONCURRENCY))
+
+    async def _scan(folder: str):
+        async with semaphore:
+            return await asyncio.to_thread(scan_folder, bucket, folder, scan_cursor.get(folder))
+
+    results = await asyncio.gather(*(_scan(folder) for folder in folders), return_exceptions=True)
+    return dict(zip(folders, results))
+
+
+# ------------------------------------------------------------
+# Курсоры инкрементального сканирования
+# ------------------------------------------------------------
+def parse_scan_cursor(raw: bytes) -> Dict[str, str]:
+    """Разбирает содержимое scan_cursor.json, отбрасывая некорректные записи."""
+    data = json.loads(raw.decode("utf-8"))
+    folders = data.get("folders", {}) if isinstance(data, dict) else {}
+    return {
+        folder: gen_id for folder, gen_id in folders.items()
+        if isinstance(gen_id, str) and GEN_ID_PATTERN.fullmatch(gen_id)
+    }
+
+
+def dump_scan_cursor(cursor: Dict[str, str]) -> bytes:
+    return json.dumps({"folders": dict(sorted(cursor.items()))}, ensure_ascii=False).encode("utf-8")
+
+
+def load_scan_cursor(bucket) -> Dict[str, str]:
+    """
+    Загружает курсоры сканирования из B2. При B2_FULL_RESCAN, отсутствии
+    или повреждении файла возвращает пустой словарь (полный листинг).
+    """
+    if B2_FULL_RESCAN:
+        print("🔁 B2_FULL_RESCAN: курсоры игнорируются, выполняется полное сканирование.")
+        return {}
+    try:
+        downloaded_file = bucket.download_file_by_name(SCAN_CURSOR_KEY)
+        buffer = io.BytesIO()
+        downloaded_file.save(buffer)
+        cursor = parse_scan_cursor(buffer.getvalue())
+        print(f"ℹ️ Загружены курсоры сканирования: {cursor}")
+        return cursor
+    except Exception as e:
+        print(f"⚠️ Курсоры сканирования {SCAN_CURSOR_KEY} не загружены ({e}). Полное сканирование.")
+        return {}
+
+
+def save_scan_cursor(bucket, cursor: Dict[str, str]) -> None:
+    try:
+        bucket.upload_bytes(dump_scan_cursor(cursor), SCAN_CURSOR_KEY)
+        print(f"💾 Курсоры сканирования сохранены в {SCAN_CURSOR_KEY}: {cursor}")
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить {SCAN_CURSOR_KEY}: {e}")
+
+
+def is_settled(gen_id: str, now: datetime) -> bool:
+    """Неполная группа считается брошенной, если она старше INCOMPLETE_GRACE_HOURS."""
+    try:
+        created = datetime.strptime(gen_id, GEN_ID_FORMAT)
+    except ValueError:
+        return True
+    return now - created > timedelta(hours=INCOMPLETE_GRACE_HOURS)
+
+
+def advance_cursor(manifests: Dict[str, GroupManifest], published_ids,
+                   previous: Optional[str] = None, now: Optional[datetime] = None) -> Optional[str]:
+    """
+    Вычисляет новый курсор папки: самый ранний gen_id, который еще ждет публикации
+    (полная неопубликованная группа или свежая неполная). Если таких нет —
+    последний увиденный gen_id. Курсор никогда не сдвигается назад.
+    """
+    now = now or datetime.now()
+    pending = [
+        gen_id for gen_id, manifest in manifests.items()
+        if gen_id not in published_ids and (manifest.is_complete or not is_settled(gen_id, now))
+    ]
+    if pending:
+        candidate = min(pending)
+    elif manifests:
+        candidate = max(manifests)
+    else:
+        candidate = previous
+    if previous and candidate and candidate < previous:
+        return previous
+    return candidate
+
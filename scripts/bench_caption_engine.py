@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк caption_engine против прежней сборки подписи.
+
+Прежний вариант: два re.sub с компиляцией шаблона на каждую системную фразу,
+затем срез caption[:1020] + "...". Новый: общие скомпилированные шаблоны и
+render_many. Для коротких подписей результаты обязаны совпадать.
+
+Запуск: python scripts/bench_caption_engine.py [число_подписей] [повторы]
+"""
+import random
+import re
+import sys
+import time
+
+from caption_engine import SYSTEM_PHRASES, CaptionRenderer, clean_post_text, visible_len
+from post_record import LINK_HTML
+
+
+def legacy_remove_system_phrases(text: str) -> str:
+    clean_text = text
+    for phrase in SYSTEM_PHRASES:
+        clean_text = re.sub(r'^\s*' + re.escape(phrase) + r'\s*\n?', '', clean_text,
+                            flags=re.IGNORECASE | re.MULTILINE).strip()
+        clean_text = re.sub(r'\n\s*' + re.escape(phrase) + r'\s*', '\n', clean_text, flags=re.IGNORECASE).strip()
+    clean_text = re.sub(r"\n\s*\n+", "\n\n", clean_text)
+    return clean_text.strip()
+
+
+def legacy_caption(text: str, hashtags: str) -> str:
+    main_text = re.sub(r'(?<!\n)\n(?!\n)', '\n\n', legacy_remove_system_phrases(text))
+    caption = "\n\n".join(part for part in [main_text, LINK_HTML, hashtags] if part)
+    if len(caption) > 1024:
+        caption = caption[:1020] + "..."
+    return caption
+
+
+def _sample_posts(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    words = ["Барон", "история", "факт", "императрица", "бал", "☕", "👨‍👩‍👧", "🏛", "Франция", "дуэль"]
+    posts = []
+    for _ in range(count):
+        paragraphs = []
+        for phrase in rng.sample(SYSTEM_PHRASES, 3):
+            paragraphs.append(phrase + "\n" + " ".join(rng.choice(words) for _ in range(rng.randint(10, 60))))
+        text = "\n".join(paragraphs)
+        hashtags = " ".join(f"#{rng.choice(words)}" for _ in range(3))
+        posts.append((text, hashtags))
+    return posts
+
+
+def _measure(func, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    posts = _sample_posts(count)
+    renderer = CaptionRenderer()
+
+    def run_legacy():
+        return [legacy_caption(text, hashtags) for text, hashtags in posts]
+
+    def run_engine():
+        return renderer.render_many((clean_post_text(text), (LINK_HTML, hashtags)) for text, hashtags in posts)
+
+    legacy, engine = run_legacy(), run_engine()
+    same = sum(1 for old, new in zip(legacy, engine) if old == new)
+    legacy_over = sum(1 for old in legacy if visible_len(old) > 1024)
+    engine_over = sum(1 for new in engine if visible_len(new) > 1024)
+    print(f"📊 Подписей: {count}, совпадает с прежней сборкой: {same}. Сверх лимита Telegram (UTF-16): "
+          f"прежняя сборка — {legacy_over}, caption_engine — {engine_over}")
+
+    legacy_time = _measure(run_legacy, repeats)
+    engine_time = _measure(run_engine, repeats)
+    print(f"⏱️ Прежняя сборка: {legacy_time * 1000:.1f} мс ({legacy_time / count * 1e6:.1f} мкс на подпись)")
+    print(f"⏱️ caption_engine: {engine_time * 1000:.1f} мс ({engine_time / count * 1e6:.1f} мкс на подпись)")
+    print(f"🚀 Ускорение: x{legacy_time / engine_time:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Сборка подписей Telegram: очистка текста и обрезка под лимит без порчи HTML.
+
+Telegram считает длину подписи после разбора разметки (теги не считаются,
+&amp; — один символ) и в единицах UTF-16 (эмодзи вне BMP — две единицы).
+Обрезка срезом строки может разрезать тег <a href>, HTML-сущность, суррогатную
+пару или составное эмодзи (ZWJ-последовательность, модификатор тона).
+truncate_html режет только по границам видимого текста и графем, по
+возможности — на пробеле, и закрывает незакрытые теги.
+
+Все регулярные выражения скомпилированы один раз при импорте. Системные
+фразы удаляются по очереди, как и раньше (порядок важен, когда фразы стоят
+рядом), но текст без единой фразы проверяется одним поиском и проходы пропускает.
+render_caption собирает подпись из основного текста и «хвоста» (ссылка,
+хештеги), который не обрезается; CaptionRenderer.render_many — пакетный
+режим для тысяч подписей (например, при ingest_posts.py).
+Замер скорости: python scripts/bench_caption_engine.py.
+"""
+import html
+import re
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# Максимальная длина подписи в Telegram (в единицах UTF-16 видимого текста)
+TELEGRAM_CAPTION_LIMIT = 1024
+ELLIPSIS = "..."
+
+SYSTEM_PHRASES = [
+    "Вступление:", "Основная часть:", "Интересный факт:", "Заключение:",
+    "🔥Вступление", "📚Основная часть", "🔍Интересный факт"
+]
+
+# Есть ли в тексте хоть одна системная фраза
+_ANY_PHRASE = re.compile("|".join(re.escape(phrase) for phrase in SYSTEM_PHRASES), re.IGNORECASE)
+# Для каждой фразы по очереди: в начале строки (вместе с переводом строки после нее) — удаляется,
+# после перевода строки в середине текста — заменяется переводом строки
+_PHRASE_PASSES = [
+    (re.compile(r"^\s*" + re.escape(phrase) + r"\s*\n?", re.IGNORECASE | re.MULTILINE),
+     re.compile(r"\n\s*" + re.escape(phrase) + r"\s*", re.IGNORECASE))
+    for phrase in SYSTEM_PHRASES
+]
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SINGLE_NEWLINE = re.compile(r"(?<!\n)\n(?!\n)")
+
+# Разметка: тег, HTML-сущность или кусок текста без разметки
+_TOKEN = re.compile(r"<[^<>]*>|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);|[^<&]+|[<&]")
+_TAG = re.compile(r"<[^<>]*>")
+_TAG_NAME = re.compile(r"<\s*(/?)\s*([A-Za-z][A-Za-z0-9-]*)")
+_WORD_BREAK = re.compile(r"\s+\S*$")
+
+# Символы, перед которыми графему резать нельзя: комбинирующие знаки,
+# селекторы вариантов, ZWJ, модификаторы тона кожи, теги флагов
+_EXTENDERS = re.compile(
+    "[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe00-\ufe0f\ufe20-\ufe2f\u200c\u200d"
+    "\U0001f3fb-\U0001f3ff\U000e0020-\U000e007f]"
+)
+_ZWJ = "\u200d"
+
+
+def utf16_len(text: str) -> int:
+    """Длина строки в единицах UTF-16, как ее считает Telegram."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def visible_len(markup: str) -> int:
+    """Длина видимого текста HTML-подписи (без тегов, сущности — по символу) в UTF-16."""
+    if "<" not in markup and "&" not in markup:
+        return utf16_len(markup)
+    return utf16_len(html.unescape(_TAG.sub("", markup)))
+
+
+def remove_system_phrases(text: str) -> str:
+    """
+    Очищает текст от стандартных заголовков и заменяет множественные переводы строк.
+    """
+    if not isinstance(text, str):
+        return ""
+    clean_text = text.strip()
+    if _ANY_PHRASE.search(clean_text):
+        for leading, inner in _PHRASE_PASSES:
+            clean_text = leading.sub("", clean_text).strip()
+            clean_text = inner.sub("\n", clean_text).strip()
+    clean_text = _BLANK_LINES.sub("\n\n", clean_text)
+    return clean_text.strip()
+
+
+def clean_post_text(text: str) -> str:
+    """Очистка от системных фраз и разбиение одиночных переводов строк на абзацы."""
+    return _SINGLE_NEWLINE.sub("\n\n", remove_system_phrases(text))
+
+
+def _safe_cut(text: str, cut: int) -> int:
+    """Сдвигает позицию разреза влево, чтобы не разделить графему."""
+    while 0 < cut < len(text) and (_EXTENDERS.match(text, cut) or text[cut - 1] == _ZWJ):
+        cut -= 1
+    return cut
+
+
+def _cut_text(text: str, budget: int) -> str:
+    """Наибольший префикс text не длиннее budget единиц UTF-16, по границе графемы и слова."""
+    cut = 0
+    used = 0
+    for char in text:
+        width = 2 if ord(char) > 0xFFFF else 1
+        if used + width > budget:
+            break
+        used += width
+        cut += 1
+    cut = _safe_cut(text, cut)
+    prefix = text[:cut]
+    # Режем на границе слова, если при этом теряется не больше пятой части
+    word_break = _WORD_BREAK.search(prefix)
+    if word_break and cut < len(text) and not text[cut].isspace() and word_break.start() >= cut * 4 // 5:
+        prefix = prefix[:word_break.start()]
+    return prefix.rstrip()
+
+
+def truncate_html(markup: str, limit: int = TELEGRAM_CAPTION_LIMIT, ellipsis: str = ELLIPSIS) -> Tuple[str, bool]:
+    """
+    Обрезает HTML-подпись до limit единиц UTF-16 видимого текста вместе с ellipsis.
+    Теги и сущности не разрезаются, открытые теги закрываются.
+    Возвращает (подпись, была ли обрезка).
+    """
+    # Длина разметки не меньше длины видимого текста — короткие подписи не разбираем
+    if len(markup) <= limit // 2 or utf16_len(markup) <= limit or visible_len(markup) <= limit:
+        return markup, False
+
+    budget = max(limit - utf16_len(ellipsis), 0)
+    parts: List[str] = []
+    open_tags: List[str] = []
+    for match in _TOKEN.finditer(markup):
+        token = match.group()
+        if token.startswith("<") and len(token) > 1:
+            name_match = _TAG_NAME.match(token)
+            if name_match:
+                closing, name = name_match.group(1), name_match.group(2).lower()
+                if closing:
+                    if name in open_tags:
+                        del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name)]
+                elif not token.endswith("/>"):
+                    open_tags.append(name)
+            parts.append(token)
+            continue
+        if token.startswith("&") and len(token) > 1:
+            width = utf16_len(html.unescape(token))
+            if width > budget:
+                break
+            budget -= width
+            parts.append(token)
+            continue
+        width = utf16_len(token)
+        if width <= budget:
+            budget -= width
+            parts.append(token)
+            continue
+        parts.append(_cut_text(token, budget))
+        break
+
+    result = "".join(parts).rstrip()
+    # Теги, оставшиеся пустыми после обрезки, не нужны (Telegram не примет пустую ссылку)
+    while open_tags and re.search(r"<" + re.escape(open_tags[-1]) + r"\b[^<>]*>$", result, re.IGNORECASE):
+        result = result[:result.rindex("<")].rstrip()
+        open_tags.pop()
+    result += ellipsis + "".join(f"</{name}>" for name in reversed(open_tags))
+    return result, True
+
+
+class CaptionRenderer:
+    """
+    Сборщик подписей: основной текст + необрезаемый хвост через разделитель.
+    Если хвост сам не помещается в лимит, обрезается вся подпись целиком.
+    """
+
+    def __init__(self, limit: int = TELEGRAM_CAPTION_LIMIT, separator: str = "\n\n", ellipsis: str = ELLIPSIS):
+        self.limit = limit
+        self.separator = separator
+        self.ellipsis = ellipsis
+        self.truncated = 0
+
+    def render(self, body: str, tail: Sequence[Optional[str]] = ()) -> str:
+        tail_text = self.separator.join(part for part in tail if part)
+        caption = self.separator.join(part for part in (body, tail_text) if part)
+        if utf16_len(caption) <= self.limit or visible_len(caption) <= self.limit:
+            return caption
+        if body and tail_text:
+            body_limit = self.limit - visible_len(tail_text) - utf16_len(self.separator)
+            if body_limit > utf16_len(self.ellipsis):
+                new_body, cut = truncate_html(body, body_limit, self.ellipsis)
+                self.truncated += cut
+                return self.separator.join((new_body, tail_text))
+        caption, cut = truncate_html(caption, self.limit, self.ellipsis)
+        self.truncated += cut
+        return caption
+
+    def render_many(self, items: Iterable[Tuple[str, Sequence[Optional[str]]]]) -> List[str]:
+        """Пакетная сборка: [(текст, хвост), ...] -> [подпись, ...]."""
+        render = self.render
+        return [render(body, tail) for body, tail in items]
+
+
+_default_renderer = CaptionRenderer()
+
+
+def render_caption(body: str, tail: Sequence[Optional[str]] = ()) -> str:
+    return _default_renderer.render(body, tail)
+
+
+def render_captions(items: Iterable[Tuple[str, Sequence[Optional[str]]]]) -> List[str]:
+    return _default_renderer.render_many(items)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Бюджет времени импорта модулей публикации.
+
+Каждый модуль импортируется в отдельном холодном процессе с `python -X importtime`
+и без учетных данных в окружении: импорт не должен требовать переменных
+окружения, ходить в сеть или занимать больше IMPORT_TIME_BUDGET_MS.
+Из вывода importtime берется накопленное время самого модуля (с зависимостями).
+Код выхода 1, если хоть один модуль не импортируется или превысил бюджет.
+
+Запуск: python scripts/check_import_time.py [модуль ...]
+"""
+import os
+import subprocess
+import sys
+import time
+from typing import Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+IMPORT_TIME_MODULES = [
+    "B2_Content_Download",
+    "module1_preparation",
+    "module2_publication",
+    "post_record",
+    "caption_engine",
+    "clients",
+    "mp4_faststart",
+    "image_optimizer",
+]
+# Эти переменные убираются из окружения проверки: импорт должен обходиться без них
+_SECRET_ENV = ["S3_KEY_ID", "S3_APPLICATION_KEY", "S3_BUCKET_NAME", "TELEGRAM_TOKEN", "TELEGRAM_CHAT_ID"]
+
+
+def measure_import(module: str) -> Tuple[Optional[float], float, str]:
+    """(накопленное время импорта по importtime в мс или None при ошибке, время процесса в мс, stderr)."""
+    env = {key: value for key, value in os.environ.items() if key not in _SECRET_ENV}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=BASE_DIR, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        return None, wall_ms, result.stderr
+    cumulative_ms = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative_ms = int(fields[1]) / 1000
+    return cumulative_ms, wall_ms, result.stderr
+
+
+def main() -> int:
+    modules = sys.argv[1:] or IMPORT_TIME_MODULES
+    failed = []
+    print(f"⏱️ Бюджет импорта: {IMPORT_TIME_BUDGET_MS:.0f} мс на модуль (без учетных данных в окружении)")
+    for module in modules:
+        cumulative_ms, wall_ms, stderr = measure_import(module)
+        if cumulative_ms is None:
+            error = stderr.strip().splitlines()[-1] if stderr.strip() else "нет вывода"
+            print(f"❌ {module}: импорт не удался — {error}")
+            failed.append(module)
+            continue
+        within = cumulative_ms <= IMPORT_TIME_BUDGET_MS
+        print(f"{'✅' if within else '❌'} {module}: {cumulative_ms:.1f} мс импорта (процесс {wall_ms:.0f} мс)")
+        if not within:
+            failed.append(module)
+    if failed:
+        print(f"💥 Бюджет импорта нарушен: {', '.join(failed)}")
+        return 1
+    print("🏁 Все модули укладываются в бюджет импорта.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Ленивые клиенты B2 и Telegram: создаются при первом обращении, а не при импорте.
+
+Импорт модулей публикации больше не ходит в сеть и не требует учетных данных:
+проверка переменных окружения, авторизация в B2 и создание бота выполняются
+в get_bucket()/get_bot() один раз на процесс.
+
+Авторизация B2 хранится в SQLite (b2sdk.v2.SqliteAccountInfo, путь
+B2_ACCOUNT_INFO_PATH): следующий запуск переиспользует токен и id бакета
+без authorize_account и get_bucket_by_name. Токен B2 живет 24 часа; после
+B2_AUTH_MAX_AGE_HOURS авторизация выполняется заново, а если токен все же
+истек раньше, b2sdk сам переавторизуется по сохраненному ключу.
+B2_ACCOUNT_INFO_PATH="" — хранить авторизацию только в памяти (как раньше).
+Файл содержит ключ приложения, поэтому создается с правами 0600.
+"""
+import os
+import threading
+import time
+from typing import Any
+
+BASE_DIR = os.path.dirname(__file__)
+
+S3_KEY_ID = os.getenv("S3_KEY_ID")
+S3_APPLICATION_KEY = os.getenv("S3_APPLICATION_KEY")
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+S3_ENDPOINT = os.getenv("S3_ENDPOINT", "production")
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+B2_ACCOUNT_INFO_PATH = os.getenv("B2_ACCOUNT_INFO_PATH", os.path.join(BASE_DIR, ".cache", "b2_account_info.sqlite3"))
+B2_AUTH_MAX_AGE_HOURS = float(os.getenv("B2_AUTH_MAX_AGE_HOURS", "20"))
+
+_lock = threading.Lock()
+_b2_api: Any = None
+_bucket: Any = None
+_bot: Any = None
+
+
+def require_env(*names: str) -> None:
+    """Проверяет, что переменные окружения заданы; иначе RuntimeError, как прежде при импорте."""
+    missing = [name for name in names if not os.getenv(name)]
+    if missing:
+        raise RuntimeError(f"❌ Ошибка: Не установлены все необходимые переменные окружения! ({', '.join(missing)})")
+
+
+def _auth_marker_path() -> str:
+    return B2_ACCOUNT_INFO_PATH + ".authorized"
+
+
+def _auth_is_fresh(info) -> bool:
+    """Сохраненная авторизация выдана тем же ключом для того же realm и еще не устарела."""
+    try:
+        if info.get_application_key_id() != S3_KEY_ID or info.get_realm() != S3_ENDPOINT:
+            return False
+        info.get_account_auth_token()
+        authorized_at = os.path.getmtime(_auth_marker_path())
+    except Exception:
+        # MissingAccountData и отсутствие отметки — авторизации еще не было
+        return False
+    return time.time() - authorized_at < B2_AUTH_MAX_AGE_HOURS * 3600
+
+
+def _new_account_info():
+    import b2sdk.v2
+
+    if not B2_ACCOUNT_INFO_PATH:
+        return b2sdk.v2.InMemoryAccountInfo()
+    os.makedirs(os.path.dirname(B2_ACCOUNT_INFO_PATH) or ".", exist_ok=True)
+    if not os.path.exists(B2_ACCOUNT_INFO_PATH):
+        # Создаем файл заранее, чтобы SQLite унаследовал права 0600
+        os.close(os.open(B2_ACCOUNT_INFO_PATH, os.O_CREAT | os.O_WRONLY, 0o600))
+    try:
+        return b2sdk.v2.SqliteAccountInfo(file_name=B2_ACCOUNT_INFO_PATH)
+    except Exception as e:
+        print(f"⚠️ Хранилище авторизации B2 {B2_ACCOUNT_INFO_PATH} недоступно ({e}), авторизация только в памяти.")
+        return b2sdk.v2.InMemoryAccountInfo()
+
+
+def get_b2_api():
+    """Авторизованный B2Api (одна авторизация на процесс, токен переиспользуется между запусками)."""
+    global _b2_api
+    if _b2_api is not None:
+        return _b2_api
+    with _lock:
+        if _b2_api is None:
+            require_env("S3_KEY_ID", "S3_APPLICATION_KEY", "S3_BUCKET_NAME")
+            import b2sdk.v2
+
+            info = _new_account_info()
+            # AuthInfoCache хранит id бакетов рядом с авторизацией: get_bucket_by_name без запроса
+            b2_api = b2sdk.v2.B2Api(info, cache=b2sdk.v2.AuthInfoCache(info))
+            try:
+                if _auth_is_fresh(info):
+                    print("♻️ Используем сохраненную авторизацию B2.")
+                else:
+                    print("⚙️ Подключаемся к Backblaze B2...")
+                    b2_api.authorize_account(S3_ENDPOINT, S3_KEY_ID, S3_APPLICATION_KEY)
+                    if not isinstance(info, b2sdk.v2.InMemoryAccountInfo):
+                        with open(_auth_marker_path(), "w"):
+                            pass
+            except Exception as e:
+                raise RuntimeError(f"❌ Ошибка подключения к B2: {e}")
+            _b2_api = b2_api
+    return _b2_api
+
+
+def get_bucket():
+    """Бакет S3_BUCKET_NAME; id бакета кэшируется вместе с авторизацией."""
+    global _bucket
+    if _bucket is not None:
+        return _bucket
+    b2_api = get_b2_api()
+    with _lock:
+        if _bucket is None:
+            try:
+                _bucket = b2_api.get_bucket_by_name(S3_BUCKET_NAME)
+            except Exception as e:
+                raise RuntimeError(f"❌ Ошибка подключения к B2: {e}")
+            print(f"✅ Успешное подключение к B2 бакету: {S3_BUCKET_NAME}")
+    return _bucket
+
+
+def get_bot():
+    """Telegram Bot для TELEGRAM_TOKEN, создается один раз."""
+    global _bot
+    if _bot is None:
+        with _lock:
+            if _bot is None:
+                require_env("TELEGRAM_TOKEN")
+                from telegram import Bot
+                try:
+                    _bot = Bot(token=TELEGRAM_TOKEN)
+                except Exception as e:
+                    raise RuntimeError(f"❌ Ошибка инициализации Telegram бота: {e}")
+                print("✅ Telegram бот инициализирован.")
+    return _bot
+
+
+def reset_clients() -> None:
+    """Сбрасывает созданные клиенты (для тестов и долгоживущих сервисов при смене ключей)."""
+    global _b2_api, _bucket, _bot
+    with _lock:
+        _b2_api = _bucket = _bot = None
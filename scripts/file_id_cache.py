@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Кэш Telegram file_id по хешу содержимого файла.
+
+После первой успешной загрузки медиа Telegram возвращает file_id, по которому
+тот же файл можно отправлять повторно (в любой чат этого бота) без передачи
+байтов. Ключ кэша — вид медиа и SHA-1 содержимого (для файлов из B2 подходит
+contentSha1 из листинга).
+
+Кэш ограничен по размеру (вытеснение давно не использованных записей),
+хранится локально в JSON и может синхронизироваться с B2. Если Telegram
+отвергает устаревший file_id, запись удаляется и файл загружается заново.
+"""
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from typing import IO, Any, Awaitable, Callable, List, Optional, Sequence, Tuple, Union
+
+from telegram.error import BadRequest
+
+BASE_DIR = os.path.dirname(__file__)
+TELEGRAM_FILE_ID_CACHE_PATH = os.getenv("TELEGRAM_FILE_ID_CACHE_PATH",
+                                        os.path.join(BASE_DIR, ".cache", "telegram_file_ids.json"))
+TELEGRAM_FILE_ID_CACHE_SIZE = int(os.getenv("TELEGRAM_FILE_ID_CACHE_SIZE", "2000"))
+FILE_ID_CACHE_KEY = "config/telegram_file_ids.json"
+
+# Фрагменты текста ошибок Telegram об устаревшем/чужом file_id. Только конкретные формулировки:
+# прочие BadRequest, где упоминается file_id, не повод сбрасывать кэш и загружать файлы заново
+_STALE_FILE_ID_MARKERS = (
+    "wrong file identifier",
+    "wrong remote file",
+)
+
+
+def file_sha1(source: Union[str, IO[bytes]], chunk_size: int = 1024 * 1024) -> str:
+    """SHA-1 содержимого файла по пути или открытого файлового объекта (потоково)."""
+    digest = hashlib.sha1()
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+def is_stale_file_id_error(error: BaseException) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in _STALE_FILE_ID_MARKERS)
+
+
+def message_file_id(message, kind: str) -> Optional[str]:
+    """Извлекает file_id из отправленного сообщения (для фото — самый большой размер)."""
+    if message is None:
+        return None
+    if kind == "photo":
+        sizes = getattr(message, "photo", None)
+        return sizes[-1].file_id if sizes else None
+    media = getattr(message, kind, None)
+    return getattr(media, "file_id", None)
+
+
+class FileIdCache:
+    """LRU-кэш (вид медиа, SHA-1) -> file_id с сохранением в JSON."""
+
+    def __init__(self, path: Optional[str] = TELEGRAM_FILE_ID_CACHE_PATH,
+                 max_entries: int = TELEGRAM_FILE_ID_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(kind: str, sha1: str) -> str:
+        return f"{kind}:{sha1}"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def contains(self, kind: str, sha1: Optional[str]) -> bool:
+        """Есть ли запись (без учета в статистике попаданий и без сдвига в LRU)."""
+        return bool(sha1) and self._key(kind, sha1) in self._entries
+
+    def get(self, kind: str, sha1: Optional[str]) -> Optional[str]:
+        if not sha1:
+            return None
+        key = self._key(kind, sha1)
+        file_id = self._entries.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, kind: str, sha1: str, file_id: str) -> None:
+        key = self._key(kind, sha1)
+        if self._entries.get(key) != file_id:
+            self.dirty = True
+        self._entries[key] = file_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.dirty = True
+
+    def invalidate(self, kind: str, sha1: str) -> None:
+        if self._entries.pop(self._key(kind, sha1), None) is not None:
+            self.dirty = True
+
+    # ------------------------------------------------------------
+    # Сериализация и хранение
+    # ------------------------------------------------------------
+    def to_bytes(self) -> bytes:
+        return json.dumps({"version": 1, "entries": list(self._entries.items())},
+                          ensure_ascii=False).encode("utf-8")
+
+    def merge_bytes(self, raw: bytes) -> None:
+        """Добавляет записи из сериализованного кэша (текущие записи считаются более свежими)."""
+        data = json.loads(raw.decode("utf-8"))
+        current = self._entries
+        self._entries = OrderedDict()
+        for key, file_id in data.get("entries", []):
+            self._entries[key] = file_id
+        for key, file_id in current.items():
+            self._entries[key] = file_id
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self) -> "FileIdCache":
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    self.merge_bytes(f.read())
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Не удалось прочитать кэш file_id {self.path}: {e}")
+        return self
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self.to_bytes())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить кэш file_id {self.path}: {e}")
+
+    def load_from_b2(self, bucket) -> "FileIdCache":
+        """Подмешивает кэш из B2 (для эфемерных CI-раннеров)."""
+        try:
+            buffer = io.BytesIO()
+            bucket.download_file_by_name(FILE_ID_CACHE_KEY).save(buffer)
+            self.merge_bytes(buffer.getvalue())
+            print(f"ℹ️ Загружен кэш file_id из B2: {len(self)} записей.")
+        except Exception as e:
+            print(f"ℹ️ Кэш file_id в B2 не загружен ({e}). Начинаем с локального.")
+        return self
+
+    def save_to_b2(self, bucket) -> None:
+        if not self.dirty:
+            return
+        try:
+            bucket.upload_bytes(self.to_bytes(), FILE_ID_CACHE_KEY)
+            self.dirty = False
+            print(f"💾 Кэш file_id сохранен в B2: {len(self)} записей.")
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить кэш file_id в B2: {e}")
+
+
+async def send_with_file_ids(cache: FileIdCache, items: Sequence[Tuple[str, Optional[str], Union[str, IO[bytes]]]],
+                             send: Callable[[List[Any]], Awaitable[Any]]) -> Any:
+    """
+    Отправляет медиа, по возможности используя file_id из кэша.
+
+    items — список (вид медиа: 'photo'/'video', SHA-1 или None, локальный путь
+    или уже открытый файловый объект — он перематывается в начало и не закрывается).
+    send(refs) получает для каждого элемента либо file_id, либо открытый файл
+    и возвращает Message или список Message. Если Telegram отверг устаревший
+    file_id, записи удаляются и отправка повторяется с загрузкой файлов.
+    После успеха file_id из ответа сохраняются в кэш.
+    """
+    cached = [cache.get(kind, sha1) for kind, sha1, _path in items]
+    for use_cache in (True, False):
+        handles = []
+        try:
+            refs = []
+            for (_kind, _sha1, path), file_id in zip(items, cached):
+                if use_cache and file_id:
+                    refs.append(file_id)
+                elif not isinstance(path, str):
+                    path.seek(0)
+                    refs.append(path)
+                else:
+                    handle = open(path, "rb")
+                    handles.append(handle)
+                    refs.append(handle)
+            result = await send(refs)
+        except BadRequest as e:
+            if use_cache and any(cached) and is_stale_file_id_error(e):
+                print(f"♻️ Telegram отклонил закэшированный file_id ({e}). Загружаем файлы заново.")
+                for (kind, sha1, _path), file_id in zip(items, cached):
+                    if file_id:
+                        cache.invalidate(kind, sha1)
+                continue
+            raise
+        finally:
+            for handle in handles:
+                handle.close()
+
+        messages = result if isinstance(result, (list, tuple)) else [result]
+        for (kind, sha1, _path), message in zip(items, messages):
+            file_id = message_file_id(message, kind)
+            if sha1 and file_id:
+                cache.put(kind, sha1, file_id)
+        if any(cached) and use_cache:
+            print(f"⚡ Использованы закэшированные file_id: {sum(1 for f in cached if f)} из {len(items)}.")
+        return result
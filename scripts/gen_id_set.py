@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Компактное множество generation_id формата ГГГГММДД-ЧЧММ.
+
+Каждый gen_id хранится как число минут от GEN_ID_EPOCH в отсортированном
+array('I') (4 байта на ID вместо строки в set). Проверка вхождения — бинарный
+поиск, разность со списком кандидатов — O(k log n); gen_id разбирается
+срезами и int(), без strptime. Добавленные ID копятся в буфере и вливаются
+в массив одним слиянием при обходе или сериализации, а не вставкой O(n) на каждый.
+ID, не подходящие под формат, хранятся отдельно как строки.
+
+Бинарный формат (sidecar в B2):
+    b"PID1" | count: uint32 | extras_len: uint32 | extras (JSON) | zlib(дельты, uint32 LE)
+Дельты между соседними значениями сжимаются zlib до долей байта на ID.
+"""
+import json
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from heapq import merge
+from itertools import accumulate, chain
+from typing import Iterable, Iterator, Optional, Set
+
+from b2_scan import GEN_ID_FORMAT, GEN_ID_PATTERN
+
+GEN_ID_EPOCH = datetime(2000, 1, 1)
+_EPOCH_ORDINAL = GEN_ID_EPOCH.toordinal()
+_MAGIC = b"PID1"
+_HEADER = struct.Struct("<4sII")
+_TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+
+def gen_id_to_minutes(gen_id: str) -> Optional[int]:
+    """Переводит gen_id в минуты от GEN_ID_EPOCH; для некорректных ID — None."""
+    if not isinstance(gen_id, str) or not GEN_ID_PATTERN.fullmatch(gen_id):
+        return None
+    hour, minute = int(gen_id[9:11]), int(gen_id[11:13])
+    if hour > 23 or minute > 59:
+        return None
+    try:
+        # date() проверяет календарь (месяц, число, високосный год), как и strptime
+        days = date(int(gen_id[0:4]), int(gen_id[4:6]), int(gen_id[6:8])).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+    minutes = (days * 24 + hour) * 60 + minute
+    return minutes if 0 <= minutes <= 0xFFFFFFFF else None
+
+
+def minutes_to_gen_id(minutes: int) -> str:
+    return (GEN_ID_EPOCH + timedelta(minutes=minutes)).strftime(GEN_ID_FORMAT)
+
+
+class GenIdSet:
+    """Отсортированный массив минут + буфер новых минут + множество нестандартных ID."""
+
+    def __init__(self, gen_ids: Iterable[str] = ()):
+        values = set()
+        self._extras: Set[str] = set()
+        for gen_id in gen_ids:
+            minutes = gen_id_to_minutes(gen_id)
+            if minutes is None:
+                self._extras.add(gen_id)
+            else:
+                values.add(minutes)
+        self._minutes = array(_TYPECODE, sorted(values))
+        # Добавленные после построения минуты (не пересекаются с _minutes)
+        self._pending: Set[int] = set()
+
+    def _flush(self) -> None:
+        """Вливает буфер добавленных минут в отсортированный массив за O(n + k log k)."""
+        if self._pending:
+            self._minutes = array(_TYPECODE, merge(self._minutes, sorted(self._pending)))
+            self._pending = set()
+
+    def __contains__(self, gen_id) -> bool:
+        minutes = gen_id_to_minutes(gen_id)
+        if minutes is None:
+            return gen_id in self._extras
+        if minutes in self._pending:
+            return True
+        index = bisect_left(self._minutes, minutes)
+        return index < len(self._minutes) and self._minutes[index] == minutes
+
+    def __len__(self) -> int:
+        return len(self._minutes) + len(self._pending) + len(self._extras)
+
+    def __iter__(self) -> Iterator[str]:
+        self._flush()
+        for minutes in self._minutes:
+            yield minutes_to_gen_id(minutes)
+        yield from sorted(self._extras)
+
+    def add(self, gen_id: str) -> None:
+        minutes = gen_id_to_minutes(gen_id)
+        if minutes is None:
+            self._extras.add(gen_id)
+            return
+        index = bisect_left(self._minutes, minutes)
+        if index == len(self._minutes) or self._minutes[index] != minutes:
+            self._pending.add(minutes)
+
+    def update(self, gen_ids: Iterable[str]) -> None:
+        for gen_id in gen_ids:
+            self.add(gen_id)
+
+    def unpublished(self, candidates: Iterable[str]) -> Set[str]:
+        """Кандидаты, которых нет в множестве (замена `set(candidates) - published_ids`)."""
+        return {gen_id for gen_id in candidates if gen_id not in self}
+
+    def __rsub__(self, other) -> Set[str]:
+        return self.unpublished(other)
+
+    # ------------------------------------------------------------
+    # Бинарная сериализация
+    # ------------------------------------------------------------
+    def to_bytes(self) -> bytes:
+        self._flush()
+        deltas = array(_TYPECODE, (b - a for a, b in zip(chain((0,), self._minutes), self._minutes)))
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        extras = json.dumps(sorted(self._extras), ensure_ascii=False).encode("utf-8")
+        return _HEADER.pack(_MAGIC, len(self._minutes), len(extras)) + extras + zlib.compress(deltas.tobytes(), 9)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "GenIdSet":
+        """Разбирает sidecar; при несоответствии формата выбрасывает ValueError."""
+        if len(raw) < _HEADER.size:
+            raise ValueError("sidecar слишком короткий")
+        magic, count, extras_len = _HEADER.unpack_from(raw)
+        if magic != _MAGIC:
+            raise ValueError(f"неизвестная сигнатура sidecar: {magic!r}")
+        offset = _HEADER.size
+        if len(raw) < offset + extras_len:
+            raise ValueError(f"sidecar обрезан: нестандартные ID занимают {extras_len} байт")
+        extras = json.loads(raw[offset:offset + extras_len].decode("utf-8"))
+        if not isinstance(extras, list) or not all(isinstance(gen_id, str) for gen_id in extras):
+            raise ValueError("нестандартные ID в sidecar должны быть списком строк")
+        deltas = array(_TYPECODE)
+        try:
+            deltas.frombytes(zlib.decompress(raw[offset + extras_len:]))
+        except zlib.error as e:
+            raise ValueError(f"поврежденные данные sidecar: {e}") from e
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        if len(deltas) != count:
+            raise ValueError(f"ожидалось {count} ID, прочитано {len(deltas)}")
+        result = cls()
+        try:
+            result._minutes = array(_TYPECODE, accumulate(deltas))
+        except OverflowError as e:
+            # Сумма дельт поврежденного sidecar вышла за 32 бита
+            raise ValueError(f"поврежденные данные sidecar: {e}") from e
+        result._extras = set(extras)
+        return result
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Бандл группы generation_id: все файлы группы в одном объекте {gen_id}.bundle.
+
+Формат (без сжатия — медиа уже сжаты):
+    заголовок: b"A1GB" | версия: uint8 | длина индекса: uint32 LE   (9 байт, смещение 0)
+    индекс (JSON, смещение 9): {"gen_id": ..., "members": [
+        {"suffix": ".json", "offset": ..., "size": ..., "sha1": ...}, ...]}
+    данные файлов подряд, в порядке индекса (offset — от начала бандла)
+
+Индекс лежит в начале, поэтому бандл читается либо одним запросом (поток
+разбирается на лету и раскладывается по целевым файлам), либо запросом
+головы с индексом и диапазонами только нужных членов.
+Прежняя раскладка из отдельных файлов остается рабочей.
+"""
+import hashlib
+import io
+import json
+import struct
+from typing import Dict, IO, List, Optional, Tuple, Union
+
+BUNDLE_MAGIC = b"A1GB"
+BUNDLE_VERSION = 1
+_HEADER = struct.Struct("<4sBI")
+# Сколько байт читать первым запросом: индекс четырех файлов заведомо меньше
+BUNDLE_HEAD_BYTES = 64 * 1024
+
+# Куда положить член бандла: путь или открытый файловый объект
+MemberTarget = Union[str, IO[bytes]]
+# Содержимое члена при упаковке: байты или открытый файл (читается кусками с начала)
+MemberSource = Union[bytes, IO[bytes]]
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BundleError(ValueError):
+    """Поврежденный или несовместимый бандл."""
+
+
+def _parse_header(head: bytes) -> int:
+    if len(head) < _HEADER.size:
+        raise BundleError("бандл короче заголовка")
+    magic, version, index_len = _HEADER.unpack_from(head)
+    if magic != BUNDLE_MAGIC:
+        raise BundleError(f"неизвестная сигнатура бандла: {magic!r}")
+    if version != BUNDLE_VERSION:
+        raise BundleError(f"неподдерживаемая версия бандла: {version}")
+    return index_len
+
+
+def _parse_index(raw: bytes) -> Dict[str, Dict]:
+    members = json.loads(raw.decode("utf-8")).get("members", [])
+    return {member["suffix"]: member for member in members}
+
+
+def member_size_and_sha1(data: MemberSource) -> Tuple[int, str]:
+    if isinstance(data, (bytes, bytearray)):
+        return len(data), hashlib.sha1(data).hexdigest()
+    digest = hashlib.sha1()
+    size = 0
+    data.seek(0)
+    for chunk in iter(lambda: data.read(_COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def pack_group(gen_id: str, members: Dict[str, MemberSource], out: IO[bytes]) -> Dict[str, Dict]:
+    """
+    Записывает бандл из {суффикс: содержимое} в out. Возвращает индекс.
+    Файловые члены копируются кусками, поэтому видео не загружается в память целиком.
+    """
+    entries: List[Dict] = []
+    for suffix, data in members.items():
+        size, sha1 = member_size_and_sha1(data)
+        entries.append({"suffix": suffix, "size": size, "sha1": sha1})
+
+    # Смещения зависят от длины индекса, а длина индекса — от записи смещений: считаем до стабилизации
+    index_len = 0
+    while True:
+        offset = _HEADER.size + index_len
+        for entry in entries:
+            entry["offset"] = offset
+            offset += entry["size"]
+        raw_index = json.dumps({"gen_id": gen_id, "members": entries}, separators=(",", ":")).encode("utf-8")
+        if len(raw_index) == index_len:
+            break
+        index_len = len(raw_index)
+
+    out.write(_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, index_len))
+    out.write(raw_index)
+    for suffix, data in members.items():
+        if isinstance(data, (bytes, bytearray)):
+            out.write(data)
+            continue
+        data.seek(0)
+        for chunk in iter(lambda: data.read(_COPY_CHUNK_SIZE), b""):
+            out.write(chunk)
+    return {entry["suffix"]: entry for entry in entries}
+
+
+def read_index(bucket, file_key: str) -> Dict[str, Dict]:
+    """Читает индекс бандла из B2 одним (реже двумя) запросом диапазона."""
+    head = _download_range(bucket, file_key, 0, BUNDLE_HEAD_BYTES - 1)
+    index_len = _parse_header(head)
+    end = _HEADER.size + index_len
+    if len(head) < end:
+        head += _download_range(bucket, file_key, len(head), end - 1)
+    return _parse_index(head[_HEADER.size:end])
+
+
+def _download_range(bucket, file_key: str, start: int, end: int) -> bytes:
+    buffer = io.BytesIO()
+    bucket.download_file_by_name(file_key, range_=(start, end)).save(buffer)
+    return buffer.getvalue()
+
+
+class _Sink:
+    """Целевой файл члена бандла с проверкой SHA-1 при закрытии."""
+
+    def __init__(self, member: Dict, target: Optional[MemberTarget]):
+        self.member = member
+        self.remaining = member["size"]
+        self.digest = hashlib.sha1()
+        self._owned = isinstance(target, str)
+        self.file = open(target, "wb") if self._owned else target
+
+    def write(self, data: bytes) -> int:
+        if len(data) > self.remaining:
+            raise BundleError(f"член {self.member['suffix']} длиннее, чем указано в индексе")
+        self.digest.update(data)
+        if self.file is not None:
+            self.file.write(data)
+        self.remaining -= len(data)
+        return len(data)
+
+    def finish(self) -> None:
+        if self.remaining:
+            self.abort()
+            raise BundleError(f"член {self.member['suffix']} получен не полностью")
+        if self._owned:
+            self.file.close()
+        elif self.file is not None:
+            self.file.seek(0)
+        if self.digest.hexdigest() != self.member["sha1"]:
+            raise BundleError(f"SHA-1 члена {self.member['suffix']} не совпадает с индексом")
+
+    def abort(self) -> None:
+        if self._owned and not self.file.closed:
+            self.file.close()
+
+    # Приемник потока диапазона в b2sdk (как у BundleSplitter)
+    def flush(self) -> None:
+        pass
+
+    def tell(self) -> int:
+        return self.member["size"] - self.remaining
+
+    def seekable(self) -> bool:
+        return False
+
+
+class BundleSplitter:
+    """
+    Файлоподобный приемник для потока бандла: по мере поступления байтов
+    разбирает заголовок и индекс и раскладывает члены по targets
+    ({суффикс: путь или файловый объект}); члены без цели только проверяются.
+    """
+
+    def __init__(self, targets: Dict[str, MemberTarget]):
+        self.targets = targets
+        self.index: Optional[Dict[str, Dict]] = None
+        self._buffer = bytearray()
+        self._position = 0
+        self._queue: List[Dict] = []
+        self._sink: Optional[_Sink] = None
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while view:
+            if self.index is None:
+                self._buffer += view
+                view = self._try_parse_index()
+                if self.index is None:
+                    break
+                continue
+            if self._sink is None:
+                if not self._queue:
+                    raise BundleError("лишние данные после последнего члена бандла")
+                member = self._queue.pop(0)
+                if member["offset"] != self._position:
+                    raise BundleError(f"член {member['suffix']} не на ожидаемом смещении")
+                self._sink = _Sink(member, self.targets.get(member["suffix"]))
+            chunk = view[:self._sink.remaining]
+            self._sink.write(bytes(chunk))
+            self._position += len(chunk)
+            view = view[len(chunk):]
+            if self._sink.remaining == 0:
+                self._sink.finish()
+                self._sink = None
+                self._finish_empty_members()
+        return len(data)
+
+    def _finish_empty_members(self) -> None:
+        # Члены нулевого размера не получат ни одного байта — закрываем их сразу
+        while self._queue and self._queue[0]["size"] == 0:
+            member = self._queue.pop(0)
+            _Sink(member, self.targets.get(member["suffix"])).finish()
+
+    def _try_parse_index(self) -> memoryview:
+        if len(self._buffer) < _HEADER.size:
+            return memoryview(b"")
+        end = _HEADER.size + _parse_header(bytes(self._buffer[:_HEADER.size]))
+        if len(self._buffer) < end:
+            return memoryview(b"")
+        self.index = _parse_index(bytes(self._buffer[_HEADER.size:end]))
+        self._queue = sorted(self.index.values(), key=lambda member: member["offset"])
+        rest = bytes(self._buffer[end:])
+        self._buffer = bytearray()
+        self._position = end
+        self._finish_empty_members()
+        return memoryview(rest)
+
+    def close(self) -> None:
+        """Проверяет, что бандл получен целиком."""
+        if self._sink is not None:
+            self._sink.abort()
+        if self.index is None or self._sink is not None or self._queue:
+            raise BundleError("бандл получен не полностью")
+
+    # b2sdk может запрашивать эти методы у приемника
+    def flush(self) -> None:
+        pass
+
+    def tell(self) -> int:
+        return self._position + len(self._buffer)
+
+    def seekable(self) -> bool:
+        return False
+
+
+def fetch_bundle(bucket, file_key: str, targets: Dict[str, MemberTarget],
+                 writer_wrapper=None) -> Dict[str, Dict]:
+    """
+    Скачивает бандл одним запросом, раскладывая члены по targets.
+    writer_wrapper (например, обертка с отменой) оборачивает приемник потока.
+    """
+    splitter = BundleSplitter(targets)
+    downloaded_file = bucket.download_file_by_name(file_key)
+    downloaded_file.save(writer_wrapper(splitter) if writer_wrapper else splitter, allow_seeking=False)
+    splitter.close()
+    return splitter.index
+
+
+def fetch_bundle_members(bucket, file_key: str, targets: Dict[str, MemberTarget],
+                         index: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+    """
+    Скачивает только нужные члены бандла диапазонами (после чтения индекса).
+    Ответ пишется в цель потоком, с проверкой SHA-1, без буфера на весь член.
+    """
+    index = index if index is not None else read_index(bucket, file_key)
+    for suffix, target in targets.items():
+        member = index.get(suffix)
+        if member is None:
+            raise BundleError(f"в бандле {file_key} нет члена {suffix}")
+        sink = _Sink(member, target)
+        try:
+            if member["size"]:
+                downloaded_file = bucket.download_file_by_name(
+                    file_key, range_=(member["offset"], member["offset"] + member["size"] - 1))
+                downloaded_file.save(sink, allow_seeking=False)
+            sink.finish()
+        except BaseException:
+            sink.abort()
+            raise
+    return index
+
+
+def unpack_bytes(raw: bytes) -> Dict[str, bytes]:
+    """Разбирает бандл целиком из памяти: {суффикс: содержимое} (для проверок и утилит)."""
+    index_len = _parse_header(raw)
+    index = _parse_index(raw[_HEADER.size:_HEADER.size + index_len])
+    result = {}
+    for suffix, member in index.items():
+        data = raw[member["offset"]:member["offset"] + member["size"]]
+        if hashlib.sha1(data).hexdigest() != member["sha1"]:
+            raise BundleError(f"SHA-1 члена {suffix} не совпадает с индексом")
+        result[suffix] = data
+    return result
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Оптимизация изображений перед отправкой в Telegram.
+
+Генератор сохраняет картинки как PNG на несколько мегабайт, а Telegram все
+равно пережимает фото в JPEG со стороной до 2560 px. Здесь такие картинки
+заранее уменьшаются до IMAGE_MAX_SIDE и перекодируются в IMAGE_FORMAT с
+качеством IMAGE_QUALITY: загрузка короче и по байтам, и по времени.
+Маленькие картинки в пределах лимитов (меньше IMAGE_MIN_BYTES) не трогаются,
+а результат, который не меньше исходника, отбрасывается.
+
+Декодирование и сжатие — CPU-работа, поэтому идет в пуле процессов и не
+блокирует цикл asyncio. Результаты кэшируются в MediaCache по SHA-1
+исходника и настройкам сжатия; «выгоды нет» кэшируется пустой записью.
+
+Pillow — необязательная зависимость: без него (или при IMAGE_OPTIMIZE=0)
+картинки отправляются как есть.
+"""
+import asyncio
+import importlib.util
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from media_cache import MediaCache
+
+BASE_DIR = os.path.dirname(__file__)
+# IMAGE_OPTIMIZE=0 отключает стадию
+IMAGE_OPTIMIZE = os.getenv("IMAGE_OPTIMIZE", "1").strip().lower() not in ("0", "false", "no")
+# Длинная сторона после уменьшения: Telegram хранит фото не больше 2560 px
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2560"))
+# JPEG или WEBP
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").strip().upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "88"))
+# Картинки меньше этого размера и в пределах IMAGE_MAX_SIDE отправляются как есть
+IMAGE_MIN_BYTES = int(os.getenv("IMAGE_MIN_BYTES", str(512 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "images"))
+
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+# Картинка для отправки: путь или открытый файловый объект
+ImageSource = Union[str, IO[bytes]]
+
+
+class ImageResult(NamedTuple):
+    source: ImageSource  # что отправлять: оптимизированная копия или исходник
+    original_bytes: int
+    optimized_bytes: int  # равно original_bytes, если картинка не менялась
+    from_cache: bool
+
+    @property
+    def optimized(self) -> bool:
+        return self.optimized_bytes < self.original_bytes
+
+
+def _optimize_bytes(data: bytes, max_side: int, image_format: str, quality: int, min_bytes: int) -> bytes:
+    """
+    Выполняется в процессе пула. Возвращает сжатую картинку или b"", если
+    картинка уже в пределах лимитов либо перекодирование не дало выигрыша.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        oversized = max(image.size) > max_side
+        if not oversized and len(data) < min_bytes:
+            return b""
+        image.load()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # У JPEG нет прозрачности: подкладываем белый фон, как это сделает клиент Telegram
+            rgba = image.convert("RGBA")
+            converted = Image.new("RGB", rgba.size, (255, 255, 255))
+            converted.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            converted = image.convert("RGB")
+        if oversized:
+            converted.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        options = {"quality": quality}
+        if image_format == "JPEG":
+            options.update(optimize=True, progressive=True)
+        else:
+            options.update(method=4)
+        converted.save(output, format=image_format, **options)
+    result = output.getvalue()
+    return result if len(result) < len(data) else b""
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_warned_unavailable = False
+
+
+def image_optimizer_enabled() -> bool:
+    """Включена ли стадия: IMAGE_OPTIMIZE и установлен Pillow (предупреждение печатается один раз)."""
+    global _warned_unavailable
+    if not IMAGE_OPTIMIZE:
+        return False
+    if importlib.util.find_spec("PIL") is None:
+        if not _warned_unavailable:
+            print("ℹ️ Pillow не установлен: картинки отправляются без оптимизации.")
+            _warned_unavailable = True
+        return False
+    return True
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Общий пул процессов для сжатия картинок (создается при первом обращении)."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(IMAGE_WORKERS, 1))
+    return _pool
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _read_source(source: ImageSource) -> bytes:
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    source.seek(0)
+    data = source.read()
+    source.seek(0)
+    return data
+
+
+def optimized_path(path: str, image_format: str = IMAGE_FORMAT) -> str:
+    """Путь оптимизированной копии рядом с исходником: {имя}.opt.jpg."""
+    root, _ext = os.path.splitext(path)
+    return f"{root}.opt{_EXTENSIONS.get(image_format, '.img')}"
+
+
+class ImageOptimizer:
+    """Сжатие картинок в пуле процессов с кэшем результатов по SHA-1 исходника."""
+
+    def __init__(self, max_side: int = IMAGE_MAX_SIDE, image_format: str = IMAGE_FORMAT,
+                 quality: int = IMAGE_QUALITY, min_bytes: int = IMAGE_MIN_BYTES,
+                 cache: Optional[MediaCache] = None):
+        if image_format not in _EXTENSIONS:
+            raise ValueError(f"IMAGE_FORMAT должен быть одним из {sorted(_EXTENSIONS)}, а не {image_format!r}")
+        self.max_side = max_side
+        self.image_format = image_format
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.cache = cache if cache is not None else MediaCache(directory=IMAGE_CACHE_DIR)
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def _key(self, sha1: Optional[str]) -> Optional[str]:
+        if not sha1:
+            return None
+        return f"img-{sha1.lower()}-{self.max_side}-{self.image_format.lower()}-q{self.quality}"
+
+    async def optimize(self, source: ImageSource, sha1: Optional[str] = None) -> ImageResult:
+        """
+        Сжимает одну картинку. Для пути оптимизированная копия пишется в
+        optimized_path(path), для файлового объекта — в новый буфер в памяти.
+        """
+        data = await asyncio.to_thread(_read_source, source)
+
+        def compress(f: IO[bytes]) -> None:
+            f.write(get_image_pool().submit(_optimize_bytes, data, self.max_side, self.image_format,
+                                            self.quality, self.min_bytes).result())
+
+        optimized, from_cache = await asyncio.to_thread(self.cache.fetch_bytes, self._key(sha1), compress)
+        self.bytes_before += len(data)
+        if not optimized:
+            self.bytes_after += len(data)
+            return ImageResult(source, len(data), len(data), from_cache)
+        self.bytes_after += len(optimized)
+        if isinstance(source, str):
+            target = optimized_path(source, self.image_format)
+            with open(target, "wb") as f:
+                f.write(optimized)
+            return ImageResult(target, len(data), len(optimized), from_cache)
+        buffer = io.BytesIO(optimized)
+        buffer.name = f"image{_EXTENSIONS[self.image_format]}"
+        return ImageResult(buffer, len(data), len(optimized), from_cache)
+
+    async def optimize_many(self, items: Sequence[Tuple[ImageSource, Optional[str]]]) -> List[ImageResult]:
+        """Сжимает картинки параллельно; при ошибке картинка остается исходной."""
+        results = await asyncio.gather(*(self.optimize(source, sha1) for source, sha1 in items),
+                                       return_exceptions=True)
+        final = []
+        for (source, _sha1), result in zip(items, results):
+            if isinstance(result, BaseException):
+                print(f"  ⚠️ Не удалось оптимизировать картинку, отправляем исходник: {result}")
+                size = await asyncio.to_thread(lambda: len(_read_source(source)))
+                result = ImageResult(source, size, size, False)
+            final.append(result)
+        return final
+
+    def stats(self) -> str:
+        saved = self.bytes_before - self.bytes_after
+        return (f"{self.bytes_before / 1024 / 1024:.1f} МБ → {self.bytes_after / 1024 / 1024:.1f} МБ "
+                f"(−{saved / 1024 / 1024:.1f} МБ загрузки)")
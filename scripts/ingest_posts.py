@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Стадия подготовки: нормализует JSON групп в записи постов {gen_id}_post.json.
+
+Для каждой группы с JSON (отдельным файлом или внутри бандла), у которой еще
+нет записи поста, скачивает JSON, прогоняет через post_record.normalize_post
+и загружает запись рядом. Публикаторы затем берут готовую подпись и опрос,
+не разбирая текст во время публикации.
+
+Переменные окружения: S3_KEY_ID, S3_APPLICATION_KEY, S3_BUCKET_NAME,
+S3_ENDPOINT, INGEST_FOLDERS (по умолчанию B2_SCAN_FOLDERS),
+INGEST_FORCE=1 — пересоздать существующие записи (например, после смены схемы).
+"""
+import io
+import json
+import os
+
+from clients import get_bucket
+from b2_scan import BUNDLE_SUFFIX, POST_SUFFIX, SCAN_FOLDERS, parse_folder_list, scan_folder
+from group_bundle import fetch_bundle_members
+from post_record import POST_SCHEMA_VERSION, dump_post_record, normalize_post
+
+INGEST_FOLDERS = parse_folder_list(os.getenv("INGEST_FOLDERS", "")) or SCAN_FOLDERS
+INGEST_FORCE = os.getenv("INGEST_FORCE", "").strip().lower() in ("1", "true", "yes")
+
+
+def _group_json(bucket, manifest) -> bytes:
+    """Содержимое JSON группы: отдельный файл или член бандла."""
+    buffer = io.BytesIO()
+    if ".json" in manifest.files:
+        bucket.download_file_by_name(manifest.files[".json"].file_name).save(buffer)
+    else:
+        fetch_bundle_members(bucket, manifest.bundle.file_name, {".json": buffer})
+    return buffer.getvalue()
+
+
+def ingest_manifest(bucket, manifest) -> None:
+    data = json.loads(_group_json(bucket, manifest).decode("utf-8"))
+    record = normalize_post(data, manifest.gen_id)
+    record_key = manifest.key(POST_SUFFIX)
+    bucket.upload_bytes(dump_post_record(record), record_key)
+    print(f"📝 {record_key}: формат {record['source_format']}, подпись {len(record['caption'])} символов")
+
+
+def main():
+    bucket = get_bucket()
+
+    created = failed = 0
+    for folder in INGEST_FOLDERS:
+        manifests = scan_folder(bucket, folder)
+        candidates = [m for _gen_id, m in sorted(manifests.items())
+                      if (".json" in m.files or BUNDLE_SUFFIX in m.files)
+                      and (INGEST_FORCE or POST_SUFFIX not in m.files)]
+        print(f"🔎 Папка {folder}: групп {len(manifests)}, к нормализации {len(candidates)} "
+              f"(схема {POST_SCHEMA_VERSION})")
+        for manifest in candidates:
+            try:
+                ingest_manifest(bucket, manifest)
+                created += 1
+            except Exception as e:
+                print(f"⚠️ Ошибка нормализации группы {manifest.gen_id}: {e}")
+                failed += 1
+    print(f"🏁 Создано записей постов: {created}, с ошибками: {failed}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Локальный кэш медиафайлов из B2 с адресацией по содержимому.
+
+Ключ записи — contentSha1 файла (или, если его нет, B2 file id: он меняется
+при каждой новой версии файла). Повторная попытка опубликовать ту же группу
+берет файлы из кэша и не тратит исходящий трафик B2.
+
+Запись атомарна: файл скачивается во временный файл внутри каталога кэша и
+переносится на место через os.replace, поэтому прерванная загрузка не
+оставляет битых записей. Вытеснение — по возрасту (MEDIA_CACHE_MAX_AGE_HOURS)
+и по суммарному размеру (MEDIA_CACHE_MAX_BYTES), начиная с давно не
+использованных; время использования — mtime записи, обновляется при попадании.
+Частичные файлы докачки не считаются записями: они не вытесняются по размеру
+и удаляются только после MEDIA_CACHE_PARTIAL_MAX_AGE_HOURS без изменений.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, IO, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(__file__)
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", os.path.join(BASE_DIR, ".cache", "media"))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+MEDIA_CACHE_MAX_AGE_HOURS = float(os.getenv("MEDIA_CACHE_MAX_AGE_HOURS", "72"))
+# MEDIA_CACHE_DISABLED=1 отключает кэш (все файлы скачиваются заново)
+MEDIA_CACHE_DISABLED = os.getenv("MEDIA_CACHE_DISABLED", "").strip().lower() in ("1", "true", "yes")
+# Частичные файлы докачки (fetch_to_path) живут отдельно от записей: удаляются только по этому сроку
+MEDIA_CACHE_PARTIAL_MAX_AGE_HOURS = float(os.getenv("MEDIA_CACHE_PARTIAL_MAX_AGE_HOURS", "72"))
+
+_TMP_PREFIX = ".tmp-"
+# {ключ}.part, {ключ}.part.json и {ключ}.part.json.tmp от download_ranged
+_PARTIAL_SUFFIXES = (".part", ".part.json", ".part.json.tmp")
+
+
+def cache_key(content_sha1: Optional[str] = None, file_id: Optional[str] = None) -> Optional[str]:
+    """Ключ кэша: SHA-1 содержимого, иначе id версии файла в B2; None — файл не кэшируется."""
+    if content_sha1:
+        return f"sha1-{content_sha1.lower()}"
+    if file_id:
+        return "id-" + "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in file_id)
+    return None
+
+
+class MediaCache:
+    """Каталог вида {dir}/{2 символа}/{ключ} с LRU-вытеснением по размеру и возрасту."""
+
+    def __init__(self, directory: str = MEDIA_CACHE_DIR,
+                 max_bytes: int = MEDIA_CACHE_MAX_BYTES,
+                 max_age_hours: float = MEDIA_CACHE_MAX_AGE_HOURS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[-2:], key)
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Путь к записи (и отметка об использовании) или None."""
+        if not key:
+            return None
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.utime(path)
+        except OSError:
+            return None
+        self.hits += 1
+        self.bytes_saved += size
+        return path
+
+    def contains(self, key: Optional[str]) -> bool:
+        """Есть ли запись (без отметки об использовании и без учета в статистике)."""
+        return bool(key) and not MEDIA_CACHE_DISABLED and os.path.exists(self._path(key))
+
+    def new_temp_file(self) -> str:
+        """
+        Пустой временный файл внутри каталога кэша для put (та же файловая
+        система, поэтому перенос атомарный). Брошенные удаляет evict.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=self.directory)
+        os.close(fd)
+        return tmp_path
+
+    def put(self, key: str, tmp_path: str, dest_path: Optional[str] = None) -> str:
+        """
+        Атомарно переносит готовый и уже проверенный файл tmp_path (из
+        new_temp_file) в запись key и кладет ее в dest_path, если он передан.
+        Для файлов, которые заполняются не по одному, а общим потоком.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self.misses += 1
+        if dest_path is not None:
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            _link_or_copy(path, dest_path)
+        return path
+
+    def _store(self, key: str, fill: Callable[[IO[bytes]], None], sha1: Optional[str] = None) -> str:
+        """Заполняет временный файл через fill(f) и атомарно переносит его в кэш."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=_TMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                fill(f)
+            if sha1 and _file_sha1(tmp_path) != sha1.lower():
+                raise ValueError(f"SHA-1 скачанного файла не совпадает с ожидаемым ({key})")
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def fetch(self, key: Optional[str], dest_path: str, download: Callable[[IO[bytes]], None],
+              sha1: Optional[str] = None) -> bool:
+        """
+        Кладет файл по ключу в dest_path: из кэша, а при промахе — через
+        download(f), который пишет содержимое в открытый файл. При переданном
+        sha1 скачанное сверяется с ним до записи в кэш.
+        Возвращает True, если файл взят из кэша.
+        """
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if not key or MEDIA_CACHE_DISABLED:
+            with open(dest_path, "wb+") as f:
+                download(f)
+            return False
+        cached_path = self.get(key)
+        if cached_path is not None:
+            _link_or_copy(cached_path, dest_path)
+            return True
+        self.misses += 1
+        _link_or_copy(self._store(key, download, sha1), dest_path)
+        return False
+
+    def fetch_bytes(self, key: Optional[str], download: Callable[[IO[bytes]], None],
+                    sha1: Optional[str] = None) -> Tuple[bytes, bool]:
+        """
+        Как fetch, но без файла назначения: возвращает (содержимое, взято ли из кэша).
+        Для небольших файлов (JSON групп), которые дальше разбираются в памяти.
+        """
+        if not key or MEDIA_CACHE_DISABLED:
+            buffer = io.BytesIO()
+            download(buffer)
+            return buffer.getvalue(), False
+        cached_path = self.get(key)
+        from_cache = cached_path is not None
+        if not from_cache:
+            self.misses += 1
+            cached_path = self._store(key, download, sha1)
+        with open(cached_path, "rb") as f:
+            return f.read(), from_cache
+
+    def fetch_to_path(self, key: Optional[str], dest_path: str, download_to: Callable[[str], None]) -> bool:
+        """
+        Как fetch, но download_to(path) сам создает готовый файл по пути path
+        (атомарно и с проверкой содержимого, как download_ranged). Путь внутри
+        кэша постоянный, поэтому частичные файлы рядом с ним переживают сбой.
+        """
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if not key or MEDIA_CACHE_DISABLED:
+            download_to(dest_path)
+            return False
+        cached_path = self.get(key)
+        if cached_path is not None:
+            _link_or_copy(cached_path, dest_path)
+            return True
+        self.misses += 1
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        download_to(path)
+        _link_or_copy(path, dest_path)
+        return False
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Записи кэша: (mtime, размер, путь). Брошенные временные файлы и давно
+        не менявшиеся частичные файлы докачки удаляются, свежие — пропускаются.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(_TMP_PREFIX):
+                    # Остатки прерванных загрузок старше часа
+                    if time.time() - stat.st_mtime > 3600:
+                        _remove_quietly(path)
+                    continue
+                if name.endswith(_PARTIAL_SUFFIXES):
+                    # Докачка, прерванная сбоем, продолжится в следующем запуске
+                    if time.time() - stat.st_mtime > MEDIA_CACHE_PARTIAL_MAX_AGE_HOURS * 3600:
+                        _remove_quietly(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """Удаляет устаревшие записи и самые давние сверх лимита размера. Возвращает число удаленных."""
+        entries = sorted(self._entries())
+        now = time.time()
+        total = sum(size for _mtime, size, _path in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            too_old = self.max_age_seconds > 0 and now - mtime > self.max_age_seconds
+            if not too_old and total <= self.max_bytes:
+                break
+            if _remove_quietly(path):
+                total -= size
+                removed += 1
+        if removed:
+            print(f"🧹 Кэш медиа: удалено {removed} записей, занято {total / 1024 / 1024:.1f} МБ.")
+        return removed
+
+    def stats(self) -> str:
+        return (f"попаданий {self.hits}, промахов {self.misses}, "
+                f"сэкономлено {self.bytes_saved / 1024 / 1024:.1f} МБ трафика B2")
+
+
+def _file_sha1(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    """Жесткая ссылка на запись кэша (без копирования байтов), иначе копия."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def _remove_quietly(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError as e:
+        print(f"  ⚠️ Не удалось удалить запись кэша {path}: {e}")
+        return False
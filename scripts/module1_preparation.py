@@ -1,154 +1,148 @@
 import os
 import json
-import b2sdk.v2
 import asyncio
-import shutil
-from telegram import Bot
-
-# 🔹 Определяем пути
-BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-DOWNLOAD_DIR = os.path.join(BASE_DIR, "data", "downloaded")
+from typing import Any, Dict, List, Optional, Tuple
+
+import published_journal
+# Ленивые клиенты B2 и Telegram: импорт модуля не ходит в сеть
+from clients import get_bucket, get_bot, require_env
+# Общий слой лимитов Telegram вместо фиксированных пауз
+from telegram_limiter import get_rate_limiter
+# Общий с B2_Content_Download кэш медиа: повторный запуск не скачивает файлы заново
+from media_cache import MediaCache, cache_key
+# Общая нормализация JSON группы (та же запись поста, что и у B2_Content_Download)
+from b2_scan import GEN_ID_PATTERN, POST_SUFFIX
+from post_record import normalize_post, fetch_post_record, poll_is_valid
+# Стадии подготовки и публикации выполняются в одном процессе
+from pipeline import PipelineStage, run_pipeline
 
 # 🔹 Загружаем переменные окружения
-S3_KEY_ID = os.getenv("S3_KEY_ID")
-S3_APPLICATION_KEY = os.getenv("S3_APPLICATION_KEY")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-S3_ENDPOINT = os.getenv("S3_ENDPOINT", "production")
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# Ключи B2 и TELEGRAM_TOKEN читает clients.py; проверка — в начале стадии подготовки
+REQUIRED_ENV = ["S3_KEY_ID", "S3_APPLICATION_KEY", "S3_BUCKET_NAME", "TELEGRAM_TOKEN", "TELEGRAM_CHAT_ID"]
 
-if not all([S3_KEY_ID, S3_APPLICATION_KEY, S3_BUCKET_NAME, TELEGRAM_TOKEN, TELEGRAM_CHAT_ID]):
-    raise RuntimeError("❌ Ошибка: Не установлены все необходимые переменные окружения!")
-
-bot = Bot(token=TELEGRAM_TOKEN)
+limiter = get_rate_limiter()
+media_cache = MediaCache()
 
-info = b2sdk.v2.InMemoryAccountInfo()
-b2_api = b2sdk.v2.B2Api(info)
-b2_api.authorize_account(S3_ENDPOINT, S3_KEY_ID, S3_APPLICATION_KEY)
 
-bucket = b2_api.get_bucket_by_name(S3_BUCKET_NAME)
-
-
-async def process_files():
-    print("🗑 Полная очистка локальной папки перед скачиванием...")
-    shutil.rmtree(DOWNLOAD_DIR, ignore_errors=True)
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+def prepare_posts(context: Optional[Dict[str, Any]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Стадия подготовки: список JSON в 444/ и записи постов для них.
+    JSON разбираются в памяти (без файлов в data/downloaded). Возвращает [(имя файла, запись поста)].
+    """
+    require_env(*REQUIRED_ENV)
+    bucket = get_bucket()
 
     print("\n📥 Проверяем статус публикации в config_public.json...")
     published_generation_ids = get_published_generation_ids()
 
     # Определяем, какие файлы можно публиковать
+    listed = [file_version for file_version, _ in bucket.ls("444/", recursive=True)]
+    post_records = {file_version.file_name for file_version in listed if file_version.file_name.endswith(POST_SUFFIX)}
     files_to_download = [
-        file_version.file_name for file_version, _ in bucket.ls("444/", recursive=True)
-        if file_version.file_name.endswith(".json")
+        file_version for file_version in listed
+        if file_version.file_name.endswith(".json") and not file_version.file_name.endswith(POST_SUFFIX)
     ]
 
     if not files_to_download:
         print(f"⚠️ Нет новых файлов для загрузки из 444/")
-        return
+        return []
 
-    for file_name in files_to_download:
-        local_path = os.path.join(DOWNLOAD_DIR, os.path.basename(file_name))
+    prepared = []
+    for file_version in files_to_download:
+        file_name = file_version.file_name
 
         try:
-            print(f"📥 Скачивание {file_name} в {local_path}...")
-            bucket.download_file_by_name(file_name).save_to(local_path)
-
-            with open(local_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            # Готовая запись поста ({gen_id}_post.json) заменяет скачивание и разбор JSON
+            record_name = file_name[:-len(".json")] + POST_SUFFIX
+            record = fetch_post_record(bucket, record_name) if record_name in post_records else None
+            if record is None:
+                print(f"📥 Скачивание {file_name}...")
+                content_sha1 = file_version.content_sha1
+                if content_sha1 in (None, "none") or content_sha1.startswith("unverified:"):
+                    content_sha1 = None
+                raw, from_cache = media_cache.fetch_bytes(
+                    cache_key(content_sha1, file_version.id_),
+                    lambda f: bucket.download_file_by_name(file_name).save(f), sha1=content_sha1)
+                if from_cache:
+                    print(f"♻️ {file_name} взят из кэша медиа.")
+                data = json.loads(raw.decode("utf-8"))
+                record = normalize_post(data, os.path.splitext(os.path.basename(file_name))[0])
+            prepared.append((file_name, record))
 
-            topic_clean = data.get("topic", {}).get("topic", "").strip("'\"")
-            text_content = data.get("text_initial", {}).get("content", "").strip()
+        except Exception as e:
+            print(f"🚨 Ошибка при обработке файла {file_name}: {e}")
 
-            # 🛑 Очистка системных фраз
-            clean_text = text_content.replace(f'Сгенерированный текст на тему: "{topic_clean}"', '').strip()
-            clean_text = clean_text.replace("Интересный факт:", "").strip()
-            clean_text = clean_text.replace("🔶 Саркастический комментарий:", "").strip()
-            clean_text = clean_text.replace("🔸 Саркастический вопрос:", "").strip()
+    return prepared
 
-            # 🛑 Удаляем лишние эмодзи (оставляем только один в начале)
-            clean_text = clean_text.replace("🏛", "").strip()
-            formatted_text = f"🏛 <b>{topic_clean}</b>\n\n{clean_text}"
 
-            await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=formatted_text, parse_mode="HTML")
-            await asyncio.sleep(1)
+async def publish_posts(context: Dict[str, Any]) -> int:
+    """Стадия публикации: отправляет подготовленные записи (context["prepare"]). Возвращает число постов."""
+    bot = get_bot()
+    published = 0
+    for file_name, record in context.get("prepare") or []:
+        try:
+            await limiter.send(bot.send_message, chat_id=TELEGRAM_CHAT_ID, text=record["caption"], parse_mode="HTML")
 
             # 📜 Отправка саркастического комментария (если есть)
-            sarcasm_comment = data.get("sarcasm", {}).get("comment", "").strip()
+            sarcasm_comment = record.get("sarcasm_comment", "")
             if sarcasm_comment:
                 sarcasm_text = f"📜 <i>{sarcasm_comment}</i>"
-                await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=sarcasm_text, parse_mode="HTML")
-                await asyncio.sleep(1)
+                await limiter.send(bot.send_message, chat_id=TELEGRAM_CHAT_ID, text=sarcasm_text, parse_mode="HTML")
 
             # 🎭 Отправка интерактивного опроса (если есть)
-            if "sarcasm" in data and "poll" in data["sarcasm"]:
-                poll_data = data["sarcasm"]["poll"]
-                question = poll_data.get("question", "").strip()
-                options = poll_data.get("options", [])
-
-                if question and options and len(options) >= 2:
-                    await bot.send_poll(chat_id=TELEGRAM_CHAT_ID, question=f"🎭 {question}", options=options, is_anonymous=True)
-                    await asyncio.sleep(1)
+            if record.get("poll") is not None:
+                if poll_is_valid(record):
+                    await limiter.send(bot.send_poll, chat_id=TELEGRAM_CHAT_ID, question=f"🎭 {record['poll']['question']}",
+                                       options=record["poll"]["options"], is_anonymous=True)
                 else:
                     print("⚠️ Опрос не отправлен. Проверьте данные!")
 
             update_generation_id_status(file_name)
+            published += 1
 
         except Exception as e:
             print(f"🚨 Ошибка при обработке файла {file_name}: {e}")
 
-    print("🚀 Скрипт завершён.")
+    print(f"🚦 Состояние лимитера Telegram: {limiter.state()}")
+    print(f"♻️ Кэш медиа: {media_cache.stats()}.")
+    media_cache.evict()
+    return published
 
 
-def get_published_generation_ids():
-    """Скачивает config_public.json из B2 и возвращает список опубликованных generation_id."""
-    try:
-        local_config_path = os.path.join(DOWNLOAD_DIR, "config_public.json")
-        bucket.download_file_by_name("config/config_public.json").save_to(local_config_path)
+# Стадии для pipeline.run_pipeline: module2_publication запускает их в своем процессе
+PIPELINE_STAGES = [
+    PipelineStage("prepare", prepare_posts),
+    PipelineStage("publish", publish_posts, condition=lambda context: bool(context.get("prepare"))),
+]
 
-        with open(local_config_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
 
-        return set(config_data.get("generation_id", []))  # Возвращаем список опубликованных generation_id
-    except Exception as e:
-        print(f"🚨 Ошибка при загрузке config_public.json: {e}")
-        return set()
+async def process_files():
+    await run_pipeline(PIPELINE_STAGES)
+    print("🚀 Скрипт завершён.")
+
+
+def get_published_generation_ids():
+    """Возвращает множество опубликованных generation_id (снимок config_public.json + дельты журнала)."""
+    return published_journal.load_published_ids(get_bucket())
 
 
 def update_generation_id_status(file_name):
-    """Добавляет новый generation_id в config_public.json, не удаляя старые записи."""
+    """Добавляет generation_id в журнал опубликованных одной дельтой, не перезаписывая config_public.json."""
     try:
-        local_config_path = os.path.join(DOWNLOAD_DIR, "config_public.json")
-
-        # 📥 Загружаем config_public.json
-        if os.path.exists(local_config_path):
-            with open(local_config_path, "r", encoding="utf-8") as f:
-                config_data = json.load(f)
+        # 🏷 Извлекаем generation_id из имени файла: 444/{gen_id}.json или 444/{gen_id}_post.json
+        base_name = os.path.basename(file_name)
+        if base_name.endswith(POST_SUFFIX):
+            generation_id = base_name[:-len(POST_SUFFIX)]
         else:
-            config_data = {}
-
-        # 🏷 Извлекаем generation_id из имени файла
-        generation_id = file_name.split("/")[1].split("-")[0]  # Берём ID группы из имени файла
-
-        # ✅ Проверяем, есть ли уже generation_id, сохраняем как список
-        existing_ids = config_data.get("generation_id", [])
-        if not isinstance(existing_ids, list):
-            existing_ids = [existing_ids]  # Преобразуем строку в список, если это старый формат
-
-        if generation_id not in existing_ids:
-            existing_ids.append(generation_id)  # Добавляем новый ID в список
-
-        config_data["generation_id"] = existing_ids  # Записываем в JSON
-
-        # 📤 Загружаем обратно в B2
-        with open(local_config_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=4)
-
-        bucket.upload_local_file(local_config_path, "config/config_public.json")
-        print(f"✅ Обновлён config_public.json: {config_data['generation_id']}")
-
+            generation_id = os.path.splitext(base_name)[0]
+        if not GEN_ID_PATTERN.fullmatch(generation_id):
+            # Общий журнал хранит только настоящие ID групп вида YYYYMMDD-HHMM
+            print(f"⚠️ {file_name}: имя не содержит generation_id, журнал опубликованных не обновлен.")
+            return
+        published_journal.record_published_id(get_bucket(), generation_id)
     except Exception as e:
-        print(f"🚨 Ошибка при обновлении config_public.json: {e}")
+        print(f"🚨 Ошибка при обновлении журнала опубликованных: {e}")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,23 @@
 import os
 import json
-import subprocess
+from typing import Any, Dict
+
+from module1_preparation import prepare_posts, publish_posts
+from pipeline import PipelineStage, run_pipeline_sync
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "data", "downloaded")
 CONFIG_PATH = os.path.join(BASE_DIR, "config", "config_public.json")
 
-if not os.path.exists(DOWNLOAD_DIR):
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-if not os.path.exists(CONFIG_PATH):
-    with open(CONFIG_PATH, "w") as f:
-        json.dump({}, f)
+def ensure_paths():
+    """Создает папку загрузок и пустой config_public.json (при запуске, а не при импорте)."""
+    if not os.path.exists(DOWNLOAD_DIR):
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
+    if not os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "w") as f:
+            json.dump({}, f)
 
 
 def load_json_data(filename):
@@ -38,18 +44,18 @@ def update_config_no_public():
         json.dump({"status": "no public"}, f)
 
 
-def main():
-    """Основной процесс публикации."""
-    print("🚀 Запуск публикации...")
-
+def publish_local_post(context: Dict[str, Any]):
+    """
+    Стадия локального поста. Возвращает текст сообщения, None — данных нет
+    (ставится 'no public'), False — JSON некорректен и подготовка не запускается.
+    """
     json_filename = "20250116-1932.json"
     post_data = load_json_data(json_filename)
 
     if not post_data:
-        print("⚠️ Нет данных для публикации. Ставим 'no public' и запускаем module1_preparation.py...")
+        print("⚠️ Нет данных для публикации. Ставим 'no public' и запускаем подготовку (module1_preparation)...")
         update_config_no_public()
-        subprocess.run(["python", "scripts/module1_preparation.py"], check=True)
-        return
+        return None
 
     # ✅ Гарантируем, что JSON загружается корректно
     if isinstance(post_data, str):
@@ -57,13 +63,25 @@ def main():
             post_data = json.loads(post_data)
         except json.JSONDecodeError:
             print("❌ Ошибка: Некорректный JSON!")
-            return
+            return False
 
     message = f"🏛 {post_data.get('topic', 'Без темы')}\n\n{post_data.get('text', 'ℹ️ Контент отсутствует.')}"
     print(f"📩 Отправка сообщения: {message}")
 
-    print("✅ Публикация завершена. Запускаем module1_preparation.py...")
-    subprocess.run(["python", "scripts/module1_preparation.py"], check=True)
+    print("✅ Публикация завершена. Запускаем подготовку (module1_preparation)...")
+    return message
+
+
+def main():
+    """Основной процесс публикации: локальный пост, затем стадии module1 в этом же процессе."""
+    print("🚀 Запуск публикации...")
+    ensure_paths()
+    # Раньше module1_preparation запускался через subprocess (новый интерпретатор и авторизация B2)
+    run_pipeline_sync([
+        PipelineStage("local_post", publish_local_post),
+        PipelineStage("prepare", prepare_posts, condition=lambda context: context.get("local_post") is not False),
+        PipelineStage("publish", publish_posts, condition=lambda context: bool(context.get("prepare"))),
+    ])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Faststart для MP4 без ffmpeg: атом moov переносится перед mdat.
+
+Telegram (и любой плеер) может начать воспроизведение до окончания загрузки,
+только если индекс moov лежит в начале файла. Runway и другие генераторы
+нередко пишут его в конец. Здесь разбирается структура атомов верхнего
+уровня, moov (обычно килобайты) читается в память, смещения чанков в
+stco/co64 сдвигаются на размер moov, и файл переписывается потоково:
+mdat копируется кусками по MP4_COPY_CHUNK_SIZE, целиком в память не
+загружается. Если после сдвига смещения не помещаются в 32 бита, stco
+переводится в co64.
+
+Заодно извлекаются длительность (mvhd) и размеры кадра (tkhd видеодорожки) —
+их передают в sendVideo/InputMediaVideo. Битый файл (атом выходит за конец
+файла, нет moov/mdat, неизвестная версия mvhd) дает Mp4Error до загрузки.
+Фрагментированные MP4 (moof) не переписываются: они и так потоковые.
+"""
+import os
+import shutil
+import struct
+import tempfile
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+MP4_COPY_CHUNK_SIZE = int(os.getenv("MP4_COPY_CHUNK_SIZE", str(1024 * 1024)))
+# Больше этого moov считается битым (индекс многочасового видео — единицы МБ)
+MP4_MAX_MOOV_BYTES = int(os.getenv("MP4_MAX_MOOV_BYTES", str(64 * 1024 * 1024)))
+
+# Контейнеры на пути к mvhd/tkhd/hdlr/stco; остальные атомы копируются как есть
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+# Наибольшее смещение, которое помещается в stco; больше — только co64
+_STCO_MAX_OFFSET = 0xFFFFFFFF
+
+# Путь или открытый файловый объект (перематывается, не закрывается)
+Mp4Source = Union[str, IO[bytes]]
+
+
+class Mp4Error(ValueError):
+    """Поврежденный или неподдерживаемый MP4."""
+
+
+class VideoInfo(NamedTuple):
+    duration: float  # секунды
+    width: int
+    height: int
+    faststart: bool  # moov перед mdat (после обработки)
+    remuxed: bool  # файл был переписан
+
+
+class _TopBox(NamedTuple):
+    kind: bytes
+    offset: int
+    size: int
+
+
+class _Atom:
+    """Атом moov: контейнер с детьми или лист с сырым содержимым (без заголовка)."""
+
+    def __init__(self, kind: bytes, payload: bytes = b"", children: Optional[List["_Atom"]] = None):
+        self.kind = kind
+        self.payload = payload
+        self.children = children
+
+    def find_all(self, kind: bytes) -> List["_Atom"]:
+        found = []
+        for child in self.children or []:
+            if child.kind == kind:
+                found.append(child)
+            if child.children is not None:
+                found.extend(child.find_all(kind))
+        return found
+
+    def find(self, kind: bytes) -> Optional["_Atom"]:
+        found = self.find_all(kind)
+        return found[0] if found else None
+
+    def serialize(self) -> bytes:
+        body = b"".join(child.serialize() for child in self.children) if self.children is not None else self.payload
+        return struct.pack(">I4s", 8 + len(body), self.kind) + body
+
+
+def _file_size(f: IO[bytes]) -> int:
+    f.seek(0, os.SEEK_END)
+    return f.tell()
+
+
+def _scan_top_level(f: IO[bytes]) -> List[_TopBox]:
+    """Атомы верхнего уровня; атомы должны покрывать файл без пропусков и выхода за конец."""
+    file_size = _file_size(f)
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise Mp4Error(f"обрезанный заголовок атома на смещении {offset}")
+        size, kind = struct.unpack(">I4s", header)
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                raise Mp4Error(f"обрезанный 64-битный размер атома {kind!r}")
+            size = struct.unpack(">Q", large)[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise Mp4Error(f"атом {kind!r} на смещении {offset} выходит за конец файла ({size} байт)")
+        boxes.append(_TopBox(kind, offset, size))
+        offset += size
+    return boxes
+
+
+def _parse_atoms(data: bytes, start: int = 0, end: Optional[int] = None) -> List[_Atom]:
+    end = len(data) if end is None else end
+    atoms = []
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise Mp4Error(f"атом {kind!r} внутри moov поврежден")
+        if kind in _CONTAINERS:
+            atoms.append(_Atom(kind, children=_parse_atoms(data, offset + header_size, offset + size)))
+        else:
+            atoms.append(_Atom(kind, payload=data[offset + header_size:offset + size]))
+        offset += size
+    return atoms
+
+
+def _read_moov(f: IO[bytes], box: _TopBox) -> _Atom:
+    if box.size > MP4_MAX_MOOV_BYTES:
+        raise Mp4Error(f"moov слишком большой ({box.size} байт)")
+    f.seek(box.offset)
+    raw = f.read(box.size)
+    if len(raw) != box.size:
+        raise Mp4Error("moov обрезан")
+    return _parse_atoms(raw)[0]
+
+
+def _chunk_offsets(atom: _Atom) -> Tuple[List[int], bool]:
+    """Смещения чанков из stco/co64 и признак 64-битности."""
+    wide = atom.kind == b"co64"
+    if len(atom.payload) < 8:
+        raise Mp4Error(f"таблица {atom.kind.decode()} обрезана")
+    count = struct.unpack_from(">I", atom.payload, 4)[0]
+    fmt = ">%d%s" % (count, "Q" if wide else "I")
+    if 8 + struct.calcsize(fmt) > len(atom.payload):
+        raise Mp4Error(f"таблица {atom.kind.decode()} короче заявленных {count} записей")
+    return list(struct.unpack_from(fmt, atom.payload, 8)), wide
+
+
+def _set_chunk_offsets(atom: _Atom, offsets: List[int], wide: bool) -> None:
+    atom.kind = b"co64" if wide else b"stco"
+    atom.payload = (atom.payload[:4] + struct.pack(">I", len(offsets))
+                    + struct.pack(">%d%s" % (len(offsets), "Q" if wide else "I"), *offsets))
+
+
+def _video_info(moov: _Atom) -> Tuple[float, int, int]:
+    try:
+        return _parse_video_info(moov)
+    except (struct.error, IndexError) as e:
+        raise Mp4Error(f"поврежден mvhd/tkhd/hdlr: {e}")
+
+
+def _parse_video_info(moov: _Atom) -> Tuple[float, int, int]:
+    mvhd = moov.find(b"mvhd")
+    if mvhd is None:
+        raise Mp4Error("в moov нет mvhd")
+    version = mvhd.payload[0]
+    if version == 0:
+        timescale, duration = struct.unpack_from(">II", mvhd.payload, 12)
+    elif version == 1:
+        timescale, duration = struct.unpack_from(">IQ", mvhd.payload, 20)
+    else:
+        raise Mp4Error(f"неизвестная версия mvhd: {version}")
+    seconds = duration / timescale if timescale else 0.0
+
+    width = height = 0
+    for trak in moov.find_all(b"trak"):
+        hdlr = trak.find(b"hdlr")
+        tkhd = trak.find(b"tkhd")
+        if hdlr is None or tkhd is None or hdlr.payload[8:12] != b"vide":
+            continue
+        # Ширина и высота — последние 8 байт tkhd, числа 16.16 с фиксированной точкой
+        raw_width, raw_height = struct.unpack_from(">II", tkhd.payload, len(tkhd.payload) - 8)
+        width, height = raw_width >> 16, raw_height >> 16
+        break
+    return seconds, width, height
+
+
+def _open(source: Mp4Source, mode: str = "rb"):
+    return open(source, mode) if isinstance(source, str) else source
+
+
+def probe(source: Mp4Source) -> VideoInfo:
+    """Проверяет структуру MP4 и извлекает длительность и размеры, не переписывая файл."""
+    f = _open(source)
+    try:
+        boxes = _scan_top_level(f)
+        moov_box = next((box for box in boxes if box.kind == b"moov"), None)
+        mdat_box = next((box for box in boxes if box.kind == b"mdat"), None)
+        if moov_box is None or mdat_box is None:
+            raise Mp4Error("в файле нет moov или mdat")
+        duration, width, height = _video_info(_read_moov(f, moov_box))
+        return VideoInfo(duration, width, height, moov_box.offset < mdat_box.offset, False)
+    finally:
+        if isinstance(source, str):
+            f.close()
+        else:
+            source.seek(0)
+
+
+def _copy_range(src: IO[bytes], dst: IO[bytes], offset: int, size: int) -> None:
+    src.seek(offset)
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(min(MP4_COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise Mp4Error("файл оказался короче, чем заявлено в атомах")
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def remux_faststart(src: IO[bytes], dst: IO[bytes]) -> VideoInfo:
+    """
+    Пишет в dst версию src с moov перед первым mdat. Если moov уже впереди
+    или файл фрагментирован, dst не трогается и remuxed=False.
+    """
+    boxes = _scan_top_level(src)
+    moov_box = next((box for box in boxes if box.kind == b"moov"), None)
+    mdat_box = next((box for box in boxes if box.kind == b"mdat"), None)
+    if moov_box is None or mdat_box is None:
+        raise Mp4Error("в файле нет moov или mdat")
+    moov = _read_moov(src, moov_box)
+    duration, width, height = _video_info(moov)
+    if moov_box.offset < mdat_box.offset or any(box.kind == b"moof" for box in boxes):
+        return VideoInfo(duration, width, height, moov_box.offset < mdat_box.offset, False)
+
+    # Новый порядок: все до первого mdat, затем moov, затем остальное (без старого moov)
+    before = [box for box in boxes if box.offset < mdat_box.offset and box.kind != b"moov"]
+    after = [box for box in boxes if box.offset >= mdat_box.offset and box.kind != b"moov"]
+    tables = moov.find_all(b"stco") + moov.find_all(b"co64")
+    original = {id(table): _chunk_offsets(table) for table in tables}
+
+    def new_position(old_offset: int, moov_size: int) -> int:
+        # Данные до старого moov сдвигаются на размер нового moov, после него — на разницу размеров
+        if old_offset < moov_box.offset:
+            return old_offset + moov_size
+        return old_offset + moov_size - moov_box.size
+
+    # Размер moov зависит от перевода stco в co64, а перевод — от размера moov
+    wide = {id(table): original[id(table)][1] for table in tables}
+    while True:
+        for table in tables:
+            offsets, _was_wide = original[id(table)]
+            _set_chunk_offsets(table, offsets, wide[id(table)])
+        moov_size = len(moov.serialize())
+        changed = False
+        for table in tables:
+            offsets = original[id(table)][0]
+            if not wide[id(table)] and offsets and new_position(max(offsets), moov_size) > _STCO_MAX_OFFSET:
+                wide[id(table)] = True
+                changed = True
+        if not changed:
+            break
+    for table in tables:
+        offsets = original[id(table)][0]
+        _set_chunk_offsets(table, [new_position(offset, moov_size) for offset in offsets], wide[id(table)])
+    moov_bytes = moov.serialize()
+
+    for box in before:
+        _copy_range(src, dst, box.offset, box.size)
+    dst.write(moov_bytes)
+    for box in after:
+        _copy_range(src, dst, box.offset, box.size)
+    dst.flush()
+    return VideoInfo(duration, width, height, True, True)
+
+
+def make_faststart(path: str) -> VideoInfo:
+    """Переносит moov в начало файла на месте (через временный файл рядом и os.replace)."""
+    with open(path, "rb") as src:
+        info = probe(src)
+        if info.faststart:
+            return info
+        fd, tmp_path = tempfile.mkstemp(prefix=".faststart-", suffix=".mp4", dir=os.path.dirname(path) or ".")
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                info = remux_faststart(src, dst)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    if not info.remuxed:
+        os.remove(tmp_path)
+        return info
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+    return info
+
+
+def video_send_kwargs(info: Optional[VideoInfo]) -> Dict[str, int]:
+    """Параметры duration/width/height для sendVideo и InputMediaVideo (только известные)."""
+    if info is None:
+        return {}
+    params = {"duration": int(round(info.duration)), "width": info.width, "height": info.height}
+    return {key: value for key, value in params.items() if value > 0}
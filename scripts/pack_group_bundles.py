@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Упаковка готовых групп generation_id в бандлы {gen_id}.bundle (см. group_bundle).
+
+Для каждой полной группы из отдельных файлов без бандла скачивает 4 файла,
+собирает бандл, загружает его рядом и проверяет, что он читается.
+С BUNDLE_DELETE_LOOSE=1 отдельные файлы после этого удаляются; по умолчанию
+они остаются, и старые публикаторы продолжают их читать.
+
+Переменные окружения: S3_KEY_ID, S3_APPLICATION_KEY, S3_BUCKET_NAME,
+S3_ENDPOINT, BUNDLE_FOLDERS (по умолчанию B2_SCAN_FOLDERS),
+BUNDLE_DELETE_LOOSE, BUNDLE_DRY_RUN.
+"""
+import os
+import tempfile
+
+from clients import get_bucket
+from b2_download import new_spool
+from b2_scan import GROUP_SUFFIXES, BUNDLE_SUFFIX, SCAN_FOLDERS, parse_folder_list, scan_folder
+from group_bundle import pack_group, read_index, member_size_and_sha1
+
+BUNDLE_FOLDERS = parse_folder_list(os.getenv("BUNDLE_FOLDERS", "")) or SCAN_FOLDERS
+BUNDLE_DELETE_LOOSE = os.getenv("BUNDLE_DELETE_LOOSE", "").strip().lower() in ("1", "true", "yes")
+BUNDLE_DRY_RUN = os.getenv("BUNDLE_DRY_RUN", "").strip().lower() in ("1", "true", "yes")
+
+
+def pack_manifest(bucket, manifest) -> bool:
+    """
+    Собирает и загружает бандл одной группы. Возвращает True при успехе.
+    Члены скачиваются в буферы new_spool (большие уходят на диск), бандл
+    собирается во временный файл и загружается из него: память не растет с размером видео.
+    """
+    bundle_key = manifest.key(BUNDLE_SUFFIX)
+    members = {}
+    fd, bundle_path = tempfile.mkstemp(suffix=BUNDLE_SUFFIX)
+    try:
+        for suffix in GROUP_SUFFIXES:
+            entry = manifest.files[suffix]
+            members[suffix] = spool = new_spool()
+            bucket.download_file_by_name(entry.file_name).save(spool)
+            if entry.content_sha1 and member_size_and_sha1(spool)[1] != entry.content_sha1:
+                print(f"❌ {entry.file_name}: SHA-1 не совпадает с листингом, группа {manifest.gen_id} пропущена.")
+                return False
+
+        with os.fdopen(fd, "wb") as out:
+            fd = None
+            index = pack_group(manifest.gen_id, members, out)
+        for spool in members.values():
+            spool.close()
+        bundle_size = os.path.getsize(bundle_path)
+        if BUNDLE_DRY_RUN:
+            print(f"🔎 [dry run] {bundle_key}: {bundle_size} байт, члены: {', '.join(index)}")
+            return True
+        bucket.upload_local_file(local_file=bundle_path, file_name=bundle_key)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        for spool in members.values():
+            spool.close()
+        os.remove(bundle_path)
+
+    # Проверяем, что индекс загруженного бандла читается и совпадает с собранным
+    if read_index(bucket, bundle_key) != index:
+        print(f"❌ Индекс загруженного {bundle_key} не совпадает с собранным. Отдельные файлы не трогаем.")
+        return False
+    print(f"📦 {bundle_key}: {bundle_size / 1024 / 1024:.1f} МБ")
+
+    if BUNDLE_DELETE_LOOSE:
+        for suffix in GROUP_SUFFIXES:
+            entry = manifest.files[suffix]
+            bucket.delete_file_version(entry.file_id, entry.file_name)
+        print(f"🗑️ Отдельные файлы группы {manifest.gen_id} удалены.")
+    return True
+
+
+def main():
+    bucket = get_bucket()
+
+    packed = failed = 0
+    for folder in BUNDLE_FOLDERS:
+        manifests = scan_folder(bucket, folder)
+        candidates = [m for gen_id, m in sorted(manifests.items())
+                      if m.bundle is None and all(suffix in m.files for suffix in GROUP_SUFFIXES)]
+        print(f"🔎 Папка {folder}: групп {len(manifests)}, к упаковке {len(candidates)}")
+        for manifest in candidates:
+            try:
+                if pack_manifest(bucket, manifest):
+                    packed += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                print(f"⚠️ Ошибка упаковки группы {manifest.gen_id}: {e}")
+                failed += 1
+    print(f"🏁 Упаковано групп: {packed}, с ошибками: {failed}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Запуск стадий конвейера (подготовка → публикация) в одном процессе.
+
+Раньше module2_publication запускал module1_preparation через subprocess:
+новый интерпретатор, повторный импорт зависимостей и новая авторизация B2
+на каждый запуск. Здесь стадии выполняются по очереди в одном процессе,
+делят клиентов из clients.py (одна авторизация, общие пулы соединений) и
+передают данные в памяти через общий контекст: результат стадии кладется
+в context[имя стадии] и доступен следующим.
+
+Стадия — синхронная или асинхронная функция от контекста. Время каждой
+стадии печатается итоговой таблицей; при ошибке таблица печатается до
+проброса исключения.
+"""
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+
+class PipelineStage(NamedTuple):
+    name: str
+    run: Callable[[Dict[str, Any]], Any]
+    # Стадия выполняется, только если condition(context) истинно
+    condition: Optional[Callable[[Dict[str, Any]], bool]] = None
+
+
+def _print_timings(timings: List[tuple]) -> None:
+    total = sum(seconds for _name, seconds, _status in timings)
+    print("⏱️ Время стадий конвейера:")
+    for name, seconds, status in timings:
+        print(f"   {status} {name:<12} {seconds:8.2f} с")
+    print(f"   Σ {'итого':<12} {total:8.2f} с")
+
+
+async def run_pipeline(stages: Sequence[PipelineStage],
+                       context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Выполняет стадии по очереди и возвращает общий контекст (с context["timings"] в секундах)."""
+    context = {} if context is None else context
+    timings: List[tuple] = []
+    context["timings"] = {}
+    try:
+        for stage in stages:
+            if stage.condition is not None and not stage.condition(context):
+                print(f"⏭️ Стадия {stage.name} пропущена.")
+                timings.append((stage.name, 0.0, "⏭️"))
+                continue
+            print(f"▶️ Стадия {stage.name}...")
+            start = time.perf_counter()
+            try:
+                result = stage.run(context)
+                if inspect.isawaitable(result):
+                    result = await result
+            except BaseException:
+                timings.append((stage.name, time.perf_counter() - start, "❌"))
+                raise
+            elapsed = time.perf_counter() - start
+            context[stage.name] = result
+            context["timings"][stage.name] = elapsed
+            timings.append((stage.name, elapsed, "✅"))
+    finally:
+        _print_timings(timings)
+    return context
+
+
+def run_pipeline_sync(stages: Sequence[PipelineStage], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Синхронная обертка для точек входа скриптов."""
+    return asyncio.run(run_pipeline(stages, context))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Нормализованная запись поста: итог разбора JSON группы для всех публикаторов.
+
+JSON групп встречается в нескольких вариантах (поле content как словарь,
+JSON-строка или простой текст; формат module1 с topic/text_initial; старый
+формат title/content). normalize_post разбирает любой из них один раз и
+возвращает компактную запись со схемой POST_SCHEMA_VERSION:
+
+    {"schema": 2, "gen_id": ..., "source_format": "content" | "text_initial" | "title",
+     "caption": финальный HTML-текст, "hashtags": [...],
+     "poll": {"question": ..., "options": [...]} или null, "sarcasm_comment": ...}
+
+Запись сохраняется рядом с группой как {gen_id}_post.json (ingest_posts.py),
+и публикаторы берут готовую подпись из нее, не тратя время на разбор текста.
+Если записи нет или ее схема устарела, тот же normalize_post вызывается на лету.
+"""
+import io
+import json
+from typing import Any, Dict, List, Optional
+
+from b2_scan import POST_SUFFIX
+from caption_engine import TELEGRAM_CAPTION_LIMIT as CAPTION_LIMIT, clean_post_text, render_caption
+
+# 2 — подписи обрезаются caption_engine (без разрыва HTML и эмодзи)
+POST_SCHEMA_VERSION = 2
+
+LINK_HTML = '<b><a href="https://t.me/boyarinn7">Подпишись, забудешь</a></b>'
+
+_POSSIBLE_TEXT_KEYS = ["текст", "content", "text"]
+
+
+def _extract_main_text(data: Dict, gen_id: str) -> str:
+    """Основной текст из поля content (словарь, JSON-строка или простой текст)."""
+    content_value = data.get("content")
+    found_text = None
+    content_data = None
+    if isinstance(content_value, dict):
+        content_data = content_value
+    elif isinstance(content_value, str) and content_value.strip():
+        try:
+            content_data = json.loads(content_value.strip())
+        except json.JSONDecodeError:
+            found_text = content_value.strip() if content_value.strip() not in ["{}"] else None
+        except Exception as e:
+            print(f"⚠️ Ошибка обработки 'content' {gen_id}: {e}")
+    if isinstance(content_data, dict):
+        post_list = content_data.get("post")
+        if isinstance(post_list, list):
+            post_texts = [list(item.values())[0] for item in post_list if isinstance(item, dict) and len(item) == 1]
+            if post_texts:
+                found_text = "\n\n".join(filter(None, post_texts))
+        if found_text is None:
+            for key in _POSSIBLE_TEXT_KEYS:
+                if key in content_data:
+                    found_text = content_data[key]
+                    break
+    return clean_post_text(found_text.strip() if isinstance(found_text, str) else "")
+
+
+def _normalize_content_format(data: Dict, gen_id: str) -> Dict[str, Any]:
+    """Основной формат групп B2: текст + ссылка + хештеги, опрос из sarcasm.poll."""
+    main_text = _extract_main_text(data, gen_id)
+
+    hashtags_list = data.get("hashtags")
+    hashtags: List[str] = []
+    if isinstance(hashtags_list, list):
+        hashtags = [tag.strip() for tag in hashtags_list if isinstance(tag, str) and tag.strip()]
+    elif hashtags_list is not None:
+        print(f"⚠️ Ключ 'hashtags' найден, но не является списком: {type(hashtags_list)}")
+    formatted_hashtags_str = " ".join(f"#{tag}" for tag in hashtags)
+
+    # Ссылка и хештеги не обрезаются: при превышении лимита укорачивается только текст
+    caption = render_caption(main_text, (LINK_HTML, formatted_hashtags_str))
+    if not caption.startswith(main_text):
+        print(f"⚠️ Подпись была обрезана до {CAPTION_LIMIT} символов.")
+
+    sarcasm_data = data.get("sarcasm") or {}
+    poll_data = sarcasm_data.get("poll") or {}
+    question = str(poll_data.get("question", "")).strip()[:300]
+    options = [str(opt).strip()[:100] for opt in poll_data.get("options", []) if str(opt).strip()][:10]
+    return {
+        "caption": caption,
+        "hashtags": hashtags,
+        "poll": {"question": question, "options": options} if question or options else None,
+        "sarcasm_comment": str(sarcasm_data.get("comment", "")).strip(),
+    }
+
+
+def _normalize_text_initial_format(data: Dict) -> Dict[str, Any]:
+    """Формат module1: тема + text_initial, комментарий и опрос из sarcasm."""
+    topic_clean = data.get("topic", {}).get("topic", "").strip("'\"")
+    text_content = data.get("text_initial", {}).get("content", "").strip()
+
+    # 🛑 Очистка системных фраз
+    clean_text = text_content.replace(f'Сгенерированный текст на тему: "{topic_clean}"', '').strip()
+    clean_text = clean_text.replace("Интересный факт:", "").strip()
+    clean_text = clean_text.replace("🔶 Саркастический комментарий:", "").strip()
+    clean_text = clean_text.replace("🔸 Саркастический вопрос:", "").strip()
+
+    # 🛑 Удаляем лишние эмодзи (оставляем только один в начале)
+    clean_text = clean_text.replace("🏛", "").strip()
+
+    sarcasm_data = data.get("sarcasm") or {}
+    poll_data = sarcasm_data.get("poll")
+    poll = None
+    if isinstance(poll_data, dict):
+        poll = {"question": poll_data.get("question", "").strip(), "options": poll_data.get("options", [])}
+    return {
+        "caption": f"🏛 <b>{topic_clean}</b>\n\n{clean_text}",
+        "hashtags": [],
+        "poll": poll,
+        "sarcasm_comment": sarcasm_data.get("comment", "").strip(),
+    }
+
+
+def _normalize_title_format(data: Dict) -> Dict[str, Any]:
+    """Старый формат title/content (tests/дубльм1.py)."""
+    poll_data = data.get("poll")
+    return {
+        "caption": f"<b>{data['title']}</b>\n\n{data['content']}",
+        "hashtags": [],
+        "poll": poll_data if isinstance(poll_data, dict) else None,
+        "sarcasm_comment": "",
+    }
+
+
+def detect_source_format(data: Dict) -> str:
+    if "text_initial" in data:
+        return "text_initial"
+    if "title" in data and "content" in data:
+        return "title"
+    return "content"
+
+
+def normalize_post(data: Dict, gen_id: str = "") -> Dict[str, Any]:
+    """Нормализует JSON группы в запись поста (см. описание модуля)."""
+    if not isinstance(data, dict):
+        raise ValueError(f"JSON группы {gen_id} не является объектом")
+    source_format = detect_source_format(data)
+    if source_format == "text_initial":
+        record = _normalize_text_initial_format(data)
+    elif source_format == "title":
+        record = _normalize_title_format(data)
+    else:
+        record = _normalize_content_format(data, gen_id)
+    return dict({"schema": POST_SCHEMA_VERSION, "gen_id": gen_id, "source_format": source_format}, **record)
+
+
+def dump_post_record(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def parse_post_record(raw: bytes) -> Optional[Dict[str, Any]]:
+    """Разбирает запись; для записи другой схемы или поврежденной возвращает None."""
+    try:
+        record = json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(record, dict) or record.get("schema") != POST_SCHEMA_VERSION:
+        return None
+    return record
+
+
+def fetch_post_record(bucket, file_key: str) -> Optional[Dict[str, Any]]:
+    """Скачивает и разбирает запись поста из B2; при ошибке — None (публикатор разберет JSON сам)."""
+    try:
+        buffer = io.BytesIO()
+        bucket.download_file_by_name(file_key).save(buffer)
+    except Exception as e:
+        print(f"⚠️ Не удалось скачать запись поста {file_key}: {e}")
+        return None
+    record = parse_post_record(buffer.getvalue())
+    if record is None:
+        print(f"⚠️ Запись поста {file_key} повреждена или устарела (нужна схема {POST_SCHEMA_VERSION}).")
+    return record
+
+
+def poll_is_valid(record: Dict[str, Any]) -> bool:
+    poll = record.get("poll") or {}
+    return bool(poll.get("question")) and len(poll.get("options") or []) >= 2
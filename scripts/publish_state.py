@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Пошаговое состояние публикации generation_id.
+
+Для каждой группы фиксируются выполненные шаги (downloaded, album_sent,
+sarcasm_sent, poll_sent) по каждому чату вместе с message_id отправленных
+сообщений. Если публикация оборвалась посередине (альбом ушел, фото сарказма —
+нет), следующий запуск продолжит с первого невыполненного шага и не
+отправит альбом повторно.
+
+Состояние хранится в локальной SQLite и синхронизируется с B2 целиком
+(CI-раннеры эфемерны). При слиянии с копией из B2 побеждает более поздняя запись.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(__file__)
+PUBLISH_STATE_DB_PATH = os.getenv("PUBLISH_STATE_DB_PATH",
+                                  os.path.join(BASE_DIR, ".cache", "publish_state.sqlite3"))
+# Сколько дней хранить записи о группах
+PUBLISH_STATE_RETENTION_DAYS = float(os.getenv("PUBLISH_STATE_RETENTION_DAYS", "30"))
+PUBLISH_STATE_KEY = "config/publish_state.sqlite3"
+
+STEP_DOWNLOADED = "downloaded"
+STEP_ALBUM = "album_sent"
+STEP_SARCASM = "sarcasm_sent"
+STEP_POLL = "poll_sent"
+# Шаги, не привязанные к чату, записываются с пустым chat_id
+NO_CHAT = ""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS publish_steps (
+    gen_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    step TEXT NOT NULL,
+    message_ids TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (gen_id, chat_id, step)
+)
+"""
+
+
+def message_ids(result: Any) -> List[int]:
+    """message_id из результата отправки (Message или список Message)."""
+    messages = result if isinstance(result, (list, tuple)) else [result]
+    return [message.message_id for message in messages if getattr(message, "message_id", None) is not None]
+
+
+class PublishState:
+    """Журнал выполненных шагов публикации в SQLite."""
+
+    def __init__(self, path: str = PUBLISH_STATE_DB_PATH):
+        self.path = path
+        self.dirty = False
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def done(self, gen_id: str, chat_id: Any, step: str) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM publish_steps WHERE gen_id = ? AND chat_id = ? AND step = ?",
+            (gen_id, str(chat_id), step),
+        ).fetchone()
+        return row is not None
+
+    def mark(self, gen_id: str, chat_id: Any, step: str, ids: Iterable[int] = ()) -> None:
+        """Отмечает шаг выполненным (сразу фиксируется на диске)."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO publish_steps (gen_id, chat_id, step, message_ids, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (gen_id, str(chat_id), step, json.dumps(list(ids)), time.time()),
+            )
+        self.dirty = True
+
+    def steps(self, gen_id: str) -> Dict[Tuple[str, str], List[int]]:
+        """Выполненные шаги группы: (chat_id, шаг) -> message_id."""
+        rows = self.conn.execute(
+            "SELECT chat_id, step, message_ids FROM publish_steps WHERE gen_id = ?", (gen_id,)
+        ).fetchall()
+        return {(chat_id, step): json.loads(ids) for chat_id, step, ids in rows}
+
+    def prune(self, retention_days: float = PUBLISH_STATE_RETENTION_DAYS) -> int:
+        """Удаляет записи старше retention_days. Возвращает число удаленных строк."""
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM publish_steps WHERE updated_at < ?",
+                                       (time.time() - retention_days * 86400,))
+        if cursor.rowcount:
+            self.dirty = True
+        return cursor.rowcount
+
+    # ------------------------------------------------------------
+    # Синхронизация с B2
+    # ------------------------------------------------------------
+    def merge_file(self, other_path: str) -> int:
+        """Подмешивает записи из другой базы; при совпадении ключа остается более поздняя."""
+        self.conn.execute("ATTACH DATABASE ? AS other", (other_path,))
+        try:
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO publish_steps SELECT gen_id, chat_id, step, message_ids, updated_at "
+                    "FROM other.publish_steps WHERE true "
+                    "ON CONFLICT (gen_id, chat_id, step) DO UPDATE SET "
+                    "message_ids = excluded.message_ids, updated_at = excluded.updated_at "
+                    "WHERE excluded.updated_at > publish_steps.updated_at"
+                )
+            return cursor.rowcount
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+
+    def load_from_b2(self, bucket) -> "PublishState":
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+            with os.fdopen(fd, "wb") as f:
+                bucket.download_file_by_name(PUBLISH_STATE_KEY).save(f)
+            merged = self.merge_file(tmp_path)
+            print(f"ℹ️ Загружено состояние публикаций из B2 (новых записей: {merged}).")
+        except Exception as e:
+            print(f"ℹ️ Состояние публикаций в B2 не загружено ({e}). Используем локальное.")
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self
+
+    def save_to_b2(self, bucket) -> None:
+        if not self.dirty:
+            return
+        try:
+            # Консистентная копия через backup API, даже если соединение открыто
+            fd, tmp_path = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+            try:
+                target = sqlite3.connect(tmp_path)
+                try:
+                    self.conn.backup(target)
+                finally:
+                    target.close()
+                with open(tmp_path, "rb") as f:
+                    bucket.upload_bytes(f.read(), PUBLISH_STATE_KEY)
+            finally:
+                os.remove(tmp_path)
+            self.dirty = False
+            print(f"💾 Состояние публикаций сохранено в B2 ({PUBLISH_STATE_KEY}).")
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить состояние публикаций в B2: {e}")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Журнал опубликованных generation_id в B2 (только добавление).
+
+Снимок — config/config_public.json в прежнем формате {"generation_id": [...]}
+и его бинарная копия config/published_ids.bin (см. gen_id_set.GenIdSet),
+которая читается в первую очередь: она на порядок меньше и быстрее разбирается.
+Каждая публикация пишет одну маленькую дельту config/published/{gen_id}.json;
+сам gen_id берется из имени объекта, поэтому для загрузки дельты не скачиваются —
+достаточно одного листинга. Когда дельт накапливается PUBLISHED_JOURNAL_COMPACT_AT,
+они сворачиваются в снимок и удаляются.
+"""
+import io
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from b2sdk.v2.exception import FileNotPresent, B2Error
+
+from gen_id_set import GenIdSet
+
+SNAPSHOT_KEY = "config/config_public.json"
+SIDECAR_KEY = "config/published_ids.bin"
+JOURNAL_PREFIX = "config/published/"
+JOURNAL_SUFFIX = ".json"
+# Порог числа дельт, после которого журнал сворачивается в снимок
+PUBLISHED_JOURNAL_COMPACT_AT = int(os.getenv("PUBLISHED_JOURNAL_COMPACT_AT", "50"))
+
+
+def _download_bytes(bucket, file_key: str) -> bytes:
+    buffer = io.BytesIO()
+    bucket.download_file_by_name(file_key).save(buffer)
+    return buffer.getvalue()
+
+
+def _load_snapshot(bucket, strict: bool = False) -> Tuple[Set[str], Dict]:
+    """
+    Читает снимок. Возвращает (множество ID, исходный словарь снимка).
+    Поддерживается прежний формат со списком в поле 'generation_id'.
+    При strict поврежденный снимок вызывает ValueError вместо пустого списка,
+    чтобы свертка не перезаписала историю одними дельтами.
+    """
+    try:
+        data = json.loads(_download_bytes(bucket, SNAPSHOT_KEY).decode("utf-8"))
+    except FileNotPresent:
+        print(f"⚠️ Файл {SNAPSHOT_KEY} не найден в B2. Будет создан при первой свертке журнала.")
+        return set(), {}
+    except json.JSONDecodeError as e:
+        if strict:
+            raise ValueError(f"Поврежден {SNAPSHOT_KEY}: {e}")
+        print(f"⚠️ Ошибка декодирования JSON в файле {SNAPSHOT_KEY}: {e}. Используем пустой список.")
+        return set(), {}
+    published = data.get("generation_id", []) if isinstance(data, dict) else None
+    if isinstance(published, str):
+        published = [published]
+    if not isinstance(published, list):
+        if strict:
+            raise ValueError(f"Поле 'generation_id' в {SNAPSHOT_KEY} не является списком")
+        print(f"⚠️ Поле 'generation_id' в {SNAPSHOT_KEY} не является списком. Используем пустой список.")
+        return set(), data if isinstance(data, dict) else {}
+    return set(published), data
+
+
+def _list_deltas(bucket) -> List[Tuple[str, str, str]]:
+    """Листинг дельт журнала: список (gen_id, имя файла, id версии)."""
+    deltas = []
+    for file_version, _folder_name in bucket.ls(folder_to_list=JOURNAL_PREFIX, recursive=False):
+        relative_path = file_version.file_name[len(JOURNAL_PREFIX):]
+        if '/' in relative_path or not relative_path.endswith(JOURNAL_SUFFIX):
+            continue
+        deltas.append((relative_path[:-len(JOURNAL_SUFFIX)], file_version.file_name, file_version.id_))
+    return deltas
+
+
+def _load_sidecar(bucket) -> Optional[GenIdSet]:
+    """Читает бинарный снимок; если его нет или он поврежден — None (используется JSON)."""
+    try:
+        return GenIdSet.from_bytes(_download_bytes(bucket, SIDECAR_KEY))
+    except FileNotPresent:
+        return None
+    except (ValueError, zlib.error) as e:
+        print(f"⚠️ Поврежден {SIDECAR_KEY}: {e}. Читаем {SNAPSHOT_KEY}.")
+        return None
+
+
+def load_published_ids(bucket) -> GenIdSet:
+    """
+    Загружает множество опубликованных ID: снимок (бинарный, иначе JSON) + дельты журнала.
+    При ошибках B2 возвращает то, что удалось прочитать.
+    """
+    published_ids = GenIdSet()
+    try:
+        snapshot_ids = _load_sidecar(bucket)
+        source = SIDECAR_KEY
+        if snapshot_ids is None:
+            snapshot_ids = GenIdSet(_load_snapshot(bucket)[0])
+            source = SNAPSHOT_KEY
+        published_ids = snapshot_ids
+        snapshot_count = len(snapshot_ids)
+        deltas = _list_deltas(bucket)
+        published_ids.update(gen_id for gen_id, _name, _id in deltas)
+        print(f"ℹ️ Загружено {len(published_ids)} опубликованных ID "
+              f"(снимок {source}: {snapshot_count}, дельт журнала: {len(deltas)}).")
+    except B2Error as e:
+        print(f"⚠️ Ошибка B2 SDK при загрузке журнала опубликованных ID: {e}. Загружено: {len(published_ids)}.")
+    except Exception as e:
+        print(f"⚠️ Не удалось загрузить журнал опубликованных ID: {e}. Загружено: {len(published_ids)}.")
+    return published_ids
+
+
+def record_published_id(bucket, gen_id: str) -> bool:
+    """Записывает в журнал одну дельту для опубликованного gen_id."""
+    delta_key = f"{JOURNAL_PREFIX}{gen_id}{JOURNAL_SUFFIX}"
+    record = {"generation_id": gen_id, "published_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    try:
+        bucket.upload_bytes(json.dumps(record).encode("utf-8"), delta_key)
+        print(f"✅ ID {gen_id} записан в журнал опубликованных ({delta_key}).")
+        return True
+    except Exception as e:
+        print(f"⚠️ Не удалось записать {delta_key} в журнал опубликованных: {e}")
+        return False
+
+
+def compact_journal(bucket, force: bool = False) -> bool:
+    """
+    Сворачивает дельты журнала в снимок, если их не меньше PUBLISHED_JOURNAL_COMPACT_AT
+    (или при force). Снимок записывается до удаления дельт, поэтому сбой
+    посередине не теряет ID. Прочие поля снимка сохраняются.
+    JSON-снимок остается источником истины, бинарный пересобирается из него.
+    """
+    try:
+        deltas = _list_deltas(bucket)
+        if not deltas or (not force and len(deltas) < PUBLISHED_JOURNAL_COMPACT_AT):
+            return False
+        print(f"🗜️ Сворачиваем {len(deltas)} дельт журнала в {SNAPSHOT_KEY}...")
+        snapshot_ids, snapshot = _load_snapshot(bucket, strict=True)
+        merged_ids = snapshot_ids | {gen_id for gen_id, _name, _id in deltas}
+        snapshot = dict(snapshot)
+        snapshot["generation_id"] = sorted(merged_ids)
+        bucket.upload_bytes(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                            SNAPSHOT_KEY)
+        bucket.upload_bytes(GenIdSet(merged_ids).to_bytes(), SIDECAR_KEY)
+        for _gen_id, file_name, file_id in deltas:
+            bucket.delete_file_version(file_id, file_name)
+        print(f"✅ Журнал свернут. Всего ID в снимке: {len(merged_ids)}")
+        return True
+    except Exception as e:
+        print(f"⚠️ Не удалось свернуть журнал опубликованных ID: {e}")
+        return False
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Журнал задач генерации видео в Runway.
+
+Задача Runway стоит кредитов и минут ожидания, а ее task_id раньше
+оставался только в логе: если скрипт падал после image_to_video.create,
+следующий запуск создавал новую генерацию. Здесь каждая задача сразу после
+создания записывается в локальную SQLite (хеш параметров, task_id, статус,
+URL результата, путь к скачанному файлу), и каждое изменение фиксируется на
+диске немедленно. При старте генератор продолжает опрос или скачивание
+незавершенных задач, а уже отрисованные параметры пропускает.
+
+Ключ записи — SHA-256 канонического JSON параметров задания (модель, промпт,
+ссылка на изображение, длительность, формат, seed), поэтому то же задание
+из манифеста всегда попадает в ту же запись.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+BASE_DIR = os.path.dirname(__file__)
+RUNWAY_JOURNAL_PATH = os.getenv("RUNWAY_JOURNAL_PATH", os.path.join(BASE_DIR, ".cache", "runway_tasks.sqlite3"))
+
+# Статусы журнала (плюс промежуточные статусы Runway: PENDING, RUNNING, THROTTLED...)
+STATUS_CREATED = "CREATED"
+STATUS_SUCCEEDED = "SUCCEEDED"
+STATUS_DOWNLOADED = "DOWNLOADED"
+STATUS_FAILED = "FAILED"
+# Задача больше не находится в Runway (удалена или устарела) — параметры генерируются заново
+STATUS_LOST = "LOST"
+# С этими статусами задачу уже не продолжить
+FINAL_STATUSES = (STATUS_DOWNLOADED, STATUS_FAILED, STATUS_LOST)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runway_tasks (
+    params_hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    output_url TEXT,
+    local_path TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class RunwayTask(NamedTuple):
+    params_hash: str
+    name: str
+    task_id: str
+    status: str
+    output_url: Optional[str]
+    local_path: Optional[str]
+    created_at: float
+    updated_at: float
+
+    @property
+    def rendered(self) -> bool:
+        """Видео скачано и файл на месте."""
+        return self.status == STATUS_DOWNLOADED and bool(self.local_path) and os.path.exists(self.local_path)
+
+    @property
+    def resumable(self) -> bool:
+        """
+        Задачу можно продолжить: опросить или скачать результат без новой генерации.
+        Скачанное видео, файла которого больше нет, тоже можно скачать заново —
+        это делается только для заданий из текущего манифеста.
+        """
+        return self.status not in FINAL_STATUSES or (self.status == STATUS_DOWNLOADED and not self.rendered)
+
+
+def params_hash(params: Dict[str, Any]) -> str:
+    """SHA-256 канонического JSON параметров задания."""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RunwayJournal:
+    """Задачи Runway в SQLite; каждая запись фиксируется на диске сразу."""
+
+    def __init__(self, path: str = RUNWAY_JOURNAL_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(_SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, key: str) -> Optional[RunwayTask]:
+        row = self.conn.execute(
+            "SELECT params_hash, name, task_id, status, output_url, local_path, created_at, updated_at "
+            "FROM runway_tasks WHERE params_hash = ?", (key,),
+        ).fetchone()
+        return RunwayTask(*row) if row else None
+
+    def record_created(self, key: str, name: str, task_id: str) -> None:
+        """Новая задача (заменяет прежнюю запись с теми же параметрами)."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO runway_tasks "
+                "(params_hash, name, task_id, status, output_url, local_path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, NULL, NULL, ?, ?)",
+                (key, name, task_id, STATUS_CREATED, now, now),
+            )
+
+    def update(self, key: str, status: str, output_url: Optional[str] = None,
+               local_path: Optional[str] = None) -> None:
+        """Меняет статус; переданные output_url и local_path перезаписывают прежние."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE runway_tasks SET status = ?, output_url = COALESCE(?, output_url), "
+                "local_path = COALESCE(?, local_path), updated_at = ? WHERE params_hash = ?",
+                (status, output_url, local_path, time.time(), key),
+            )
+
+    def unfinished(self) -> List[RunwayTask]:
+        """
+        Незавершенные задачи (в порядке создания). Скачанные сюда не входят, даже
+        если файл перемещен или удален: иначе каждый запуск скачивал бы их заново.
+        """
+        placeholders = ", ".join("?" for _ in FINAL_STATUSES)
+        rows = self.conn.execute(
+            "SELECT params_hash, name, task_id, status, output_url, local_path, created_at, updated_at "
+            f"FROM runway_tasks WHERE status NOT IN ({placeholders}) ORDER BY created_at", FINAL_STATUSES,
+        ).fetchall()
+        return [RunwayTask(*row) for row in rows]
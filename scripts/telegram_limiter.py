@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Общий слой ограничения частоты запросов к Telegram.
+
+Telegram ограничивает частоту сообщений: не чаще ~1 сообщения в секунду
+в один чат, не больше ~20 сообщений в минуту в группу/канал (медиагруппа
+считается как столько сообщений, сколько в ней элементов) и ~30 сообщений
+в секунду на бота в целом. Эти лимиты моделируются ведрами токенов
+(per-chat и глобальным), поэтому отправки идут ровно на допустимой скорости,
+без лишних пауз.
+
+Вызовы выполняются через limiter.send(bot.send_xxx, chat_id=..., ...):
+- RetryAfter от сервера блокирует чат на указанное время, а его минутная
+  скорость снижается (адаптивно, с постепенным восстановлением);
+- сетевые ошибки повторяются с экспоненциальной задержкой и джиттером, только
+  если запрос точно не дошел до Telegram (не удалось соединиться, занят пул).
+  Таймаут чтения и обрыв после отправки не повторяются: Telegram мог уже принять
+  альбом или опрос, и повтор опубликовал бы его дважды. Решение о повторе тогда
+  за вызывающим кодом (publish_state);
+- текущее состояние ведер доступно через limiter.state().
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+# Минимальный интервал между сообщениями в один чат (сек)
+TELEGRAM_CHAT_MIN_INTERVAL = float(os.getenv("TELEGRAM_CHAT_MIN_INTERVAL", "1.0"))
+# Максимум сообщений в минуту в один чат (группа/канал)
+TELEGRAM_CHAT_MESSAGES_PER_MINUTE = int(os.getenv("TELEGRAM_CHAT_MESSAGES_PER_MINUTE", "20"))
+# Глобальный лимит сообщений в секунду на бота
+TELEGRAM_GLOBAL_MESSAGES_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_MESSAGES_PER_SECOND", "30"))
+# Повторы при временных сетевых ошибках
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+TELEGRAM_BACKOFF_BASE = float(os.getenv("TELEGRAM_BACKOFF_BASE", "1.0"))
+TELEGRAM_BACKOFF_MAX = float(os.getenv("TELEGRAM_BACKOFF_MAX", "30.0"))
+# Сколько раз подряд можно ждать RetryAfter для одного вызова
+TELEGRAM_MAX_FLOOD_WAITS = int(os.getenv("TELEGRAM_MAX_FLOOD_WAITS", "5"))
+
+# Во сколько раз снижается минутная скорость чата после RetryAfter и насколько восстанавливается после успеха
+_FLOOD_SLOWDOWN = 0.8
+_RECOVERY_STEP = 1.02
+_MIN_RATE_FACTOR = 0.25
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after бывает int или timedelta в зависимости от версии PTB."""
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+# Ошибки httpx, при которых запрос не был отправлен (имена классов и фрагменты сообщений PTB)
+_NOT_SENT_ERRORS = ("ConnectError", "ConnectTimeout", "PoolTimeout")
+_NOT_SENT_MARKERS = ("ConnectError", "ConnectTimeout", "Pool timeout")
+
+
+def request_not_sent(error: NetworkError) -> bool:
+    """Запрос точно не дошел до Telegram: соединение не установлено или не получено из пула."""
+    cause = error.__cause__
+    if cause is not None and type(cause).__name__ in _NOT_SENT_ERRORS:
+        return True
+    message = str(error)
+    return any(marker in message for marker in _NOT_SENT_MARKERS)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity. Допускает долг."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float, now: float) -> float:
+        """Сколько ждать, пока станет доступно cost токенов (но не больше емкости)."""
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if missing > 0 else 0.0
+
+    def consume(self, cost: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= cost
+
+
+class _ChatState:
+    def __init__(self, min_interval: float, per_minute: int):
+        self.per_second = TokenBucket(1.0 / min_interval if min_interval > 0 else 1000.0, 1)
+        self.per_minute = TokenBucket(per_minute / 60.0, per_minute)
+        self.nominal_minute_rate = self.per_minute.rate
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        self.sent = 0
+        self.flood_waits = 0
+        self.retries = 0
+
+
+class TelegramRateLimiter:
+    """Per-chat и глобальные ведра токенов + обработка RetryAfter и сетевых ошибок."""
+
+    def __init__(self, min_interval: float = TELEGRAM_CHAT_MIN_INTERVAL,
+                 per_minute: int = TELEGRAM_CHAT_MESSAGES_PER_MINUTE,
+                 global_per_second: float = TELEGRAM_GLOBAL_MESSAGES_PER_SECOND,
+                 max_retries: int = TELEGRAM_MAX_RETRIES,
+                 backoff_base: float = TELEGRAM_BACKOFF_BASE,
+                 backoff_max: float = TELEGRAM_BACKOFF_MAX,
+                 max_flood_waits: int = TELEGRAM_MAX_FLOOD_WAITS):
+        self.min_interval = min_interval
+        self.per_minute = max(1, per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_flood_waits = max_flood_waits
+        self._global = TokenBucket(global_per_second, global_per_second)
+        # Блокировки создаются лениво внутри работающего цикла событий (важно для Python 3.9)
+        self._global_lock: Optional[asyncio.Lock] = None
+        self._chats: Dict[str, _ChatState] = {}
+
+    def _chat(self, chat_id) -> _ChatState:
+        chat_id = str(chat_id)
+        if chat_id not in self._chats:
+            self._chats[chat_id] = _ChatState(self.min_interval, self.per_minute)
+        return self._chats[chat_id]
+
+    async def acquire(self, chat_id, cost: int = 1) -> float:
+        """
+        Ждет, пока в чат можно отправить cost сообщений, и резервирует их.
+        Возвращает фактическое время ожидания в секундах.
+        """
+        chat = self._chat(chat_id)
+        waited = 0.0
+        async with chat.lock:
+            while True:
+                now = time.monotonic()
+                delay = max(chat.blocked_until - now,
+                            chat.per_second.delay(1, now),
+                            chat.per_minute.delay(cost, now))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+                waited += delay
+            if self._global_lock is None:
+                self._global_lock = asyncio.Lock()
+            async with self._global_lock:
+                while True:
+                    now = time.monotonic()
+                    delay = self._global.delay(cost, now)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                    waited += delay
+                self._global.consume(cost, now)
+            chat.per_second.consume(1, now)
+            chat.per_minute.consume(cost, now)
+        if waited > 0:
+            print(f"⏳ Лимит Telegram для чата {chat_id}: пауза {waited:.1f} сек.")
+        return waited
+
+    def _on_flood(self, chat: _ChatState, seconds: float) -> None:
+        chat.blocked_until = max(chat.blocked_until, time.monotonic() + seconds)
+        chat.flood_waits += 1
+        chat.per_minute.rate = max(chat.nominal_minute_rate * _MIN_RATE_FACTOR,
+                                   chat.per_minute.rate * _FLOOD_SLOWDOWN)
+        chat.per_minute.tokens = min(chat.per_minute.tokens, 0)
+
+    def _on_success(self, chat: _ChatState) -> None:
+        chat.sent += 1
+        chat.per_minute.rate = min(chat.nominal_minute_rate, chat.per_minute.rate * _RECOVERY_STEP)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": равномерно от 0 до экспоненциальной границы
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def send(self, method: Callable[..., Awaitable[Any]], *args, cost: int = 1, **kwargs) -> Any:
+        """
+        Вызывает метод бота (bot.send_media_group и т.п.) с соблюдением лимитов.
+        chat_id берется из kwargs. После RetryAfter вызов повторяется (до
+        max_flood_waits раз), сетевые ошибки до отправки запроса — до max_retries раз.
+        TimedOut и сетевые ошибки после отправки (Telegram мог принять сообщение),
+        BadRequest и прочие ошибки пробрасываются сразу.
+        """
+        chat_id = kwargs.get("chat_id")
+        chat = self._chat(chat_id)
+        attempt = 0
+        flood_waits = 0
+        while True:
+            await self.acquire(chat_id, cost)
+            try:
+                result = await method(*args, **kwargs)
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                self._on_flood(chat, seconds)
+                if flood_waits >= self.max_flood_waits:
+                    raise
+                flood_waits += 1
+                print(f"🚦 Flood control для чата {chat_id}: повтор через {seconds:.0f} сек.")
+                continue
+            except BadRequest:
+                raise
+            except NetworkError as e:
+                # Повтор неидемпотентной отправки после таймаута чтения продублировал бы пост
+                if attempt >= self.max_retries or not request_not_sent(e):
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                chat.retries += 1
+                print(f"🔁 Сетевая ошибка Telegram ({e}). Попытка {attempt}/{self.max_retries} через {delay:.1f} сек.")
+                await asyncio.sleep(delay)
+                continue
+            self._on_success(chat)
+            return result
+
+    def state(self) -> Dict[str, Any]:
+        """Снимок состояния лимитера (для логов и диагностики)."""
+        now = time.monotonic()
+        self._global._refill(now)
+        chats = {}
+        for chat_id, chat in self._chats.items():
+            chat.per_minute._refill(now)
+            chats[chat_id] = {
+                "minute_tokens": round(chat.per_minute.tokens, 2),
+                "minute_rate": round(chat.per_minute.rate * 60, 2),
+                "blocked_for": round(max(0.0, chat.blocked_until - now), 1),
+                "sent": chat.sent,
+                "flood_waits": chat.flood_waits,
+                "retries": chat.retries,
+            }
+        return {"global_tokens": round(self._global.tokens, 2), "chats": chats}
+
+
+_default_limiter: Optional[TelegramRateLimiter] = None
+
+
+def get_rate_limiter() -> TelegramRateLimiter:
+    """Общий на процесс лимитер: все публикаторы делят одни и те же ведра."""
+    global _default_limiter
+    if _default_limiter is None:
+        _default_limiter = TelegramRateLimiter()
+    return _default_limiter
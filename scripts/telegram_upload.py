@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Потоковая загрузка больших медиа в Telegram с ограниченной памятью.
+
+python-telegram-bot при отправке файла читает его целиком (InputFile) и
+собирает multipart-тело в памяти, поэтому пиковая память растет как размер
+видео × число одновременных публикаций. Здесь тело multipart/form-data
+отдается httpx асинхронным итератором: поля и заголовки частей — заранее,
+содержимое файлов — кусками по TELEGRAM_UPLOAD_CHUNK_SIZE прямо с диска
+(или из уже открытого файла/буфера). Content-Length считается заранее,
+поэтому запрос обычный, без chunked-кодирования. В памяти одновременно
+находится не больше одного куска на загрузку.
+
+Ответ Bot API превращается в объекты PTB (Message), а ошибки — в
+исключения telegram.error (RetryAfter, BadRequest, NetworkError), поэтому
+вызовы идут через telegram_limiter и send_with_file_ids как обычные методы бота.
+Ход загрузки (процент, МБ/с) печатается по мере отправки.
+
+Файлы меньше TELEGRAM_STREAM_UPLOAD_MIN_MB выгоднее отправлять обычным путем
+PTB: см. needs_streaming().
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import IO, Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+import httpx
+from telegram import Message
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+TELEGRAM_UPLOAD_CHUNK_SIZE = int(os.getenv("TELEGRAM_UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Файлы от этого размера загружаются потоково (0 — всегда потоково)
+TELEGRAM_STREAM_UPLOAD_MIN_MB = float(os.getenv("TELEGRAM_STREAM_UPLOAD_MIN_MB", "10"))
+# Как часто печатать ход загрузки (доля от размера)
+TELEGRAM_UPLOAD_PROGRESS_STEP = float(os.getenv("TELEGRAM_UPLOAD_PROGRESS_STEP", "0.1"))
+
+# Файл для загрузки: путь или открытый файловый объект (перематывается, не закрывается)
+UploadSource = Union[str, IO[bytes]]
+
+_CONTENT_TYPES = {"photo": "image/jpeg", "video": "video/mp4", "document": "application/octet-stream"}
+
+
+def source_size(source: UploadSource) -> int:
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    position = source.tell()
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(position)
+    return size
+
+
+def needs_streaming(refs: Sequence[Any]) -> bool:
+    """Есть ли среди ссылок (строка — file_id, иначе открытый файл) файл не меньше порога потоковой загрузки."""
+    threshold = TELEGRAM_STREAM_UPLOAD_MIN_MB * 1024 * 1024
+    return any(ref is not None and not isinstance(ref, str) and source_size(ref) >= threshold for ref in refs)
+
+
+class UploadProgress:
+    """Счетчик отправленных байтов с печатью процента и скорости."""
+
+    def __init__(self, label: str, total: int, step: float = TELEGRAM_UPLOAD_PROGRESS_STEP):
+        self.label = label
+        self.total = total
+        self.step = step
+        self.sent = 0
+        self.started = time.monotonic()
+        self._next_report = step
+
+    def advance(self, count: int) -> None:
+        self.sent += count
+        if self.total and self.step > 0 and self.sent / self.total >= self._next_report and self.sent < self.total:
+            print(f"📤 {self.label}: {self.sent / self.total:.0%} ({self.sent / 1024 / 1024:.1f} МБ, "
+                  f"{self.throughput() / 1024 / 1024:.2f} МБ/с)")
+            while self._next_report <= self.sent / self.total:
+                self._next_report += self.step
+
+    def throughput(self) -> float:
+        """Средняя скорость с начала загрузки, байт/с."""
+        return self.sent / max(time.monotonic() - self.started, 1e-6)
+
+    def finish(self) -> None:
+        elapsed = time.monotonic() - self.started
+        print(f"✅ {self.label}: {self.sent / 1024 / 1024:.1f} МБ за {elapsed:.1f} с "
+              f"({self.throughput() / 1024 / 1024:.2f} МБ/с)")
+
+
+class StreamingMultipart:
+    """
+    Тело multipart/form-data: текстовые поля + файлы, читаемые кусками.
+    Итерироваться можно повторно (повтор запроса после RetryAfter/сетевой ошибки).
+    """
+
+    def __init__(self, fields: Dict[str, Any], files: Dict[str, Tuple[str, UploadSource, str]],
+                 chunk_size: int = TELEGRAM_UPLOAD_CHUNK_SIZE, label: str = "загрузка"):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.label = label
+        self._parts: List[Tuple[bytes, Optional[UploadSource], int]] = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+            header = (f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                      f"{value}\r\n").encode("utf-8")
+            self._parts.append((header, None, 0))
+        for name, (filename, source, content_type) in files.items():
+            header = (f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; "
+                      f"filename=\"{filename}\"\r\nContent-Type: {content_type}\r\n\r\n").encode("utf-8")
+            self._parts.append((header, source, source_size(source)))
+        self._closing = f"--{self.boundary}--\r\n".encode("utf-8")
+        self.file_bytes = sum(size for _header, source, size in self._parts if source is not None)
+        self.content_length = (sum(len(header) + size + (2 if source is not None else 0)
+                                   for header, source, size in self._parts) + len(self._closing))
+        self.progress: Optional[UploadProgress] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": f"multipart/form-data; boundary={self.boundary}",
+                "Content-Length": str(self.content_length)}
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self.progress = UploadProgress(self.label, self.file_bytes)
+        for header, source, size in self._parts:
+            yield header
+            if source is None:
+                continue
+            # Чтение с диска (или из сброшенного на диск буфера) — в потоке, чтобы не держать цикл событий
+            handle = await asyncio.to_thread(open, source, "rb") if isinstance(source, str) else source
+            try:
+                handle.seek(0)
+                remaining = size
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(handle.read, min(self.chunk_size, remaining))
+                    if not chunk:
+                        raise NetworkError(f"Файл {self.label} оказался короче ожидаемого")
+                    remaining -= len(chunk)
+                    self.progress.advance(len(chunk))
+                    yield chunk
+            finally:
+                if isinstance(source, str):
+                    handle.close()
+                else:
+                    handle.seek(0)
+            yield b"\r\n"
+        yield self._closing
+
+
+def _raise_for_response(status_code: int, data: Dict[str, Any]) -> None:
+    description = data.get("description") or f"HTTP {status_code}"
+    parameters = data.get("parameters") or {}
+    if parameters.get("retry_after") is not None:
+        raise RetryAfter(int(parameters["retry_after"]))
+    if status_code in (401, 403):
+        raise Forbidden(description)
+    if status_code == 400:
+        raise BadRequest(description)
+    if status_code >= 500 or status_code == 0:
+        raise NetworkError(description)
+    raise TelegramError(description)
+
+
+async def call_with_upload(bot, method: str, fields: Dict[str, Any],
+                           files: Dict[str, Tuple[str, UploadSource, str]],
+                           read_timeout: float = 120, write_timeout: float = 120,
+                           connect_timeout: float = 60, label: Optional[str] = None) -> Any:
+    """Вызывает метод Bot API с потоковой отправкой файлов. Возвращает поле result ответа."""
+    body = StreamingMultipart(fields, files, label=label or method)
+    timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=write_timeout, pool=connect_timeout)
+    url = f"{TELEGRAM_API_URL}/bot{bot.token}/{method}"
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.post(url, content=body, headers=body.headers)
+    except httpx.HTTPError as e:
+        raise NetworkError(f"Ошибка сети при загрузке {body.label}: {e}") from e
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    if response.status_code != 200 or not data.get("ok"):
+        _raise_for_response(response.status_code, data)
+    if body.progress is not None:
+        body.progress.finish()
+    return data["result"]
+
+
+def _filename(source: UploadSource, kind: str, index: int) -> str:
+    name = source if isinstance(source, str) else getattr(source, "name", None)
+    if isinstance(name, str) and name:
+        return os.path.basename(name).replace('"', "")
+    return f"{kind}{index}{'.mp4' if kind == 'video' else '.jpg'}"
+
+
+async def send_media_group_streaming(bot, chat_id, media: Sequence[Dict[str, Any]], **timeouts) -> List[Message]:
+    """
+    sendMediaGroup с потоковой загрузкой. media — словари InputMedia Bot API
+    ({"type": "photo"/"video", "media": file_id (строка) или открытый файл, "caption": ..., ...});
+    файлы передаются как attach://fileN.
+    """
+    items, files = [], {}
+    for index, item in enumerate(media):
+        item = {key: value for key, value in item.items() if value not in (None, "")}
+        source = item["media"]
+        if not isinstance(source, str):
+            attach = f"file{index}"
+            content_type = _CONTENT_TYPES.get(item["type"], "application/octet-stream")
+            files[attach] = (_filename(source, item["type"], index), source, content_type)
+            item["media"] = f"attach://{attach}"
+        items.append(item)
+    result = await call_with_upload(bot, "sendMediaGroup", {"chat_id": chat_id, "media": items}, files,
+                                    label=f"медиагруппа для {chat_id}", **timeouts)
+    return Message.de_list(result, bot)
+
+
+async def send_video_streaming(bot, chat_id, video: UploadSource, caption: Optional[str] = None,
+                               parse_mode: Optional[str] = None, supports_streaming: bool = True,
+                               **timeouts) -> Message:
+    """sendVideo с потоковой загрузкой файла."""
+    fields = {"chat_id": chat_id, "caption": caption, "parse_mode": parse_mode,
+              "supports_streaming": "true" if supports_streaming else None}
+    files = {"video": (_filename(video, "video", 0), video, _CONTENT_TYPES["video"])}
+    result = await call_with_upload(bot, "sendVideo", fields, files, label=f"видео для {chat_id}", **timeouts)
+    return Message.de_json(result, bot)
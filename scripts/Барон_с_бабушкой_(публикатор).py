@@ -4,10 +4,22 @@
 import asyncio
 import os
 import logging
+from typing import Sequence, Union
 from telegram import Bot, InputMediaVideo
 from telegram.error import TelegramError
 from telegram.constants import ParseMode
 
+# Общий слой лимитов Telegram (ведра токенов, RetryAfter, повторы)
+from telegram_limiter import get_rate_limiter
+# Кэш Telegram file_id по SHA-1 содержимого
+from file_id_cache import FileIdCache, file_sha1, send_with_file_ids
+# Потоковая загрузка больших видео с ограниченной памятью
+from telegram_upload import needs_streaming, send_media_group_streaming
+# Лимит подписи Telegram и обрезка без порчи HTML и эмодзи
+from caption_engine import TELEGRAM_CAPTION_LIMIT, truncate_html
+# moov в начало MP4 и параметры видео для Telegram
+from mp4_faststart import Mp4Error, make_faststart, video_send_kwargs
+
 # --- Настройка логирования ---
 logging.basicConfig(
     level=logging.INFO,
@@ -36,29 +48,33 @@ LETTER_TEXT = """Мои дражайшие читатели! Позвольте
 Остаюсь ваш, несколько виртуальный, но неизменно преданный,
 Барон Сарказм."""
 
-# Максимальная длина подписи в Telegram
-TELEGRAM_CAPTION_LIMIT = 1024
-
 
-async def publish_video_with_caption(bot_token: str, chat_id: str, video_path: str, caption_text: str) -> bool:
+async def publish_video_with_caption(bot_token: str, chat_id: Union[str, Sequence[str]], video_path: str,
+                                     caption_text: str) -> bool:
     """
-    Публикует видео с подписью в указанный Telegram чат.
+    Публикует видео с подписью в указанный Telegram чат (или несколько чатов).
     Видео отправляется как единственный элемент медиагруппы, чтобы текст был его подписью.
     Подпись будет укорочена, если она превышает лимит Telegram.
+    При нескольких чатах видео загружается один раз в первый чат, а в остальные
+    параллельно отправляется полученный file_id.
 
     Args:
         bot_token: Токен Telegram бота.
-        chat_id: ID целевого чата/канала.
+        chat_id: ID целевого чата/канала, список ID или строка с ID через запятую.
         video_path: Локальный путь к видеофайлу.
         caption_text: Текст подписи для видео.
 
     Returns:
-        True, если публикация прошла успешно, иначе False.
+        True, если публикация прошла успешно во все чаты, иначе False.
     """
+    if isinstance(chat_id, str):
+        chat_ids = [chat.strip() for chat in chat_id.split(",") if chat.strip()]
+    else:
+        chat_ids = [str(chat) for chat in chat_id or []]
     if not bot_token:
         logger.error("❌ Токен Telegram бота не указан (TELEGRAM_TOKEN).")
         return False
-    if not chat_id:
+    if not chat_ids:
         logger.error("❌ ID чата Telegram не указан (TELEGRAM_CHAT_ID).")
         return False
     if not os.path.exists(video_path):
@@ -70,39 +86,77 @@ async def publish_video_with_caption(bot_token: str, chat_id: str, video_path: s
         logger.warning("⚠️ Текст подписи пуст. Видео будет отправлено без подписи.")
         processed_caption = ""
 
-        # Проверяем и укорачиваем подпись, если она все еще слишком длинная
-    if len(processed_caption) > TELEGRAM_CAPTION_LIMIT:
+    # Проверяем и укорачиваем подпись, если она слишком длинная: лимит считается
+    # по видимому тексту в UTF-16, теги и составные эмодзи не разрезаются
+    processed_caption, truncated = truncate_html(processed_caption, TELEGRAM_CAPTION_LIMIT)
+    if truncated:
         logger.warning(
-            f"⚠️ Длина подписи ({len(processed_caption)} символов) превышает лимит Telegram ({TELEGRAM_CAPTION_LIMIT} символов).")
-        # Укорачиваем, стараясь сохранить целые слова в конце, если возможно
-        # Это простая обрезка, можно улучшить, чтобы не резать слова
-        processed_caption = processed_caption[:TELEGRAM_CAPTION_LIMIT - 3] + "..."
+            f"⚠️ Длина подписи ({len(caption_text)} символов) превышает лимит Telegram ({TELEGRAM_CAPTION_LIMIT} символов).")
         logger.info(f"Подпись была укорочена до: {processed_caption}")
 
     bot = Bot(token=bot_token)
-    logger.info(f"🤖 Бот инициализирован. Попытка отправки видео в чат {chat_id}...")
-
-    try:
-        with open(video_path, "rb") as video_file:
+    logger.info(f"🤖 Бот инициализирован. Попытка отправки видео в чаты: {', '.join(chat_ids)}...")
+
+    # Кэш file_id: повторная публикация того же видео не загружает его заново
+    file_id_cache = FileIdCache().load()
+
+    async def send_to_chat(target_chat: str):
+        async def send_video(refs):
+            if needs_streaming(refs):
+                # Большое видео отправляется потоком кусками, память не растет с размером файла
+                return await get_rate_limiter().send(
+                    send_media_group_streaming,
+                    bot,
+                    chat_id=target_chat,
+                    media=[{"type": "video", "media": refs[0], "caption": processed_caption,
+                            "parse_mode": ParseMode.HTML, "supports_streaming": True, **video_params}],
+                    read_timeout=120,
+                    connect_timeout=60,
+                    write_timeout=120
+                )
             # Создаем медиа-элемент для видео с подписью
             video_media = InputMediaVideo(
-                media=video_file,
+                media=refs[0],
                 caption=processed_caption,
-                parse_mode=ParseMode.HTML  # Используем HTML для поддержки некоторых Unicode символов и форматирования
+                parse_mode=ParseMode.HTML,  # Используем HTML для поддержки некоторых Unicode символов и форматирования
+                supports_streaming=True,
+                **video_params
             )
-
-            await bot.send_media_group(
-                chat_id=chat_id,
+            return await get_rate_limiter().send(
+                bot.send_media_group,
+                chat_id=target_chat,
                 media=[video_media],
                 read_timeout=120,
                 connect_timeout=60,
                 write_timeout=120
             )
-        logger.info(f"✅ Видео с подписью успешно отправлено в чат {chat_id}.")
-        return True
+
+        await send_with_file_ids(file_id_cache, [("video", video_sha1, video_path)], send_video)
+        logger.info(f"✅ Видео с подписью успешно отправлено в чат {target_chat}.")
+
+    try:
+        # Без moov в начале Telegram не строит превью и не воспроизводит видео до полной загрузки;
+        # SHA-1 считается уже по итоговому файлу
+        video_info = await asyncio.to_thread(make_faststart, video_path)
+        if video_info.remuxed:
+            logger.info("🎞️ moov перенесен в начало видео (faststart).")
+        video_params = video_send_kwargs(video_info)
+        video_sha1 = file_sha1(video_path)
+        # Первый чат загружает видео, остальные получают file_id параллельно
+        await send_to_chat(chat_ids[0])
+        file_id_cache.save()
+        results = await asyncio.gather(*(send_to_chat(chat) for chat in chat_ids[1:]), return_exceptions=True)
+        failed = [(chat, result) for chat, result in zip(chat_ids[1:], results) if isinstance(result, BaseException)]
+        for chat, error in failed:
+            logger.error(f"❌ Не удалось отправить видео в чат {chat}: {error}")
+        file_id_cache.save()
+        return not failed
     except FileNotFoundError:
         logger.error(f"❌ Ошибка: Файл видео не найден по пути {video_path}.")
         return False
+    except Mp4Error as e:
+        logger.error(f"❌ Видео {video_path} не является корректным MP4: {e}")
+        return False
     except TelegramError as e:
         logger.error(f"❌ Ошибка Telegram API при отправке видео: {e}")
         return False
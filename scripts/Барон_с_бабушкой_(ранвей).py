@@ -12,11 +12,18 @@ import logging
 # --- Конец диагностики ---
 
 import requests  # Остальные импорты оставляем как были
+import asyncio
 import json
+import mimetypes
 import time
 import base64
 from pathlib import Path
 
+from mp4_faststart import Mp4Error, make_faststart
+# Журнал задач Runway: после сбоя задачи продолжаются, а не создаются заново
+from runway_journal import (RunwayJournal, params_hash, STATUS_SUCCEEDED, STATUS_DOWNLOADED, STATUS_FAILED,
+                            STATUS_LOST)
+
 # --- Настройка Логирования ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("runway_video_generator")
@@ -86,15 +93,29 @@ RUNWAY_MODEL_NAME = "gen4_turbo"
 VIDEO_DURATION_SECONDS = 10
 ASPECT_RATIO = "1280:720"  # ИСПРАВЛЕНО на конкретное разрешение
 
-# Параметры опроса
-POLLING_INTERVAL_SECONDS = 20
-MAX_POLLING_ATTEMPTS = 60
+# Параметры опроса: пауза растет от минимальной до максимальной (или по прогрессу задачи)
+RUNWAY_POLL_MIN_SECONDS = float(os.getenv("RUNWAY_POLL_MIN_SECONDS", "5"))
+RUNWAY_POLL_MAX_SECONDS = float(os.getenv("RUNWAY_POLL_MAX_SECONDS", "30"))
+RUNWAY_POLL_BACKOFF = float(os.getenv("RUNWAY_POLL_BACKOFF", "1.5"))
+RUNWAY_TASK_TIMEOUT_SECONDS = float(os.getenv("RUNWAY_TASK_TIMEOUT_SECONDS", "1200"))
+RUNWAY_POLL_ERROR_RETRIES = 3
+RUNWAY_CREATE_RETRIES = 3
+RUNWAY_PENDING_STATUSES = ("PENDING", "PROCESSING", "QUEUED", "WAITING", "RUNNING", "THROTTLED")
 REQUEST_TIMEOUT_SECONDS = 60
 
+# Пакетная генерация: JSON-манифест заданий и лимит одновременных задач аккаунта Runway
+RUNWAY_BATCH_MANIFEST = os.getenv("RUNWAY_BATCH_MANIFEST")
+RUNWAY_MAX_CONCURRENCY = int(os.getenv("RUNWAY_MAX_CONCURRENCY", "2"))
+# RUNWAY_FORCE=1 генерирует заново даже уже отрисованные по журналу задания
+RUNWAY_FORCE = os.getenv("RUNWAY_FORCE", "").strip().lower() in ("1", "true", "yes")
+
 # Директория для сохранения
 OUTPUT_DIRECTORY = "zagruzki"
 Path(OUTPUT_DIRECTORY).mkdir(parents=True, exist_ok=True)
 
+# Созданные задачи и их результаты (SQLite открывается при первом обращении)
+task_journal = RunwayJournal()
+
 
 def get_runway_api_key():
     """Получает API-ключ Runway из переменных окружения."""
@@ -139,7 +160,14 @@ def download_video(video_url: str, output_path: str) -> bool:
             for chunk in response.iter_content(chunk_size=8192):
                 f.write(chunk)
         logger.info(f"Видео успешно сохранено: {output_path}")
+        # moov в начало файла: Telegram сможет показывать превью и воспроизводить до полной загрузки
+        info = make_faststart(output_path)
+        logger.info(f"MP4: {info.width}x{info.height}, {info.duration:.1f} с, "
+                    f"{'moov перенесен в начало' if info.remuxed else 'уже faststart'}")
         return True
+    except Mp4Error as e:
+        logger.error(f"Скачанное видео {output_path} не является корректным MP4: {e}")
+        return False
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка скачивания видео {video_url}: {e}")
         return False
@@ -148,8 +176,260 @@ def download_video(video_url: str, output_path: str) -> bool:
         return False
 
 
+def _extract_video_url(task_output) -> str | None:
+    """URL видео из поля output завершенной задачи (список URL, словарь или строка)."""
+    if isinstance(task_output, list) and len(task_output) > 0 and isinstance(task_output[0], str):
+        return task_output[0]
+    if isinstance(task_output, dict) and task_output.get('url'):
+        return task_output['url']
+    if isinstance(task_output, str) and task_output.startswith('http'):
+        return task_output
+    return None
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    """Ответ 429 от Runway: лимит запросов или параллельных задач аккаунта."""
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Ответ 404 от Runway: задачи с таким ID больше нет."""
+    return getattr(error, 'status_code', None) == 404 or type(error).__name__ == "NotFoundError"
+
+
+def load_batch_jobs(manifest_path: str | None) -> list[dict]:
+    """
+    Задания пакетной генерации из JSON-манифеста: список объектов
+    {"name", "prompt_text", "image_url" или "image_path", необязательно "duration", "ratio", "model", "seed"}.
+    Без манифеста — одно задание из констант скрипта.
+    """
+    if not manifest_path:
+        return [{"name": "baron_video", "image_url": INPUT_IMAGE_URL, "prompt_text": RUNWAY_TEXT_PROMPT}]
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data.get("jobs", []) if isinstance(data, dict) else data
+    valid_jobs = []
+    for index, job in enumerate(jobs):
+        if not isinstance(job, dict) or not job.get("prompt_text") or not (job.get("image_url") or job.get("image_path")):
+            logger.warning(f"Задание #{index} в манифесте {manifest_path} пропущено: нужны prompt_text и image_url/image_path.")
+            continue
+        valid_jobs.append({"name": f"clip_{index + 1:02d}", **job})
+    logger.info(f"📋 Манифест {manifest_path}: {len(valid_jobs)} заданий.")
+    return valid_jobs
+
+
+def image_path_to_base64_data_uri(image_path: str) -> str | None:
+    """Читает локальное изображение и конвертирует его в base64 data URI."""
+    try:
+        content_type = mimetypes.guess_type(image_path)[0] or 'image/png'
+        with open(image_path, "rb") as f:
+            base64_image = base64.b64encode(f.read()).decode("utf-8")
+        return f"data:{content_type};base64,{base64_image}"
+    except OSError as e:
+        logger.error(f"Ошибка чтения изображения {image_path}: {e}")
+        return None
+
+
+def job_params_hash(job: dict) -> str:
+    """Ключ задания в журнале: параметры генерации со ссылкой на изображение вместо его содержимого."""
+    return params_hash(build_generation_params(job, job.get("image_path") or job["image_url"]))
+
+
+def build_generation_params(job: dict, image_data_uri: str) -> dict:
+    params = {
+        "model": job.get("model", RUNWAY_MODEL_NAME),
+        "prompt_image": image_data_uri,
+        "prompt_text": job["prompt_text"].strip(),
+        "duration": job.get("duration", VIDEO_DURATION_SECONDS),
+        "ratio": job.get("ratio", ASPECT_RATIO),
+    }
+    if job.get("seed") is not None:
+        params["seed"] = job["seed"]
+    return params
+
+
+def next_poll_interval(interval: float, elapsed: float, progress) -> float:
+    """
+    Следующая пауза опроса: растет в RUNWAY_POLL_BACKOFF раз от RUNWAY_POLL_MIN_SECONDS
+    до RUNWAY_POLL_MAX_SECONDS, а если Runway сообщает прогресс — половина оценки оставшегося времени.
+    """
+    if isinstance(progress, (int, float)) and 0 < progress < 1 and elapsed > 0:
+        remaining = elapsed * (1 - progress) / progress
+        return min(max(remaining / 2, RUNWAY_POLL_MIN_SECONDS), RUNWAY_POLL_MAX_SECONDS)
+    return min(interval * RUNWAY_POLL_BACKOFF, RUNWAY_POLL_MAX_SECONDS)
+
+
+async def create_task(client, job: dict, generation_params: dict) -> str | None:
+    """Создает задачу image_to_video; на 429 повторяет с экспоненциальной паузой."""
+    log_params_preview = {k: (v[:70] + '...' if isinstance(v, str) and len(v) > 70 else v) for k, v in
+                          generation_params.items()}
+    logger.debug(f"[{job['name']}] Параметры для Runway: {json.dumps(log_params_preview, indent=2)}")
+    delay = RUNWAY_POLL_MIN_SECONDS
+    for attempt in range(RUNWAY_CREATE_RETRIES + 1):
+        try:
+            task = await asyncio.to_thread(client.image_to_video.create, **generation_params)
+        except RunwayAPIError as e:
+            if _is_rate_limited(e) and attempt < RUNWAY_CREATE_RETRIES:
+                logger.warning(f"[{job['name']}] Лимит Runway при создании задачи, повтор через {delay:.0f} с: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RUNWAY_POLL_MAX_SECONDS)
+                continue
+            logger.error(f"❌ [{job['name']}] Ошибка SDK Runway при создании задачи: {e}", exc_info=True)
+            return None
+        task_id = getattr(task, 'id', None)
+        if not task_id:
+            logger.error(f"[{job['name']}] Не удалось получить ID задачи от Runway.")
+            logger.debug(f"Ответ от Runway (create task): {task}")
+        return task_id
+    return None
+
+
+async def wait_for_task(client, job: dict, task_id: str, first_delay: float = RUNWAY_POLL_MIN_SECONDS) -> str | None:
+    """
+    Опрашивает задачу с адаптивной паузой до завершения; возвращает URL видео или None.
+    Смена статуса сразу записывается в журнал задач.
+    """
+    key = job["params_hash"]
+    started = time.monotonic()
+    interval = first_delay
+    last_status = None
+    errors = 0
+    while time.monotonic() - started < RUNWAY_TASK_TIMEOUT_SECONDS:
+        await asyncio.sleep(interval)
+        try:
+            task_status = await asyncio.to_thread(client.tasks.retrieve, task_id)
+            errors = 0
+        except RunwayAPIError as e:
+            if _is_not_found(e):
+                logger.error(f"❌ [{job['name']}] Задача Runway {task_id} не найдена: {e}")
+                task_journal.update(key, STATUS_LOST)
+                return None
+            interval = max(interval, RUNWAY_POLL_MIN_SECONDS)
+            errors += 1
+            if errors > RUNWAY_POLL_ERROR_RETRIES:
+                logger.error(f"❌ [{job['name']}] Ошибка SDK Runway при опросе задачи {task_id}: {e}", exc_info=True)
+                return None
+            interval = RUNWAY_POLL_MAX_SECONDS if _is_rate_limited(e) else min(interval * 2, RUNWAY_POLL_MAX_SECONDS)
+            logger.warning(f"[{job['name']}] Ошибка опроса {task_id} ({errors}/{RUNWAY_POLL_ERROR_RETRIES}), "
+                           f"повтор через {interval:.0f} с: {e}")
+            continue
+        current_status = str(getattr(task_status, 'status', 'UNKNOWN')).upper()
+        progress = getattr(task_status, 'progress', None)
+        elapsed = time.monotonic() - started
+        progress_text = f", прогресс {progress:.0%}" if isinstance(progress, (int, float)) else ""
+        logger.info(f"[{job['name']}] Статус Runway {task_id}: {current_status}{progress_text} ({elapsed:.0f} с)")
+        if current_status != last_status and current_status not in ("SUCCEEDED", "FAILED", "CANCELLED"):
+            task_journal.update(key, current_status)
+        last_status = current_status
+
+        if current_status == "SUCCEEDED":
+            logger.info(f"🎉 [{job['name']}] Задача Runway {task_id} успешно завершена!")
+            task_output = getattr(task_status, 'output', None)
+            final_video_url = _extract_video_url(task_output)
+            if final_video_url:
+                logger.info(f"[{job['name']}] Получен URL видео: {final_video_url}")
+                task_journal.update(key, STATUS_SUCCEEDED, output_url=final_video_url)
+            else:
+                logger.warning(f"[{job['name']}] Статус SUCCEEDED, но URL видео не найден в ответе: {task_output}")
+                task_journal.update(key, STATUS_FAILED)
+            return final_video_url
+        if current_status in ("FAILED", "CANCELLED"):
+            error_details = getattr(task_status, 'failure', None) or getattr(
+                task_status, 'error_message', 'Детали ошибки отсутствуют в ответе API.')
+            logger.error(f"❌ [{job['name']}] Задача Runway {task_id} завершилась со статусом {current_status}: "
+                         f"{error_details}")
+            logger.debug(f"Полный ответ статуса при ошибке: {task_status}")
+            task_journal.update(key, STATUS_FAILED)
+            return None
+        if current_status not in RUNWAY_PENDING_STATUSES:
+            logger.warning(f"[{job['name']}] Неизвестный статус Runway: {current_status}. Прерывание опроса.")
+            logger.debug(f"Полный ответ статуса: {task_status}")
+            return None
+        interval = next_poll_interval(max(interval, RUNWAY_POLL_MIN_SECONDS), elapsed, progress)
+    logger.warning(f"⏰ [{job['name']}] Таймаут ({RUNWAY_TASK_TIMEOUT_SECONDS:.0f} сек) ожидания задачи Runway {task_id}.")
+    return None
+
+
+async def run_job(client, job: dict, slots: asyncio.Semaphore) -> str | None:
+    """
+    Одно задание: изображение → задача Runway → опрос → скачивание.
+    Слот параллельности занят только пока задача выполняется в Runway:
+    скачивание готового видео идет уже параллельно со следующими задачами.
+    Задача из журнала продолжается (опрос или скачивание) без новой генерации.
+    """
+    key = job["params_hash"]
+    record = task_journal.get(key)
+    if record is not None and record.rendered and not RUNWAY_FORCE:
+        logger.info(f"⏭️ [{job['name']}] Уже отрисовано (задача {record.task_id}): {record.local_path}")
+        return record.local_path
+
+    task_id = record.task_id if record is not None and record.resumable and not RUNWAY_FORCE else None
+    final_video_url = None
+    if task_id and record.status == STATUS_DOWNLOADED:
+        logger.info(f"[{job['name']}] Файл {record.local_path} из журнала не найден, скачиваем видео заново.")
+    if task_id:
+        logger.info(f"⏯️ [{job['name']}] Продолжаем задачу Runway {task_id} из журнала (статус {record.status}).")
+        async with slots:
+            # Повторный опрос дает и свежий URL: ссылки на результат Runway со временем истекают
+            final_video_url = await wait_for_task(client, job, task_id, first_delay=0)
+        if not final_video_url:
+            if job.get("resume_only") or task_journal.get(key).status != STATUS_LOST:
+                return None
+            logger.info(f"[{job['name']}] Задача {task_id} потеряна в Runway, создаем новую.")
+            task_id = None
+    elif job.get("resume_only"):
+        return None
+
+    if not task_id:
+        if job.get("image_path"):
+            image_data_uri = await asyncio.to_thread(image_path_to_base64_data_uri, job["image_path"])
+        else:
+            image_data_uri = await asyncio.to_thread(image_url_to_base64_data_uri, job["image_url"])
+        if not image_data_uri:
+            logger.error(f"[{job['name']}] Не удалось подготовить исходное изображение.")
+            return None
+        generation_params = build_generation_params(job, image_data_uri)
+
+        async with slots:
+            logger.info(f"🚀 [{job['name']}] Создание задачи RunwayML Image-to-Video...")
+            task_id = await create_task(client, job, generation_params)
+            if not task_id:
+                return None
+            # Запись до первого опроса: после сбоя задача будет продолжена, а не создана заново
+            task_journal.record_created(key, job["name"], task_id)
+            logger.info(f"✅ [{job['name']}] Задача Runway создана! ID: {task_id}")
+            final_video_url = await wait_for_task(client, job, task_id)
+
+    if not final_video_url:
+        logger.error(f"[{job['name']}] Финальный URL видео не был получен. Скачивание невозможно.")
+        return None
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    output_path = Path(OUTPUT_DIRECTORY) / f"{job['name']}_{task_id}_{timestamp}.mp4"
+    if not await asyncio.to_thread(download_video, final_video_url, str(output_path)):
+        # Статус остается SUCCEEDED: следующий запуск повторит скачивание без новой генерации
+        logger.error(f"[{job['name']}] Не удалось скачать финальное видео. URL: {final_video_url}")
+        return None
+    task_journal.update(key, STATUS_DOWNLOADED, local_path=str(output_path))
+    logger.info(f"🎉 [{job['name']}] Видео успешно сгенерировано и скачано: {output_path}")
+    return str(output_path)
+
+
+async def run_batch(client, jobs: list[dict]) -> list[str | None]:
+    """Выполняет задания параллельно (не больше RUNWAY_MAX_CONCURRENCY задач в Runway одновременно)."""
+    slots = asyncio.Semaphore(max(RUNWAY_MAX_CONCURRENCY, 1))
+    results = await asyncio.gather(*(run_job(client, job, slots) for job in jobs), return_exceptions=True)
+    final = []
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            logger.error(f"❌ [{job['name']}] Непредвиденная ошибка: {result}",
+                         exc_info=(type(result), result, result.__traceback__))
+            result = None
+        final.append(result)
+    return final
+
+
 def main():
-    """Основная функция для генерации видео."""
+    """Основная функция для генерации видео (одного или пакета из манифеста)."""
     logger.info(f"Запуск main(). RUNWAY_SDK_AVAILABLE: {RUNWAY_SDK_AVAILABLE}")
     if not RUNWAY_SDK_AVAILABLE:
         logger.info("Завершение работы из main(), так как RunwayML SDK недоступен (RUNWAY_SDK_AVAILABLE is False).")
@@ -162,10 +442,30 @@ def main():
     except ValueError:
         return
 
-        # 1. Подготовка исходного изображения
-    image_data_uri = image_url_to_base64_data_uri(INPUT_IMAGE_URL)
-    if not image_data_uri:
-        logger.error("Не удалось подготовить исходное изображение. Завершение работы.")
+    # 1. Задания: манифест из аргумента командной строки или RUNWAY_BATCH_MANIFEST
+    manifest_path = sys.argv[1] if len(sys.argv) > 1 else RUNWAY_BATCH_MANIFEST
+    try:
+        jobs = load_batch_jobs(manifest_path)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Не удалось прочитать манифест заданий {manifest_path}: {e}")
+        return
+    unique_jobs = {}
+    for job in jobs:
+        job["params_hash"] = job_params_hash(job)
+        if job["params_hash"] in unique_jobs:
+            logger.warning(f"Задание {job['name']} повторяет {unique_jobs[job['params_hash']]['name']} и пропущено.")
+            continue
+        unique_jobs[job["params_hash"]] = job
+    # Незавершенные задачи прошлых запусков, которых нет в текущем манифесте, тоже доводим до конца
+    # (уже скачанные видео с пропавшим файлом скачиваются заново только для заданий манифеста)
+    for record in task_journal.unfinished():
+        if record.params_hash not in unique_jobs:
+            logger.info(f"⏯️ В журнале есть незавершенная задача {record.task_id} ({record.name}, {record.status}).")
+            unique_jobs[record.params_hash] = {"name": record.name, "params_hash": record.params_hash,
+                                               "resume_only": True}
+    jobs = list(unique_jobs.values())
+    if not jobs:
+        logger.error("Нет заданий для генерации. Завершение работы.")
         return
 
     # 2. Инициализация клиента RunwayML
@@ -181,99 +481,17 @@ def main():
         logger.error(f"Ошибка инициализации клиента RunwayML: {e}", exc_info=True)
         return
 
-    # 3. Создание задачи генерации видео
-    generation_params = {
-        "model": RUNWAY_MODEL_NAME,
-        "prompt_image": image_data_uri,
-        "prompt_text": RUNWAY_TEXT_PROMPT.strip(),
-        "duration": VIDEO_DURATION_SECONDS,
-        "ratio": ASPECT_RATIO  # Здесь используется "1280:720"
-    }
-
-    task_id = None
+    # 3. Задачи создаются и опрашиваются параллельно в одном цикле asyncio
+    logger.info(f"⏳ Генерация {len(jobs)} видео (одновременно до {RUNWAY_MAX_CONCURRENCY} задач)...")
+    started = time.monotonic()
     try:
-        logger.info("🚀 Создание задачи RunwayML Image-to-Video...")
-        log_params_preview = {k: (v[:70] + '...' if isinstance(v, str) and len(v) > 70 else v) for k, v in
-                              generation_params.items()}
-        logger.debug(f"Параметры для Runway: {json.dumps(log_params_preview, indent=2)}")
-
-        task = client.image_to_video.create(**generation_params)
-        task_id = getattr(task, 'id', None)
-        if not task_id:
-            logger.error("Не удалось получить ID задачи от Runway.")
-            logger.debug(f"Ответ от Runway (create task): {task}")
-            return
-        logger.info(f"✅ Задача Runway создана! ID: {task_id}")
-
-    except RunwayAPIError as e:
-        logger.error(f"❌ Ошибка SDK Runway при создании задачи: {e}", exc_info=True)
-        return
-    except Exception as e:
-        logger.error(f"❌ Общая ошибка при создании задачи Runway: {e}", exc_info=True)
-        return
-
-    # 4. Опрос статуса задачи
-    logger.info(f"⏳ Начало опроса статуса задачи Runway {task_id}...")
-    final_video_url = None
-
-    for attempt in range(MAX_POLLING_ATTEMPTS):
-        try:
-            task_status = client.tasks.retrieve(task_id)
-            current_status = getattr(task_status, 'status', 'UNKNOWN').upper()
-            logger.info(f"Попытка {attempt + 1}/{MAX_POLLING_ATTEMPTS}. Статус Runway {task_id}: {current_status}")
-
-            if current_status == "SUCCEEDED":
-                logger.info(f"🎉 Задача Runway {task_id} успешно завершена!")
-                task_output = getattr(task_status, 'output', None)
-
-                if isinstance(task_output, list) and len(task_output) > 0 and isinstance(task_output[0], str):
-                    final_video_url = task_output[0]
-                elif isinstance(task_output, dict) and task_output.get('url'):
-                    final_video_url = task_output['url']
-                elif isinstance(task_output, str) and task_output.startswith('http'):
-                    final_video_url = task_output
-
-                if final_video_url:
-                    logger.info(f"Получен URL видео: {final_video_url}")
-                else:
-                    logger.warning(f"Статус SUCCEEDED, но URL видео не найден в ответе: {task_output}")
-                break
-
-            elif current_status == "FAILED":
-                logger.error(f"❌ Задача Runway {task_id} завершилась с ошибкой (FAILED)!")
-                error_details = getattr(task_status, 'error_message', 'Детали ошибки отсутствуют в ответе API.')
-                logger.error(f"Детали ошибки Runway: {error_details}")
-                logger.debug(f"Полный ответ статуса при ошибке: {task_status}")
-                break
-
-            elif current_status in ["PENDING", "PROCESSING", "QUEUED", "WAITING", "RUNNING"]:
-                time.sleep(POLLING_INTERVAL_SECONDS)
-            else:
-                logger.warning(f"Неизвестный или неожиданный статус Runway: {current_status}. Прерывание опроса.")
-                logger.debug(f"Полный ответ статуса: {task_status}")
-                break
-
-        except RunwayAPIError as e:
-            logger.error(f"❌ Ошибка SDK Runway при опросе задачи {task_id}: {e}", exc_info=True)
-            break
-        except Exception as e:
-            logger.error(f"❌ Общая ошибка при опросе статуса Runway {task_id}: {e}", exc_info=True)
-            break
-    else:
-        logger.warning(
-            f"⏰ Таймаут ({MAX_POLLING_ATTEMPTS * POLLING_INTERVAL_SECONDS} сек) ожидания завершения задачи Runway {task_id}.")
-
-    # 5. Скачивание видео
-    if final_video_url:
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
-        output_filename = f"baron_video_{task_id}_{timestamp}.mp4"
-        output_path = Path(OUTPUT_DIRECTORY) / output_filename
-        if not download_video(final_video_url, str(output_path)):
-            logger.error(f"Не удалось скачать финальное видео. URL: {final_video_url}")
-        else:
-            logger.info(f"🎉 Видео успешно сгенерировано и скачано: {output_path}")
-    else:
-        logger.error("Финальный URL видео не был получен. Скачивание невозможно.")
+        results = asyncio.run(run_batch(client, jobs))
+    finally:
+        task_journal.close()
+    succeeded = [path for path in results if path]
+    logger.info(f"📊 Готово {len(succeeded)}/{len(jobs)} видео за {time.monotonic() - started:.0f} с.")
+    for job, path in zip(jobs, results):
+        logger.info(f"   {'✅' if path else '❌'} {job['name']}: {path or 'не получено'}")
 
     logger.info("--- ✅ Завершение работы скрипта ---")
 
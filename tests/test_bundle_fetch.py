@@ -0,0 +1,122 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# Общие модули из scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+import b2_download
+from b2_download import _fetch_bundle_sync
+from group_bundle import BundleError, fetch_bundle_members, pack_group
+from media_cache import MediaCache, cache_key
+
+BUNDLE_KEY = "folder/20250101-1200.bundle"
+MEMBERS = {
+    ".mp4": os.urandom(200_000),
+    ".json": b'{"content": "text"}',
+    ".png": os.urandom(5_000),
+    "_sarcasm.png": os.urandom(3_000),
+}
+
+
+class _Download:
+    def __init__(self, data):
+        self.data = data
+
+    def save(self, f, allow_seeking=True):
+        for start in range(0, len(self.data), 4096):
+            f.write(self.data[start:start + 4096])
+
+
+class FakeBucket:
+    """Бакет с одним бандлом; считает запросы скачивания."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.requests = []
+
+    def download_file_by_name(self, file_name, range_=None):
+        assert file_name == BUNDLE_KEY
+        self.requests.append(range_)
+        if range_ is None:
+            return _Download(self.raw)
+        return _Download(self.raw[range_[0]:range_[1] + 1])
+
+
+@pytest.fixture
+def bucket():
+    out = io.BytesIO()
+    pack_group("20250101-1200", MEMBERS, out)
+    return FakeBucket(out.getvalue())
+
+
+def _targets(directory, suffixes):
+    return {suffix: str(directory / f"20250101-1200{suffix}") for suffix in suffixes}
+
+
+def _assert_files(targets):
+    for suffix, path in targets.items():
+        with open(path, "rb") as f:
+            assert f.read() == MEMBERS[suffix]
+
+
+def test_full_group_with_cache_is_one_request_then_none(tmp_path, bucket):
+    cache = MediaCache(directory=str(tmp_path / "cache"))
+    targets = _targets(tmp_path / "first", MEMBERS)
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, targets, cache, "sha1-bundle")
+    assert bucket.requests == [None]
+    _assert_files(targets)
+    assert all(cache.contains(cache_key(hashlib.sha1(data).hexdigest()))
+               for data in MEMBERS.values())
+
+    retry = _targets(tmp_path / "retry", MEMBERS)
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, retry, cache, "sha1-bundle")
+    assert bucket.requests == [None]
+    _assert_files(retry)
+    assert not [name for name in os.listdir(cache.directory) if name.startswith(".tmp-")]
+
+
+def test_group_without_json_is_still_one_request(tmp_path, bucket):
+    cache = MediaCache(directory=str(tmp_path / "cache"))
+    targets = _targets(tmp_path, [".mp4", ".png", "_sarcasm.png"])
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, targets, cache, "sha1-bundle")
+    assert bucket.requests == [None]
+    _assert_files(targets)
+
+
+def test_some_members_use_ranges(tmp_path, bucket):
+    cache = MediaCache(directory=str(tmp_path / "cache"))
+    targets = _targets(tmp_path, ["_sarcasm.png", ".png"])
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, targets, cache, "sha1-bundle")
+    # Голова с индексом и по диапазону на каждый член
+    assert len(bucket.requests) == 3 and None not in bucket.requests
+    _assert_files(targets)
+
+
+def test_full_group_without_cache_is_one_request(tmp_path, bucket):
+    targets = {suffix: io.BytesIO() for suffix in MEMBERS}
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, targets, None)
+    assert bucket.requests == [None]
+    for suffix, target in targets.items():
+        assert target.getvalue() == MEMBERS[suffix]
+
+
+def test_large_member_is_fetched_in_ranges_with_offset(tmp_path, bucket, monkeypatch):
+    monkeypatch.setattr(b2_download, "B2_RANGE_MIN_SIZE", 100_000)
+    monkeypatch.setattr(b2_download, "B2_RANGE_PART_SIZE", 64 * 1024)
+    targets = _targets(tmp_path, [".mp4"])
+    _fetch_bundle_sync(bucket, BUNDLE_KEY, targets, None)
+    # Голова с индексом и четыре части видео
+    assert len(bucket.requests) == 1 + 4
+    _assert_files(targets)
+    assert not os.path.exists(targets[".mp4"] + ".part")
+
+
+def test_short_range_response_is_rejected(bucket):
+    index = fetch_bundle_members(bucket, BUNDLE_KEY, {})
+    original = bucket.download_file_by_name
+    bucket.download_file_by_name = lambda name, range_=None: _Download(original(name, range_).data[:-1])
+    with pytest.raises(BundleError):
+        fetch_bundle_members(bucket, BUNDLE_KEY, {".png": io.BytesIO()}, index=index)
@@ -0,0 +1,82 @@
+import os
+import random
+import struct
+import sys
+import zlib
+from array import array
+
+import pytest
+
+# Общие модули из scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+from gen_id_set import GenIdSet, gen_id_to_minutes, minutes_to_gen_id
+
+
+def _random_ids(count, seed=0):
+    rng = random.Random(seed)
+    return {f"{rng.randint(2000, 2099):04d}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}-"
+            f"{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}" for _ in range(count)}
+
+
+def test_encode_decode_round_trip():
+    ids = _random_ids(5000) | {"legacy-id", "20250101-1200", "20000101-0000"}
+    original = GenIdSet(ids)
+    decoded = GenIdSet.from_bytes(original.to_bytes())
+    assert set(decoded) == ids
+    assert len(decoded) == len(ids)
+    assert decoded.to_bytes() == original.to_bytes()
+
+
+def test_added_ids_survive_encoding():
+    base, added = sorted(_random_ids(2000, seed=1)), sorted(_random_ids(500, seed=2))
+    ids = GenIdSet(base[:1000])
+    for gen_id in base[1000:] + added + ["not-a-gen-id"]:
+        ids.add(gen_id)
+    ids.add(added[0])
+    expected = set(base) | set(added) | {"not-a-gen-id"}
+    assert all(gen_id in ids for gen_id in expected)
+    assert len(ids) == len(expected)
+    assert set(GenIdSet.from_bytes(ids.to_bytes())) == expected
+    assert list(ids)[:len(expected) - 1] == sorted(expected - {"not-a-gen-id"})
+
+
+def test_empty_set_round_trip():
+    assert len(GenIdSet.from_bytes(GenIdSet().to_bytes())) == 0
+
+
+def test_unpublished():
+    published = GenIdSet(["20250101-1200", "20250102-1200", "odd"])
+    candidates = ["20250101-1200", "20250103-1200", "odd", "other"]
+    assert published.unpublished(candidates) == {"20250103-1200", "other"}
+    assert candidates - published == {"20250103-1200", "other"}
+
+
+@pytest.mark.parametrize("gen_id", ["20240229-2359", "20000101-0000", "20991231-1234"])
+def test_minutes_round_trip(gen_id):
+    assert minutes_to_gen_id(gen_id_to_minutes(gen_id)) == gen_id
+
+
+@pytest.mark.parametrize("gen_id", ["20230229-1200", "20251301-1200", "20250101-2400",
+                                    "20250101-1260", "19991231-2359", "2025010-11200", None])
+def test_invalid_gen_ids(gen_id):
+    assert gen_id_to_minutes(gen_id) is None
+
+
+def _sidecar(count, extras, deltas):
+    raw_deltas = array("I", deltas)
+    if sys.byteorder == "big":
+        raw_deltas.byteswap()
+    return struct.pack("<4sII", b"PID1", count, len(extras)) + extras + zlib.compress(raw_deltas.tobytes())
+
+
+@pytest.mark.parametrize("raw", [
+    b"",
+    b"XXXX" + bytes(8),
+    GenIdSet(["20250101-1200"]).to_bytes()[:-2],
+    _sidecar(2, b"[]", [0xFFFFFFFF, 5]),          # сумма дельт больше 32 бит
+    _sidecar(0, b'["a", "b"]', [])[:14],          # обрезаны нестандартные ID
+    _sidecar(0, b'{"a": 1}', []),                 # нестандартные ID не списком
+])
+def test_corrupted_sidecar_raises(raw):
+    with pytest.raises(ValueError):
+        GenIdSet.from_bytes(raw)
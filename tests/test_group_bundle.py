@@ -0,0 +1,75 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+# Общие модули из scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+from group_bundle import BundleError, BundleSplitter, pack_group, unpack_bytes
+
+MEMBERS = {
+    ".mp4": os.urandom(300_000),
+    ".json": b'{"content": "\xd1\x82\xd0\xb5\xd0\xba\xd1\x81\xd1\x82"}',
+    ".png": os.urandom(5_000),
+    "_sarcasm.png": b"",
+}
+
+
+def _pack(members):
+    out = io.BytesIO()
+    index = pack_group("20250101-1200", members, out)
+    return out.getvalue(), index
+
+
+def test_pack_then_unpack_bytes():
+    raw, index = _pack(MEMBERS)
+    assert unpack_bytes(raw) == MEMBERS
+    for suffix, member in index.items():
+        assert raw[member["offset"]:member["offset"] + member["size"]] == MEMBERS[suffix]
+        assert member["sha1"] == hashlib.sha1(MEMBERS[suffix]).hexdigest()
+
+
+def test_file_members_pack_like_bytes():
+    raw, index = _pack(MEMBERS)
+    file_raw, file_index = _pack({suffix: io.BytesIO(data) for suffix, data in MEMBERS.items()})
+    assert file_raw == raw
+    assert file_index == index
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 20])
+def test_splitter_streams_members_to_targets(chunk_size):
+    raw, index = _pack(MEMBERS)
+    targets = {".mp4": io.BytesIO(), ".json": io.BytesIO(), "_sarcasm.png": io.BytesIO()}
+    splitter = BundleSplitter(targets)
+    for start in range(0, len(raw), chunk_size):
+        splitter.write(raw[start:start + chunk_size])
+    splitter.close()
+    assert splitter.index == index
+    for suffix, target in targets.items():
+        assert target.getvalue() == MEMBERS[suffix]
+
+
+def test_splitter_rejects_truncated_bundle():
+    raw, _index = _pack(MEMBERS)
+    splitter = BundleSplitter({})
+    splitter.write(raw[:-10])
+    with pytest.raises(BundleError):
+        splitter.close()
+
+
+def test_corrupted_member_is_detected():
+    raw, index = _pack(MEMBERS)
+    damaged = bytearray(raw)
+    damaged[index[".png"]["offset"]] ^= 0xFF
+    with pytest.raises(BundleError):
+        unpack_bytes(bytes(damaged))
+    with pytest.raises(BundleError):
+        BundleSplitter({}).write(bytes(damaged))
+
+
+def test_unknown_magic_is_rejected():
+    raw, _index = _pack(MEMBERS)
+    with pytest.raises(BundleError):
+        unpack_bytes(b"XXXX" + raw[4:])
@@ -0,0 +1,131 @@
+import io
+import os
+import struct
+import sys
+
+import pytest
+
+# Общие модули из scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+import mp4_faststart
+from mp4_faststart import Mp4Error, make_faststart, probe, remux_faststart, video_send_kwargs
+
+CHUNKS = [os.urandom(1000), os.urandom(1500), os.urandom(700)]
+
+
+def box(kind, payload):
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def full_box(kind, payload, version=0):
+    return box(kind, bytes([version, 0, 0, 0]) + payload)
+
+
+def moov(offsets, wide=False):
+    mvhd = full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 12345) + bytes(80))
+    tkhd = full_box(b"tkhd", bytes(72) + struct.pack(">II", 1280 << 16, 720 << 16))
+    hdlr = full_box(b"hdlr", bytes(4) + b"vide" + bytes(13))
+    if wide:
+        table = full_box(b"co64", struct.pack(">I", len(offsets)) + b"".join(struct.pack(">Q", o) for o in offsets))
+    else:
+        table = full_box(b"stco", struct.pack(">I", len(offsets)) + b"".join(struct.pack(">I", o) for o in offsets))
+    stbl = box(b"stbl", table)
+    mdia = box(b"mdia", hdlr + box(b"minf", stbl))
+    return box(b"moov", mvhd + box(b"trak", tkhd + mdia))
+
+
+FTYP = box(b"ftyp", b"isom" + bytes(4) + b"isommp41")
+
+
+def moov_at_end(wide=False):
+    """ftyp | mdat(CHUNKS) | moov | free — moov после mdat, как у неподготовленных файлов."""
+    first = len(FTYP) + 8
+    offsets = [first + sum(len(chunk) for chunk in CHUNKS[:i]) for i in range(len(CHUNKS))]
+    mdat = box(b"mdat", b"".join(CHUNKS))
+    return FTYP + mdat + moov(offsets, wide) + box(b"free", b"xx")
+
+
+def chunk_offsets(data):
+    for kind, fmt, width in ((b"stco", ">I", 4), (b"co64", ">Q", 8)):
+        position = data.find(kind)
+        if position != -1:
+            count = struct.unpack_from(">I", data, position + 8)[0]
+            return kind, [struct.unpack_from(fmt, data, position + 12 + width * i)[0] for i in range(count)]
+    raise AssertionError("нет таблицы смещений")
+
+
+def top_level_kinds(data):
+    kinds, offset = [], 0
+    while offset < len(data):
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        kinds.append(kind)
+        offset += size
+    return kinds
+
+
+@pytest.mark.parametrize("wide", [False, True])
+def test_remux_moves_moov_and_keeps_chunk_offsets(wide):
+    source = moov_at_end(wide)
+    out = io.BytesIO()
+    info = remux_faststart(io.BytesIO(source), out)
+    result = out.getvalue()
+
+    assert info.remuxed and info.faststart
+    assert len(result) == len(source)
+    assert top_level_kinds(result) == [b"ftyp", b"moov", b"mdat", b"free"]
+    kind, offsets = chunk_offsets(result)
+    assert kind == (b"co64" if wide else b"stco")
+    for offset, chunk in zip(offsets, CHUNKS):
+        assert result[offset:offset + len(chunk)] == chunk
+    assert probe(io.BytesIO(result)) == info._replace(remuxed=False)
+
+
+def test_stco_promoted_to_co64_when_shifted_offset_overflows(monkeypatch):
+    # Файл больше 4 ГБ здесь не собрать: граница stco понижается так, чтобы ее перешли
+    # сдвинутые смещения, но не исходные
+    source = moov_at_end()
+    _kind, original = chunk_offsets(source)
+    monkeypatch.setattr(mp4_faststart, "_STCO_MAX_OFFSET", max(original) + 1)
+    out = io.BytesIO()
+    remux_faststart(io.BytesIO(source), out)
+    result = out.getvalue()
+
+    kind, offsets = chunk_offsets(result)
+    assert kind == b"co64"
+    moov_size = struct.unpack_from(">I", result, len(FTYP))[0]
+    assert offsets == [offset + moov_size for offset in original]
+    assert len(result) == len(source) + 4 * len(offsets)
+    for offset, chunk in zip(offsets, CHUNKS):
+        assert result[offset:offset + len(chunk)] == chunk
+
+
+def test_video_info_and_send_kwargs():
+    info = probe(io.BytesIO(moov_at_end()))
+    assert not info.faststart
+    assert (info.duration, info.width, info.height) == (12.345, 1280, 720)
+    assert video_send_kwargs(info) == {"duration": 12, "width": 1280, "height": 720}
+    assert video_send_kwargs(None) == {}
+
+
+def test_make_faststart_rewrites_file_once(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(moov_at_end())
+    assert make_faststart(str(path)).remuxed
+    remuxed = path.read_bytes()
+    assert top_level_kinds(remuxed)[1] == b"moov"
+    assert not make_faststart(str(path)).remuxed
+    assert path.read_bytes() == remuxed
+    assert [p.name for p in tmp_path.iterdir()] == ["video.mp4"]
+
+
+@pytest.mark.parametrize("data", [
+    moov_at_end()[:-20],                  # обрезан хвост
+    b"garbage" * 10,                      # не MP4
+    FTYP + box(b"mdat", b"".join(CHUNKS)),  # нет moov
+])
+def test_malformed_files_raise(tmp_path, data):
+    path = tmp_path / "broken.mp4"
+    path.write_bytes(data)
+    with pytest.raises(Mp4Error):
+        make_faststart(str(path))
+    assert path.read_bytes() == data
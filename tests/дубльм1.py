@@ -1,8 +1,13 @@
 import os
+import sys
 import json
+import hashlib
+import threading
 import boto3
 
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -14,6 +19,13 @@ load_dotenv(dotenv_path)
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "data", "downloaded")
 
+# Общие модули из scripts/
+sys.path.insert(0, os.path.join(BASE_DIR, "scripts"))
+from b2_scan import (SCAN_FOLDERS, SCAN_CONCURRENCY, B2_FULL_RESCAN, GEN_ID_PATTERN, dump_scan_cursor,
+                     is_settled, parse_scan_cursor)
+from media_cache import MediaCache, cache_key
+from post_record import normalize_post
+
 # Создание папки для скачивания
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
@@ -30,8 +42,23 @@ load_dotenv()
 PROCESSED_DIR = "data/processed"
 LOG_FILE = "logs/operation_log.txt"
 
-# Папки для поиска готовых групп
-SEARCH_FOLDERS = ["444/", "555/", "666/"]
+# Папки для поиска готовых групп (общая настройка B2_SCAN_FOLDERS)
+SEARCH_FOLDERS = SCAN_FOLDERS
+
+# Общий со scripts/ кэш медиа: повторная загрузка группы не тратит трафик B2
+media_cache = MediaCache()
+
+# Режим зеркала: потоки на файлы, параметры multipart-скачивания boto3
+MIRROR_WORKERS = int(os.getenv("MIRROR_WORKERS", "8"))
+MIRROR_MULTIPART_THRESHOLD = int(os.getenv("MIRROR_MULTIPART_THRESHOLD_MB", "16")) * 1024 * 1024
+MIRROR_MULTIPART_CHUNKSIZE = int(os.getenv("MIRROR_MULTIPART_CHUNKSIZE_MB", "16")) * 1024 * 1024
+MIRROR_MAX_CONCURRENCY = int(os.getenv("MIRROR_MAX_CONCURRENCY", "4"))
+# ETag уже скачанных файлов (для multipart-объектов ETag не равен MD5 содержимого)
+MIRROR_STATE_FILE = os.path.join(DOWNLOAD_DIR, ".mirror_etags.json")
+# Собственные курсоры поиска групп .json+.mp4: config/scan_cursor.json сдвигается
+# по правилам B2_Content_Download (4 файла, журнал публикаций) и здесь не подходит
+GROUP_CURSOR_FILE = os.path.join(DOWNLOAD_DIR, ".group_scan_cursor.json")
+READY_EXTENSIONS = {".json", ".mp4"}
 
 # Настройки B2 из переменных окружения
 ENDPOINT = os.getenv("S3_ENDPOINT")
@@ -61,28 +88,114 @@ def create_b2_client():
         log_message(f"Ошибка подключения к B2: {e}")
         raise
 
-# Скачивание файлов из B2
+def iter_objects(client, **list_kwargs):
+    """Все объекты листинга с учетом пагинации (list_objects_v2 отдает не больше 1000 ключей)."""
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, **list_kwargs):
+        yield from page.get('Contents', [])
+
+
+def _load_mirror_state():
+    try:
+        with open(MIRROR_STATE_FILE, "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_mirror_state(state):
+    tmp_path = MIRROR_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, MIRROR_STATE_FILE)
+
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_up_to_date(local_path, obj, state):
+    """Локальная копия совпадает с объектом: тот же размер и тот же ETag (записанный или MD5)."""
+    if not os.path.exists(local_path) or os.path.getsize(local_path) != obj['Size']:
+        return False
+    etag = obj.get('ETag', "").strip('"')
+    if state.get(obj['Key']) == etag:
+        return True
+    # ETag обычного (не multipart) объекта — MD5 содержимого
+    return bool(etag) and "-" not in etag and _file_md5(local_path) == etag
+
+
+# Скачивание файлов из B2 (режим зеркала)
 def download_files(client, prefix=""):
+    """
+    Синхронизирует DOWNLOAD_DIR с объектами .json/.mp4/.png под prefix.
+    Листинг постраничный, файлы скачиваются в пуле из MIRROR_WORKERS потоков,
+    крупные — частями по TransferConfig. Файлы с совпадающими размером и ETag
+    пропускаются, поэтому повторная синхронизация докачивает только новое.
+    """
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-    try:
-        response = client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=prefix)
-        if 'Contents' not in response:
-            log_message("Нет файлов для скачивания.")
-            return
+    transfer_config = TransferConfig(
+        multipart_threshold=MIRROR_MULTIPART_THRESHOLD,
+        multipart_chunksize=MIRROR_MULTIPART_CHUNKSIZE,
+        max_concurrency=MIRROR_MAX_CONCURRENCY,
+    )
+    state = _load_mirror_state()
+    state_lock = threading.Lock()
+
+    def download_one(obj):
+        key = obj['Key']
+        local_path = os.path.join(DOWNLOAD_DIR, os.path.basename(key))
+        log_message(f"Сохранение файла в: {local_path}")
+        client.download_file(BUCKET_NAME, key, local_path, Config=transfer_config)
+        with state_lock:
+            state[key] = obj.get('ETag', "").strip('"')
+        log_message(f"Скачан файл: {key}")
+        return obj['Size']
 
-        for obj in response['Contents']:
+    try:
+        to_download = []
+        found = skipped = 0
+        for obj in iter_objects(client, Prefix=prefix):
             key = obj['Key']
             # Фильтруем файлы
-            if key.endswith((".json", ".mp4", ".png")):
-                local_path = os.path.join(DOWNLOAD_DIR, os.path.basename(key))
-                log_message(f"Сохранение файла в: {local_path}")
-                client.download_file(BUCKET_NAME, key, local_path)
-                log_message(f"Скачан файл: {key}")
-            else:
+            if not key.endswith((".json", ".mp4", ".png")):
                 log_message(f"Пропущен файл: {key}")
-
+                continue
+            found += 1
+            if _is_up_to_date(os.path.join(DOWNLOAD_DIR, os.path.basename(key)), obj, state):
+                skipped += 1
+                state[key] = obj.get('ETag', "").strip('"')
+                continue
+            to_download.append(obj)
     except (BotoCoreError, ClientError) as e:
         log_message(f"Ошибка скачивания из B2: {e}")
+        return
+
+    if not found:
+        log_message("Нет файлов для скачивания.")
+        return
+
+    downloaded_bytes = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, MIRROR_WORKERS)) as executor:
+            futures = {executor.submit(download_one, obj): obj['Key'] for obj in to_download}
+            for future in as_completed(futures):
+                try:
+                    downloaded_bytes += future.result()
+                except (BotoCoreError, ClientError, OSError) as e:
+                    log_message(f"Ошибка скачивания {futures[future]} из B2: {e}")
+                except Exception as e:
+                    # Ошибка одного файла не должна останавливать остальные загрузки
+                    log_message(f"Непредвиденная ошибка при скачивании {futures[future]}: {e}")
+    finally:
+        # ETag уже скачанных файлов сохраняются даже при прерывании, иначе их скачают снова
+        _save_mirror_state(state)
+    log_message(f"Зеркало: {found} файлов, уже актуальны {skipped}, скачано {len(to_download)} "
+                f"({downloaded_bytes / 1024 / 1024:.1f} МБ).")
 
 # Обработка JSON
 def process_json_file(json_path):
@@ -96,15 +209,14 @@ def process_json_file(json_path):
             log_message(f"Файл {json_path} пропущен: отсутствуют обязательные поля.")
             return
 
-        # Форматирование текста
-        title = f"<b>{data['title']}</b>"
-        content = data['content']
-        post_text = f"{title}\n\n{content}"
+        # Форматирование текста — общая нормализация записи поста (scripts/post_record.py)
+        record = normalize_post(data, os.path.splitext(os.path.basename(json_path))[0])
 
         # Сохранение обработанных данных
         processed_path = os.path.join(PROCESSED_DIR, os.path.basename(json_path))
         with open(processed_path, "w", encoding="utf-8") as output_file:
-            json.dump({"text": post_text, "poll": data.get("poll")}, output_file, indent=4, ensure_ascii=False)
+            json.dump({"text": record["caption"], "poll": record["poll"], "record": record},
+                      output_file, indent=4, ensure_ascii=False)
         log_message(f"Обработан файл: {json_path}")
 
     except Exception as e:
@@ -160,25 +272,88 @@ def update_config_in_b2(client, folder):
     except (BotoCoreError, ClientError) as e:
         log_message(f"Ошибка при загрузке {config_key} в B2: {e}")
 
+def _load_group_cursor():
+    """Курсоры find_ready_group по папкам; при B2_FULL_RESCAN или ошибке — пустой словарь."""
+    if B2_FULL_RESCAN:
+        return {}
+    try:
+        with open(GROUP_CURSOR_FILE, "rb") as cursor_file:
+            return parse_scan_cursor(cursor_file.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_group_cursor(cursor):
+    tmp_path = GROUP_CURSOR_FILE + ".tmp"
+    with open(tmp_path, "wb") as cursor_file:
+        cursor_file.write(dump_scan_cursor(cursor))
+    os.replace(tmp_path, GROUP_CURSOR_FILE)
+
+
+def _next_group_cursor(files, previous):
+    """
+    Новый курсор папки: самая ранняя группа, которая готова (.json и .mp4) или
+    еще может догрузиться (моложе B2_SCAN_INCOMPLETE_GRACE_HOURS). Если таких
+    нет — последняя увиденная. Курсор никогда не сдвигается назад.
+    """
+    now = datetime.now()
+    gen_ids = [name for name in files if GEN_ID_PATTERN.fullmatch(name)]
+    pending = [name for name in gen_ids if READY_EXTENSIONS <= files[name] or not is_settled(name, now)]
+    candidate = min(pending) if pending else max(gen_ids, default=previous)
+    if previous and candidate and candidate < previous:
+        return previous
+    return candidate
+
+
+def _list_folder_groups(client, folder, start_gen_id=None):
+    """Листинг одной папки (с курсора, если он есть): возвращает {имя группы: множество расширений}."""
+    list_kwargs = {"Prefix": folder}
+    if start_gen_id:
+        # StartAfter исключает сам ключ, но "444/ID" < "444/ID.json", поэтому группа курсора попадает в листинг
+        list_kwargs["StartAfter"] = f"{folder}{start_gen_id}"
+
+    files = {}
+    for obj in iter_objects(client, **list_kwargs):
+        key = obj['Key']
+        name, ext = os.path.splitext(os.path.basename(key))
+        if ext in READY_EXTENSIONS:
+            files.setdefault(name, set()).add(ext)
+    return files
+
+
 def find_ready_group(client):
     """
-    Ищет первую подходящую группу файлов с одинаковым generation_id (.json и .mp4) в папках 444/, 555/, 666/.
+    Ищет первую подходящую группу файлов с одинаковым generation_id (.json и .mp4) в папках SEARCH_FOLDERS.
+    Папки листингуются параллельно (не больше SCAN_CONCURRENCY одновременно), каждая — со своего
+    курсора из GROUP_CURSOR_FILE: до него нет ни готовых групп, ни свежих неполных.
     """
-    for folder in ["444/", "555/", "666/"]:
-        response = client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=folder)
-        if 'Contents' not in response:
+    cursor = _load_group_cursor()
+    with ThreadPoolExecutor(max_workers=max(1, min(SCAN_CONCURRENCY, len(SEARCH_FOLDERS)))) as executor:
+        futures = {
+            folder: executor.submit(_list_folder_groups, client, folder, cursor.get(folder))
+            for folder in SEARCH_FOLDERS
+        }
+
+    listed = {}
+    for folder in SEARCH_FOLDERS:
+        try:
+            listed[folder] = futures[folder].result()
+        except (BotoCoreError, ClientError) as e:
+            log_message(f"Ошибка листинга папки {folder}: {e}")
             continue
+        next_cursor = _next_group_cursor(listed[folder], cursor.get(folder))
+        if next_cursor:
+            cursor[folder] = next_cursor
+    try:
+        _save_group_cursor(cursor)
+    except OSError as e:
+        log_message(f"Не удалось сохранить курсоры поиска групп: {e}")
 
-        files = {}
-        for obj in response['Contents']:
-            key = obj['Key']
-            name, ext = os.path.splitext(os.path.basename(key))
-            if ext in (".json", ".mp4"):
-                files.setdefault(name, set()).add(ext)
-
+    # Порядок папок сохраняется: первая папка с готовой группой имеет приоритет
+    for folder, files in listed.items():
         # Проверяем, есть ли подходящие группы
         for name, extensions in files.items():
-            if {".json", ".mp4"} <= extensions:
+            if READY_EXTENSIONS <= extensions:
                 log_message(f"Найдена группа файлов: {name} в папке {folder}")
                 return folder, name  # Возвращаем папку и имя группы
 
@@ -218,6 +393,7 @@ def update_config_in_b2(client, folder):
 def download_group(client, folder, group_name):
     """
     Скачивает группу файлов (.json и .mp4) из указанной папки.
+    Файлы берутся из кэша медиа по id версии файла в B2 (VersionId в S3 API).
     """
     group_files = [f"{folder}{group_name}.json", f"{folder}{group_name}.mp4"]
     os.makedirs(DOWNLOAD_DIR, exist_ok=True)
@@ -226,8 +402,12 @@ def download_group(client, folder, group_name):
         try:
             local_path = os.path.join(DOWNLOAD_DIR, os.path.basename(file_key))
             log_message(f"Сохранение файла в: {local_path}")
-            client.download_file(BUCKET_NAME, file_key, local_path)
-            log_message(f"Скачан файл: {file_key}")
+            head = client.head_object(Bucket=BUCKET_NAME, Key=file_key)
+            if media_cache.fetch(cache_key(file_id=head.get("VersionId")), local_path,
+                                 lambda f: client.download_fileobj(BUCKET_NAME, file_key, f)):
+                log_message(f"Файл {file_key} взят из кэша медиа.")
+            else:
+                log_message(f"Скачан файл: {file_key}")
         except Exception as e:
             log_message(f"Ошибка скачивания файла {file_key}: {e}")
 
@@ -246,6 +426,9 @@ def main():
     else:
         log_message("Готовая группа не найдена.")
 
+    log_message(f"Кэш медиа: {media_cache.stats()}.")
+    media_cache.evict()
+
     log_message("Скрипт завершил выполнение.")
 
 if __name__ == "__main__":